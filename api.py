@@ -1,31 +1,106 @@
+import asyncio
+import copy
+import os
 from typing import Union
 
 import aiohttp
-import requests
 from aiohttp.client_exceptions import ContentTypeError
 
 from errors import BadRequestError
-from settings import API_HOST, API_KEY
+from settings import (API_CONNECT_TIMEOUT, API_HOST, API_KEEPALIVE_TIMEOUT, API_KEY, API_POOL_LIMIT,
+                      API_POOL_LIMIT_PER_HOST, API_READ_TIMEOUT, USER_CACHE_SIZE, USER_CACHE_TTL)
+from utils.cache import TTLCache
 from utils.logger import logger
+from utils.metrics import metrics
 
 
 class API:
+    def __init__(self):
+        self._session = None
+        self.users_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+        self._cached_telegram_ids = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+        self._users_cache_generation = 0
+        self._in_flight_gets = {}
+        self.get_requests = 0
+        self.coalesced_gets = 0
+
+    async def start(self):
+        await self._get_session()
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=API_POOL_LIMIT,
+                limit_per_host=API_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=API_KEEPALIVE_TIMEOUT,
+            )
+            timeout = aiohttp.ClientTimeout(total=None, connect=API_CONNECT_TIMEOUT, sock_read=API_READ_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers={"Token": API_KEY})
+        return self._session
+
+    def pool_stats(self) -> dict:
+        if self._session is None or self._session.closed:
+            return {"in_use": 0, "idle": 0, "waiting": 0, "limit": API_POOL_LIMIT}
+        connector = self._session.connector
+        return {
+            "in_use": len(getattr(connector, "_acquired", ())),
+            "idle": sum(len(conns) for conns in getattr(connector, "_conns", {}).values()),
+            "waiting": sum(len(waiters) for waiters in getattr(connector, "_waiters", {}).values()),
+            "limit": connector.limit,
+        }
+
+    def request_stats(self) -> dict:
+        return {
+            "get_requests": self.get_requests,
+            "coalesced_gets": self.coalesced_gets,
+            "in_flight_gets": len(self._in_flight_gets),
+        }
+
     async def _call_api(
-        self, address, method: Union["get", "post", "patch", "delete"] = "get", _json=None, data=None, content_type=None
+        self,
+        address,
+        method: Union["get", "post", "patch", "delete"] = "get",
+        _json=None,
+        data=None,
+        content_type=None,
+        coalesce=True,
     ):
+        """
+        Identical GET requests made while one is in flight wait for it instead of going out again.
+        """
+        if method != "get" or not coalesce:
+            return await self._request(address, method, _json, data, content_type)
+
+        self.get_requests += 1
+        future = self._in_flight_gets.get(address)
+        if future is not None:
+            self.coalesced_gets += 1
+            return copy.deepcopy(await asyncio.shield(future))
+
+        future = self._in_flight_gets[address] = asyncio.ensure_future(self._request(address))
+        future.add_done_callback(lambda _: self._in_flight_gets.pop(address, None))
+        return await asyncio.shield(future)
+
+    async def _request(self, address, method="get", _json=None, data=None, content_type=None):
         url = API_HOST + address
-        headers = {"Token": API_KEY}
+        headers = {}
         if content_type:
             headers["Content-Type"] = content_type
 
-        async with aiohttp.ClientSession() as session:
-            if content_type == "multipart/form-data" and method == "post":
-                with aiohttp.MultipartWriter("mixed") as mpwriter:
-                    mpwriter.append(data["file"].raw, {"Content-Type": "multipart/form-data"})
-                    resp = await session.post(url, headers=headers, data=mpwriter)
-            else:
-                resp = await getattr(session, method)(url, headers=headers, json=_json)
+        session = await self._get_session()
+        if content_type == "multipart/form-data" and method == "post":
+            mpwriter = aiohttp.MultipartWriter("mixed")
+            mpwriter.append(data["file"].raw, {"Content-Type": "multipart/form-data"})
+            request = session.post(url, headers=headers, data=mpwriter)
+        else:
+            request = session.request(method.upper(), url, headers=headers, json=_json)
 
+        async with request as resp:
             if resp.status == 403:
                 data = await resp.json()
                 raise BadRequestError(data.get("detail", ""))
@@ -45,10 +120,10 @@ class API:
             return j
 
     async def get_updates(self):
-        return await self._call_api("/updates")
+        return await self._call_api("/updates", coalesce=False)
 
     async def get_control_updates(self):
-        return await self._call_api("/control-updates")
+        return await self._call_api("/control-updates", coalesce=False)
 
     async def get_all_telegram_ids(self):
         return await self._call_api("/all_telegram_ids")
@@ -79,6 +154,23 @@ class API:
         else:
             raise ValueError("telegram_id or user_id must be provided")
 
+    async def get_cached_user(self, telegram_id):
+        user = self.users_cache.get(telegram_id)
+        if user is None:
+            generation = self._users_cache_generation
+            user = await self.get_user(telegram_id=telegram_id)
+            # an invalidation during the request means the fetched profile may already be outdated
+            if generation == self._users_cache_generation:
+                self.users_cache.set(telegram_id, user)
+                self._cached_telegram_ids.set(user["id"], telegram_id)
+        return copy.deepcopy(user)
+
+    def invalidate_user(self, user_id):
+        self._users_cache_generation += 1
+        telegram_id = self._cached_telegram_ids.pop(user_id)
+        if telegram_id is not None:
+            self.users_cache.pop(telegram_id)
+
     async def get_user_info(self, nickname):
         return await self._call_api(f"/user-info/{nickname}")
 
@@ -309,7 +401,10 @@ class API:
             "allow_super_buy": allow_super_buy,
             "lang": lang
         }
-        return await self._call_api(f"/user", method="patch", _json=data)
+        try:
+            return await self._call_api(f"/user", method="patch", _json=data)
+        finally:
+            self.invalidate_user(user_id)
 
     async def change_balance(self, user_id, admin_id, amount, with_operation=False):
         data = {"to_user_id": user_id, "admin_id": admin_id, "amount": amount, "with_operation": with_operation}
@@ -416,35 +511,27 @@ class API:
     async def error(self, *, text, telegram_id):
         return await self._call_api(f"/error", method="post", _json={"text": text, "telegram_id": telegram_id})
 
-    async def upload_photo(self, user_id, photo, content_type):
+    async def upload_photo(self, user_id, photo, content_type, filename=None):
+        """
+        Upload a file object or an async iterable of byte chunks as multipart form data,
+        streamed through the shared session.
+        """
         url = API_HOST + f"/user/{user_id}/media"
         if content_type:
             url += f'?content_type={content_type}'
-        headers = {"Token": API_KEY}
-        res = requests.post(url, files={"file": photo}, headers=headers)
-
-        if res.status_code == 400:
-            data = res.json()
-            raise BadRequestError(data.get("detail", ""), 400)
-        res.raise_for_status()
-        return res.json()
-
-    def send_transaction_sync(self, user_id, amount, address, with_proxy=False, token=None):
-        url = API_HOST + "/send-transaction"
-        headers = {"Token": API_KEY}
-        res = requests.post(
-            url,
-            headers=headers,
-            json={
-                "user_id": user_id,
-                "amount": float(amount),
-                "address": address,
-                "with_proxy": with_proxy,
-                "token": token,
-            },
-        )
-        res.raise_for_status()
-        return res.json()
+        form = aiohttp.FormData()
+        form.add_field("file", photo, filename=filename or os.path.basename(photo.name))
+
+        session = await self._get_session()
+        async with session.post(url, data=form) as resp:
+            if resp.status == 400:
+                data = await resp.json()
+                raise BadRequestError(data.get("detail", ""), 400)
+            resp.raise_for_status()
+            return await resp.json()
 
 
 api = API()
+metrics.register("api_pool", api.pool_stats)
+metrics.register("api_requests", api.request_stats)
+metrics.register("users_cache", api.users_cache.stats)
@@ -0,0 +1,469 @@
+"""
+Stand-in for the backend API, serving fixture data with configurable latency, errors and payload size.
+
+    python -m bench.fake_api --port 5555 --latency 0.02 --jitter 0.01 --error-rate 0.01
+
+Point the bot at it with `TEST=1 API_HOST=http://127.0.0.1:5555` (API_HOST is only read in test mode).
+Request counts per route are served at /_stats and reset with DELETE /_stats.
+Every GET endpoint of api.py has a route backed by bench.fixtures; anything else is logged, a GET answers 404
+and other methods answer {"ok": true}.
+"""
+import argparse
+import asyncio
+import random
+from collections import Counter
+
+from aiohttp import web
+
+from bench.fixtures import REPORT_FIELDS, Fixtures
+from utils.logger import logger
+
+
+class FakeApi:
+    def __init__(
+        self,
+        fixtures: Fixtures,
+        *,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        pad_bytes=0,
+        updates_per_poll=0,
+        seed=1,
+    ):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.pad_bytes = pad_bytes
+        self.updates_per_poll = updates_per_poll
+        self.random = random.Random(seed)
+        self.requests = Counter()
+        self.errors = Counter()
+        self.masks = {}
+        self.usermessage_bans = set()
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.middleware])
+        app.add_routes(
+            [
+                web.get("/_stats", self.stats),
+                web.delete("/_stats", self.reset_stats),
+                web.get("/settings", self.settings),
+                web.get("/currencies", self.currencies),
+                web.get("/brokers", self.brokers),
+                web.get("/rate", self.rate),
+                web.get("/commission", self.commission),
+                web.get("/updates", self.updates),
+                web.get("/control-updates", self.control_updates),
+                web.get("/all_telegram_ids", self.all_telegram_ids),
+                web.get("/user", self.user_by_telegram_id),
+                web.patch("/user", self.update_user),
+                web.get("/user/{user_id}", self.user),
+                web.get("/user-info/{nickname}", self.user_info),
+                web.get("/user-exists", self.user_exists),
+                web.get("/user-exists/{nickname}", self.user_exists_nickname),
+                web.post("/new-user", self.new_user),
+                web.get("/user-stat/{user_id}", self.user_stat),
+                web.get("/affiliate/{user_id}", self.affiliate),
+                web.get("/wallet/{user_id}", self.wallet),
+                web.post("/create-wallet-if-not-exists", self.ok),
+                web.get("/bind-status/{user_id}", self.bind_status),
+                web.get("/usermessages-ban-status/{target_id}", self.usermessages_ban_status),
+                web.patch("/usermessages-ban-status", self.set_usermessages_ban_status),
+                web.get("/address-validation/{address}", self.address_validation),
+                web.get("/last-requisites/{broker}", self.last_requisites),
+                web.get("/active-promocodes-count/{user_id}", self.zero_count),
+                web.get("/active-promocodes/{user_id}", self.empty_list),
+                web.get("/lots/{t}", self.lots),
+                web.get("/broker-lots/{t}", self.broker_lots),
+                web.get("/lot/{identificator}", self.lot),
+                web.patch("/lot", self.update_lot),
+                web.delete("/lot", self.delete_lot),
+                web.get("/user-lots/{user_id}", self.user_lots),
+                web.post("/new-lot", self.new_lot),
+                web.get("/active-deals/{user_id}", self.active_deals),
+                web.get("/active-deals-count/{user_id}", self.active_deals_count),
+                web.get("/deal/{deal_id}", self.deal),
+                web.get("/deal/{deal_id}/mask", self.mask),
+                web.post("/deal/{deal_id}/mask", self.set_mask),
+                web.post("/new-deal", self.new_deal),
+                web.get("/dispute/{deal_id}", self.dispute),
+                web.get("/payment-info/{operation_id}", self.merchant_operation),
+                web.get("/payment-v2-info/{operation_id}", self.merchant_operation),
+                web.get("/sale-info/{operation_id}", self.merchant_operation),
+                web.get("/sale_v2-info/{operation_id}", self.merchant_operation),
+                web.get("/cpayment-info/{operation_id}", self.merchant_operation),
+                web.get("/withdrawal-info/{operation_id}", self.merchant_operation),
+                web.get("/profit", self.profit),
+                web.get("/frozen-all", self.frozen_all),
+                web.get("/finreport", self.finreport),
+                web.get("/transit/{user_id}", self.transit),
+                web.get("/reports/{user_id}", self.user_reports),
+                web.get("/reports-all/{t}", self.reports),
+                web.get("/node-transaction/{tx_hash}", self.node_transaction),
+                web.route("*", "/{tail:.*}", self.fallback),
+            ]
+        )
+        return app
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        route = request.match_info.route.resource.canonical
+        if route == "/_stats":
+            return await handler(request)
+        if route == "/{tail}":
+            route = request.path
+        self.requests[f"{request.method} {route}"] += 1
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors[f"{request.method} {route}"] += 1
+            return web.json_response({"detail": "injected failure"}, status=500)
+        return await handler(request)
+
+    def respond(self, data, status=200) -> web.Response:
+        """
+        JSON response padded with an ignored field so every object is about `pad_bytes` bigger.
+        """
+        if self.pad_bytes:
+            if isinstance(data, dict):
+                data = {**data, "_padding": "x" * self.pad_bytes}
+            elif isinstance(data, list):
+                data = [{**item, "_padding": "x" * self.pad_bytes} if isinstance(item, dict) else item for item in data]
+        return web.json_response(data, status=status)
+
+    @staticmethod
+    def not_found(what) -> web.Response:
+        return web.json_response({"detail": f"{what} not found"}, status=404)
+
+    def _user(self, user_id):
+        return self.fixtures.users.get(int(user_id))
+
+    async def stats(self, request):
+        return web.json_response(
+            {
+                "total": sum(self.requests.values()),
+                "errors": sum(self.errors.values()),
+                "requests": dict(self.requests.most_common()),
+                "injected_errors": dict(self.errors.most_common()),
+            }
+        )
+
+    async def reset_stats(self, request):
+        self.requests.clear()
+        self.errors.clear()
+        return web.json_response({"ok": True})
+
+    async def ok(self, request):
+        return self.respond({"ok": True})
+
+    async def zero_count(self, request):
+        return self.respond({"count": 0})
+
+    async def empty_list(self, request):
+        return self.respond([])
+
+    async def fallback(self, request):
+        if request.method == "GET":
+            logger.warning(f"Fake API has no data for {request.path_qs}")
+            return self.not_found(request.path)
+        return self.respond({"ok": True})
+
+    async def settings(self, request):
+        return self.respond(self.fixtures.settings())
+
+    async def currencies(self, request):
+        return self.respond(self.fixtures.currencies())
+
+    async def brokers(self, request):
+        currency = request.query.get("currency")
+        brokers = [broker for broker in self.fixtures.brokers if currency is None or broker["currency"] == currency]
+        return self.respond(brokers)
+
+    async def rate(self, request):
+        return self.respond(self.fixtures.rate(request.query["currency"]))
+
+    async def commission(self, request):
+        return self.respond({"commission": 0.0001, "dynamic_commissions": []})
+
+    async def all_telegram_ids(self, request):
+        return self.respond(list(self.fixtures.users_by_telegram_id))
+
+    async def user_by_telegram_id(self, request):
+        user = self.fixtures.users_by_telegram_id.get(int(request.query["telegram_id"]))
+        return self.respond(user) if user else self.not_found("user")
+
+    async def user(self, request):
+        user = self._user(request.match_info["user_id"])
+        return self.respond(user) if user else self.not_found("user")
+
+    async def update_user(self, request):
+        data = await request.json()
+        user = self._user(data.pop("user_id"))
+        if user is None:
+            return self.not_found("user")
+        user.update({key: value for key, value in data.items() if value is not None})
+        return self.respond(user)
+
+    async def user_info(self, request):
+        nickname = request.match_info["nickname"]
+        user = next((user for user in self.fixtures.users.values() if user["nickname"] == nickname), None)
+        if user is None:
+            return self.not_found("user")
+        return self.respond({**user, **self.fixtures.user_stat(user["id"])})
+
+    async def user_exists(self, request):
+        return self.respond({"exists": int(request.query["telegram_id"]) in self.fixtures.users_by_telegram_id})
+
+    async def user_exists_nickname(self, request):
+        nickname = request.match_info["nickname"]
+        return self.respond({"exists": any(user["nickname"] == nickname for user in self.fixtures.users.values())})
+
+    async def new_user(self, request):
+        telegram_id = int(request.query["telegram_id"])
+        user = self.fixtures.users_by_telegram_id.get(telegram_id) or self.fixtures.new_user(telegram_id)
+        return self.respond(user)
+
+    async def user_stat(self, request):
+        user_id = int(request.match_info["user_id"])
+        if user_id not in self.fixtures.users:
+            return self.not_found("user")
+        return self.respond(self.fixtures.user_stat(user_id))
+
+    async def affiliate(self, request):
+        user_id = request.match_info["user_id"]
+        return self.respond(
+            {"invited_count": 0, "earned_from_ref": 0, "earned_from_ref_currency": 0, "ref_code": f"ref{user_id}"}
+        )
+
+    async def wallet(self, request):
+        user_id = int(request.match_info["user_id"])
+        if user_id not in self.fixtures.users:
+            return self.not_found("wallet")
+        return self.respond(self.fixtures.wallet(user_id))
+
+    async def bind_status(self, request):
+        return self.respond({"status": False})
+
+    async def usermessages_ban_status(self, request):
+        key = (int(request.query["user_id"]), int(request.match_info["target_id"]))
+        return self.respond({"is_baned": key in self.usermessage_bans})
+
+    async def set_usermessages_ban_status(self, request):
+        data = await request.json()
+        key = (data["user_id"], data["target_user_id"])
+        if data["status"]:
+            self.usermessage_bans.add(key)
+        else:
+            self.usermessage_bans.discard(key)
+        return self.respond({"ok": True})
+
+    async def address_validation(self, request):
+        return self.respond({"is_valid": len(request.match_info["address"]) >= 26})
+
+    async def last_requisites(self, request):
+        return self.respond(["5536 9137 1234 5678"])
+
+    async def lots(self, request):
+        return self.respond(self.fixtures.market(request.match_info["t"], request.query.get("currency", "rub")))
+
+    async def broker_lots(self, request):
+        user_id = int(request.query["user_id"])
+        lots = self.fixtures.broker_lots(request.query["broker"], request.match_info["t"])
+        return self.respond([self.fixtures.lot_for(lot, user_id) for lot in lots if lot["is_active"]])
+
+    async def lot(self, request):
+        lot = self.fixtures.lots.get(request.match_info["identificator"])
+        return self.respond(lot) if lot else self.not_found("lot")
+
+    async def update_lot(self, request):
+        data = await request.json()
+        lot = self.fixtures.lots.get(data.pop("identificator"))
+        if lot is None:
+            return self.not_found("lot")
+        data.pop("user_id", None)
+        activity_status = data.pop("activity_status", None)
+        if activity_status is not None:
+            lot["is_active"] = activity_status
+        lot.update({key: value for key, value in data.items() if value is not None})
+        return self.respond(lot)
+
+    async def delete_lot(self, request):
+        data = await request.json()
+        lot = self.fixtures.lots.get(data["identificator"])
+        if lot is None:
+            return self.not_found("lot")
+        lot["is_deleted"] = True
+        lot["is_active"] = False
+        return self.respond({"ok": True})
+
+    async def user_lots(self, request):
+        return self.respond(self.fixtures.user_lots(int(request.match_info["user_id"])))
+
+    async def new_lot(self, request):
+        data = await request.json()
+        broker = next((broker for broker in self.fixtures.brokers if broker["id"] == data["broker"]), None)
+        if broker is None:
+            return self.not_found("broker")
+        lot = self.fixtures.new_lot(
+            data["user_id"],
+            data["type"],
+            broker,
+            rate=data["rate"],
+            coefficient=data.get("coefficient"),
+            limit_from=data["limit_from"],
+            limit_to=data["limit_to"],
+        )
+        return self.respond(lot)
+
+    async def active_deals(self, request):
+        return self.respond(self.fixtures.user_deals(int(request.match_info["user_id"])))
+
+    async def active_deals_count(self, request):
+        return self.respond({"count": len(self.fixtures.user_deals(int(request.match_info["user_id"])))})
+
+    async def deal(self, request):
+        deal = self.fixtures.deals.get(request.match_info["deal_id"])
+        return self.respond(deal) if deal else self.not_found("deal")
+
+    async def mask(self, request):
+        return self.respond({"mask": self.masks.get(request.match_info["deal_id"])})
+
+    async def set_mask(self, request):
+        self.masks[request.match_info["deal_id"]] = (await request.json())["mask"]
+        return self.respond({"ok": True})
+
+    async def new_deal(self, request):
+        data = await request.json()
+        if data["lot_id"] not in self.fixtures.lots:
+            return self.not_found("lot")
+        deal = self.fixtures.new_deal(
+            data["user_id"],
+            data["lot_id"],
+            state="proposed",
+            rate=data["rate"],
+            amount=data["amount"],
+            amount_currency=data["amount_currency"],
+            requisite=data["requisite"],
+        )
+        return self.respond(deal)
+
+    async def dispute(self, request):
+        deal = self.fixtures.deals.get(request.match_info["deal_id"])
+        if deal is None or not deal["dispute_exists"]:
+            return self.not_found("dispute")
+        return self.respond({"deal_id": deal["identificator"], "initiator": deal["buyer"]["id"], "opponent": None})
+
+    async def merchant_operation(self, request):
+        return self.respond(self.fixtures.merchant_operation(request.match_info["operation_id"]))
+
+    async def profit(self, request):
+        return self.respond(self.fixtures.profit())
+
+    async def frozen_all(self, request):
+        return self.respond(self.fixtures.frozen_all())
+
+    async def finreport(self, request):
+        return self.respond(self.fixtures.finreport())
+
+    async def transit(self, request):
+        return self.respond(self.fixtures.transit(int(request.match_info["user_id"])))
+
+    async def user_reports(self, request):
+        user_id = int(request.match_info["user_id"])
+        if user_id not in self.fixtures.users:
+            return self.not_found("user")
+        return self.respond(self.fixtures.user_reports(user_id))
+
+    async def reports(self, request):
+        t = request.match_info["t"]
+        if t not in REPORT_FIELDS:
+            return self.not_found(f"report {t}")
+        return self.respond(self.fixtures.report(t))
+
+    async def node_transaction(self, request):
+        return self.respond(self.fixtures.node_transaction(request.match_info["tx_hash"]))
+
+    def _synthetic_updates(self) -> dict:
+        """
+        Random message, income and deal updates in the shape of /updates.
+        """
+        updates = {
+            "deals": {
+                "timeouts": [],
+                "referrals": [],
+                "deals": [],
+                "cancel": [],
+                "disputes": [],
+                "dispute_notifications": [],
+                "closed_disputes": [],
+            },
+            "messages": [],
+            "new-referral": [],
+            "transactions": [],
+            "accounts_join": [],
+            "promocodes": [],
+            "usermessages": [],
+            "earnings": [],
+            "secondary_node": [],
+        }
+        users = list(self.fixtures.users)
+        deals = list(self.fixtures.deals.values())
+        for _ in range(self.updates_per_poll):
+            kind = self.random.choice(("message", "transaction", "deal", "deal", "timeout", "cancel"))
+            if kind == "message":
+                sender_id, receiver_id = self.random.sample(users, 2)
+                updates["messages"].append(
+                    {"sender_id": sender_id, "receiver_id": receiver_id, "message": "Привет", "media_url": None}
+                )
+            elif kind == "transaction":
+                updates["transactions"].append(
+                    {"user_id": self.random.choice(users), "type": "in", "amount": 0.001, "link": None}
+                )
+            else:
+                deal = self.random.choice(deals)
+                user_id, opponent_id = deal["buyer"]["id"], deal["seller"]["id"]
+                update = {"user_id": user_id, "opponent": opponent_id, "deal_id": deal["identificator"]}
+                category = {"deal": "deals", "timeout": "timeouts", "cancel": "cancel"}[kind]
+                updates["deals"][category].append(update)
+        return updates
+
+    async def updates(self, request):
+        return self.respond(self._synthetic_updates())
+
+    async def control_updates(self, request):
+        return self.respond([])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake backend API for benchmarks and offline tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--symbol", default="btc", choices=("btc", "eth", "usdt"))
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--lots-per-broker", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +- seconds around the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 500")
+    parser.add_argument("--pad-bytes", type=int, default=0, help="extra bytes added to every returned object")
+    parser.add_argument("--updates-per-poll", type=int, default=0, help="synthetic updates returned by /updates")
+    args = parser.parse_args()
+
+    fixtures = Fixtures(symbol=args.symbol, users=args.users, lots_per_broker=args.lots_per_broker, seed=args.seed)
+    fake_api = FakeApi(
+        fixtures,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        pad_bytes=args.pad_bytes,
+        updates_per_poll=args.updates_per_poll,
+        seed=args.seed,
+    )
+    web.run_app(fake_api.app(), host=args.host, port=args.port, access_log=None, print=logger.info)
+
+
+if __name__ == "__main__":
+    main()
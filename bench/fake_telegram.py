@@ -0,0 +1,285 @@
+"""
+Stand-in for the Telegram Bot API with Telegram's flood limits.
+
+Updates are queued with push_message/push_callback and handed to the bot through getUpdates long polling.
+Messages sent by the bot are kept per chat, so callback queries can be made from their inline keyboards.
+Sends over the per chat, per group or global limit are answered with 429 and retry_after, like Telegram does.
+
+    python -m bench.fake_telegram --port 8081
+
+Point the bot at it with `TEST=1 TELEGRAM_API_HOST=http://127.0.0.1:8081`.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import time
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+from utils.logger import logger
+
+SEND_METHODS = {"sendMessage", "sendDocument", "sendPhoto", "editMessageText", "editMessageReplyMarkup"}
+BOT_USER = {"id": 777000, "is_bot": True, "first_name": "Bench bot", "username": "bench_bot"}
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Take a token; return 0 on success or the seconds until one is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class FakeTelegram:
+    def __init__(self, *, chat_rate=1, chat_burst=3, group_rate=20 / 60, group_burst=3, global_rate=30):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        self._updates = []
+        self._new_updates = None
+        self.delivered_at = {}
+        self.messages = defaultdict(dict)
+        self._waiters = defaultdict(list)
+        self.polling = None
+        self.calls = Counter()
+        self.throttled = Counter()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.on_startup.append(self._on_startup)
+        app.add_routes([web.get("/_stats", self.stats), web.post("/bot{token}/{method}", self.handle)])
+        return app
+
+    async def _on_startup(self, app):
+        self._new_updates = asyncio.Event()
+        self.polling = asyncio.Event()
+
+    async def stats(self, request):
+        return web.json_response({"calls": dict(self.calls), "throttled": dict(self.throttled)})
+
+    # updates from users
+
+    def _push(self, update) -> int:
+        update_id = update["update_id"] = next(self._update_ids)
+        self._updates.append(update)
+        self._new_updates.set()
+        return update_id
+
+    @staticmethod
+    def _user(telegram_id, lang):
+        return {"id": telegram_id, "is_bot": False, "first_name": f"User {telegram_id}", "language_code": lang}
+
+    def push_message(self, telegram_id, text, lang="ru") -> int:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": telegram_id, "type": "private"},
+            "from": self._user(telegram_id, lang),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self._push({"message": message})
+
+    def push_callback(self, telegram_id, message, data, lang="ru") -> int:
+        callback_query = {
+            "id": str(next(self._callback_ids)),
+            "from": self._user(telegram_id, lang),
+            "message": message,
+            "chat_instance": str(telegram_id),
+            "data": data,
+        }
+        return self._push({"callback_query": callback_query})
+
+    def last_inline_message(self, chat_id):
+        """
+        The latest bot message in the chat that has an inline keyboard.
+        """
+        for message in reversed(self.messages[chat_id].values()):
+            if "inline_keyboard" in message.get("reply_markup", {}):
+                return message
+        return None
+
+    def wait_response(self, chat_id) -> asyncio.Future:
+        """
+        Future resolved with (method, message, monotonic time) on the next message sent or edited in the chat.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id].append(future)
+        return future
+
+    def _notify(self, chat_id, method, message):
+        now = time.monotonic()
+        for future in self._waiters.pop(chat_id, ()):
+            if not future.done():
+                future.set_result((method, message, now))
+
+    # Bot API
+
+    @staticmethod
+    def ok(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def error(code, description, **parameters) -> web.Response:
+        data = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            data["parameters"] = parameters
+        return web.json_response(data, status=code)
+
+    def _bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _flood_wait(self, chat_id) -> float:
+        return self._bucket(chat_id).take() or self.global_bucket.take()
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] += 1
+        if method in SEND_METHODS:
+            chat_id = int(params["chat_id"])
+            wait = self._flood_wait(chat_id)
+            if wait:
+                self.throttled[method] += 1
+                retry_after = math.ceil(wait)
+                return self.error(429, f"Too Many Requests: retry after {retry_after}", retry_after=retry_after)
+        handler = getattr(self, f"api_{method}", None)
+        if handler is None:
+            return self.ok(True)
+        return await handler(params)
+
+    async def api_getMe(self, params):
+        return self.ok(BOT_USER)
+
+    async def api_getWebhookInfo(self, params):
+        return self.ok({"url": "", "has_custom_certificate": False, "pending_update_count": len(self._updates)})
+
+    async def api_getUpdates(self, params):
+        self.polling.set()
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 100))
+        timeout = float(params.get("timeout", 0))
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        updates = self._updates[:limit]
+        now = time.monotonic()
+        for update in updates:
+            self.delivered_at.setdefault(update["update_id"], now)
+        return self.ok(updates)
+
+    def _store(self, chat_id, params, **fields) -> dict:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": BOT_USER,
+            **fields,
+        }
+        if params.get("reply_markup"):
+            message["reply_markup"] = json.loads(params["reply_markup"])
+        self.messages[chat_id][message["message_id"]] = message
+        return message
+
+    async def api_sendMessage(self, params):
+        chat_id = int(params["chat_id"])
+        message = self._store(chat_id, params, text=params["text"])
+        self._notify(chat_id, "sendMessage", message)
+        return self.ok(message)
+
+    async def _send_file(self, params, kind):
+        chat_id = int(params["chat_id"])
+        file = params[kind]
+        size = len(file.file.read()) if isinstance(file, web.FileField) else 0
+        content = {"file_id": f"{kind}-{chat_id}", "file_unique_id": f"{kind}-{chat_id}", "file_size": size}
+        message = self._store(chat_id, params, **{kind: [content] if kind == "photo" else content})
+        self._notify(chat_id, f"send{kind.title()}", message)
+        return self.ok(message)
+
+    async def api_sendDocument(self, params):
+        return await self._send_file(params, "document")
+
+    async def api_sendPhoto(self, params):
+        return await self._send_file(params, "photo")
+
+    async def _edit(self, params, method, **fields):
+        chat_id = int(params["chat_id"])
+        message = self.messages[chat_id].get(int(params["message_id"]))
+        if message is None:
+            return self.error(400, "Bad Request: message to edit not found")
+        markup = json.loads(params["reply_markup"]) if params.get("reply_markup") else None
+        if all(message.get(key) == value for key, value in fields.items()) and message.get("reply_markup") == markup:
+            return self.error(
+                400,
+                "Bad Request: message is not modified: specified new message content and reply markup are exactly "
+                "the same as a current content and reply markup of the message",
+            )
+        message.update(fields)
+        if markup is None:
+            message.pop("reply_markup", None)
+        else:
+            message["reply_markup"] = markup
+        self._notify(chat_id, method, message)
+        return self.ok(message)
+
+    async def api_editMessageText(self, params):
+        return await self._edit(params, "editMessageText", text=params["text"])
+
+    async def api_editMessageReplyMarkup(self, params):
+        return await self._edit(params, "editMessageReplyMarkup")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--chat-rate", type=float, default=1, help="messages per second in a private chat")
+    parser.add_argument("--chat-burst", type=float, default=3)
+    parser.add_argument("--group-rate", type=float, default=20, help="messages per minute in a group")
+    parser.add_argument("--global-rate", type=float, default=30, help="messages per second over all chats")
+    args = parser.parse_args()
+
+    fake_telegram = FakeTelegram(
+        chat_rate=args.chat_rate,
+        chat_burst=args.chat_burst,
+        group_rate=args.group_rate / 60,
+        global_rate=args.global_rate,
+    )
+    web.run_app(fake_telegram.app(), host=args.host, port=args.port, access_log=None, print=logger.info)
+
+
+if __name__ == "__main__":
+    main()
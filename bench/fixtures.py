@@ -0,0 +1,331 @@
+import random
+from datetime import datetime, timedelta
+
+CURRENCIES = ("rub", "usd", "uah", "kzt")
+BROKERS = ("Sberbank", "Tinkoff", "Qiwi", "Yandex", "Monobank", "Privat", "Kaspi", "Payeer")
+RATES = {
+    "btc": {"rub": 2_450_000, "usd": 30_500, "uah": 1_120_000, "kzt": 13_700_000},
+    "eth": {"rub": 165_000, "usd": 2_050, "uah": 75_000, "kzt": 920_000},
+    "usdt": {"rub": 81, "usd": 1, "uah": 37, "kzt": 450},
+}
+DEAL_STATES = ("proposed", "confirmed", "paid", "closed", "deleted")
+# columns of /reports-all/<type>, as the admin report screens write them
+REPORT_FIELDS = {
+    "deals": ("id", "lot", "amount", "crypto", "created", "end", "status", "buyer", "seller", "income"),
+    "promocodes": ("code", "amount", "count", "activations", "deleted", "created", "user"),
+    "lots": ("id", "created_at", "broker", "rate", "user", "created", "active", "coefficient"),
+    "exchange": (
+        "id", "created_at", "nickname", "from_symbol", "to_symbol", "rate", "amount_sent", "amount_received",
+        "commission",
+    ),
+    "users": ("nickname", "lang", "telegram_id", "created", "deleted", "baned", "verify", "rating"),
+    "transactions": (
+        "type", "to_address", "commission", "tx_hash", "created_at", "processed_at", "amount", "is_confirmed",
+        "is_deleted",
+    ),
+    "income": ("date", "transactions_income", "deals_income", "merchants_income", "total_income"),
+    "merchants": ("date", "merchants_income"),
+    "control": (
+        "id", "buyer", "buyer_email", "seller", "state", "requisite", "created_at", "end_time", "amount_currency",
+        "payment_id", "sell_id", "ip",
+    ),
+    "campaigns": ("id", "name", "registrations", "deals", "deals_revenue"),
+}
+
+
+class Fixtures:
+    """
+    Deterministic backend data shaped like the real API responses.
+    The same seed always gives the same users, lots and deals.
+    """
+
+    def __init__(self, symbol="btc", users=1000, lots_per_broker=30, deals_per_user=3, seed=1):
+        self.symbol = symbol
+        self.random = random.Random(seed)
+        self.users = {}
+        self.users_by_telegram_id = {}
+        self.lots = {}
+        self.deals = {}
+        self._broker_lots = {}
+        self._user_deals = {}
+        self.brokers = [
+            {"id": f"{name.lower()}-{currency}", "name": name, "currency": currency}
+            for currency in CURRENCIES
+            for name in BROKERS
+        ]
+        for _ in range(users):
+            self.new_user(telegram_id=100_000 + len(self.users) + 1)
+        for broker in self.brokers:
+            for t in ("buy", "sell"):
+                for _ in range(lots_per_broker):
+                    self.new_lot(self.random.choice(list(self.users)), t, broker)
+        for user_id in self.users:
+            for _ in range(deals_per_user):
+                self.new_deal(user_id, self.random.choice(list(self.lots)))
+
+    def settings(self) -> dict:
+        return {
+            "symbol": self.symbol,
+            "coin_name": {"btc": "Bitcoin", "eth": "Ethereum", "usdt": "Tether"}[self.symbol],
+            "control_chat": -1001,
+            "messages_chat": -1002,
+            "profits_chat": -1003,
+            "earnings_chat": -1004,
+            "deal_control_chat": -1005,
+            "commission": 0.0005,
+            "dispute_time": 30,
+            "min_tx_amount": 0.0005,
+            "base_deal_time": 15,
+            "advanced_deal_time": 90,
+            "currencies": [{"id": currency, "rate_variation": 0.3} for currency in CURRENCIES],
+        }
+
+    def currencies(self) -> list:
+        return [{"id": currency} for currency in CURRENCIES]
+
+    def rate(self, currency) -> float:
+        return RATES[self.symbol].get(currency, 1)
+
+    def new_user(self, telegram_id, **kwargs) -> dict:
+        user_id = len(self.users) + 1
+        user = {
+            "id": user_id,
+            "telegram_id": telegram_id,
+            "nickname": f"user{user_id}",
+            "lang": self.random.choice(("ru", "en")),
+            "currency": self.random.choice(CURRENCIES),
+            "is_admin": False,
+            "is_baned": False,
+            "shadow_ban": False,
+            "is_verify": self.random.random() < 0.2,
+            "rating": self.random.randint(0, 500),
+            "sky_pay": False,
+            "allow_sell": True,
+            "allow_sale_v2": False,
+            "allow_super_buy": False,
+            "super_verify_only": False,
+            "apply_shadow_ban": False,
+            "balance": round(self.random.uniform(0, 2), 8),
+            "frozen": 0,
+            **kwargs,
+        }
+        self.users[user_id] = user
+        self.users_by_telegram_id[telegram_id] = user
+        return user
+
+    def user_stat(self, user_id) -> dict:
+        user = self.users[user_id]
+        return {
+            "deals": self.random.randint(0, 300),
+            "deposited": round(self.random.uniform(0, 10), 8),
+            "withdrawn": round(self.random.uniform(0, 10), 8),
+            "revenue": round(self.random.uniform(0, 1_000_000), 2),
+            "days_registered": self.random.randint(1, 1500),
+            "likes": self.random.randint(0, 300),
+            "dislikes": self.random.randint(0, 10),
+            "rating": user["rating"],
+            "rating_logo": "🐳" if user["rating"] > 250 else "🐟",
+        }
+
+    def wallet(self, user_id) -> dict:
+        user = self.users[user_id]
+        return {
+            "balance": user["balance"],
+            "frozen": user["frozen"],
+            "balance_currency": round(user["balance"] * self.rate(user["currency"]), 2),
+            "address": f"bc1q{user_id:038d}",
+            "last_address": None,
+            "is_active": True,
+            "withdrawal_limit": 10,
+        }
+
+    def new_lot(self, user_id, t, broker, **kwargs) -> dict:
+        identificator = f"L{len(self.lots) + 1:07d}"
+        rate = round(self.rate(broker["currency"]) * self.random.uniform(0.97, 1.05), 2)
+        limit_from = self.random.choice((500, 1000, 5000))
+        lot = {
+            "identificator": identificator,
+            "user_id": user_id,
+            "type": t,
+            "symbol": self.symbol,
+            "currency": broker["currency"],
+            "broker": broker["name"],
+            "broker_id": broker["id"],
+            "rate": rate,
+            "coefficient": None,
+            "limit_from": limit_from,
+            "limit_to": limit_from * self.random.randint(2, 50),
+            "details": self.random.choice(("", "Только перевод по номеру карты", "Fast payment")),
+            "is_active": True,
+            "is_deleted": False,
+            "is_online": self.random.random() < 0.6,
+            "is_verify": self.users[user_id]["is_verify"],
+            "owner": False,
+            **kwargs,
+        }
+        self.lots[identificator] = lot
+        self._broker_lots.setdefault((broker["id"], t), []).append(lot)
+        return lot
+
+    def lot_for(self, lot, user_id) -> dict:
+        return {**lot, "owner": lot["user_id"] == user_id}
+
+    def broker_lots(self, broker_id, t) -> list:
+        return self._broker_lots.get((broker_id, t), [])
+
+    def market(self, t, currency) -> list:
+        brokers = [broker for broker in self.brokers if broker["currency"] == currency]
+        result = []
+        for broker in brokers:
+            lots = self.broker_lots(broker["id"], t)
+            rates = [lot["rate"] for lot in lots]
+            best = (max(rates) if t == "sell" else min(rates)) if rates else 0
+            result.append({"broker": {"id": broker["id"], "name": broker["name"]}, "rate": best, "cnt": len(lots)})
+        return result
+
+    def new_deal(self, user_id, lot_id, **kwargs) -> dict:
+        lot = self.lots[lot_id]
+        buyer_id, seller_id = (lot["user_id"], user_id) if lot["type"] == "buy" else (user_id, lot["user_id"])
+        amount_currency = self.random.randint(lot["limit_from"], lot["limit_to"])
+        created = datetime.utcnow() - timedelta(minutes=self.random.randint(0, 60))
+        deal = {
+            "identificator": f"D{len(self.deals) + 1:09d}",
+            "symbol": self.symbol,
+            "type": 0,
+            "state": self.random.choice(DEAL_STATES[:3]),
+            "lot": {key: lot[key] for key in ("identificator", "type", "broker", "currency", "user_id")},
+            "buyer": self._party(buyer_id),
+            "seller": self._party(seller_id),
+            "amount": round(amount_currency / lot["rate"], 8),
+            "amount_currency": amount_currency,
+            "rate": lot["rate"],
+            "currency": lot["currency"],
+            "broker": lot["broker"],
+            "requisite": "5536 9137 1234 5678",
+            "created": created.isoformat(),
+            "end_time": (created + timedelta(minutes=15)).isoformat(),
+            "payment_id": None,
+            "payment_v2_id": None,
+            "merchant": None,
+            "dispute_exists": False,
+            "buyer_commission": 0,
+            "seller_commission": 0,
+            "buyer_email": None,
+            **kwargs,
+        }
+        self.deals[deal["identificator"]] = deal
+        for party_id in {buyer_id, seller_id}:
+            self._user_deals.setdefault(party_id, []).append(deal)
+        return deal
+
+    def _party(self, user_id) -> dict:
+        user = self.users[user_id]
+        return {
+            "id": user_id,
+            "nickname": user["nickname"],
+            "email": None,
+            "rating": user["rating"],
+            "is_verify": user["is_verify"],
+        }
+
+    def user_deals(self, user_id, active=True) -> list:
+        deals = self._user_deals.get(user_id, [])
+        return [deal for deal in deals if not active or deal["state"] in DEAL_STATES[:3]]
+
+    def user_lots(self, user_id) -> list:
+        return [self.lot_for(lot, user_id) for lot in self.lots.values() if lot["user_id"] == user_id]
+
+    def merchant_operation(self, operation_id) -> dict:
+        """
+        A payment, sale, cpayment or withdrawal of a merchant, as the support screens show it.
+        """
+        deals = self.random.sample(list(self.deals.values()), 2)
+        return {
+            "id": operation_id,
+            "merchant": self.random.choice(list(self.users)),
+            "amount": round(self.random.uniform(0.001, 0.1), 8),
+            "is_currency_amount": False,
+            "symbol": self.symbol,
+            "currency": self.random.choice(CURRENCIES),
+            "address": f"bc1q{self.random.getrandbits(128):038x}",
+            "status": self.random.choice(("new", "paid", "expired")),
+            "deals": [{"identificator": deal["identificator"], "buyer_email": None} for deal in deals],
+        }
+
+    def profit(self) -> dict:
+        db_funds = round(sum(user["balance"] + user["frozen"] for user in self.users.values()), 8)
+        if self.symbol == "btc":
+            wallet_funds = {
+                "confirmed": round(db_funds * 1.01, 8),
+                "unconfirmed": 0,
+                "secondary": 0.5,
+                "cpayments": 0.1,
+                "deposits": round(db_funds * 2, 8),
+                "withdraws": round(db_funds, 8),
+            }
+        else:
+            wallet_funds = round(db_funds * 1.01, 8)
+        return {
+            "users": len(self.users),
+            "wallet_funds": wallet_funds,
+            "db_funds": db_funds,
+            "profit": round(db_funds * 0.01, 8),
+            "binance": 0,
+            "trx_balance": 100,
+            "imbalance": 0,
+        }
+
+    def frozen_all(self) -> list:
+        return [{"user": user_id, "frozen": user["frozen"]} for user_id, user in self.users.items() if user["frozen"]]
+
+    def finreport(self) -> dict:
+        report = {}
+        for source in ("transactions", "deals", "merchants"):
+            for interval, days in (("day", 1), ("week", 7), ("month", 30), ("year", 365)):
+                report[f"{source}_{interval}"] = round(0.002 * days, 5)
+        return report
+
+    def transit(self, user_id) -> dict:
+        return {"address": f"bc1qtransit{user_id:031d}", "pk": "0" * 64, "balance": 0}
+
+    def node_transaction(self, tx_hash) -> dict:
+        received = int((datetime.utcnow() - timedelta(hours=1)).timestamp())
+        return {"txid": tx_hash, "timereceived": received, "blocktime": received + 600, "amount": 0.01, "fee": -0.0001}
+
+    def user_reports(self, user_id) -> dict:
+        created = datetime.utcnow().isoformat()
+        deals = [
+            {"id": deal["identificator"], "amount": deal["amount"], "state": deal["state"], "created": deal["created"]}
+            for deal in self._user_deals.get(user_id, [])
+        ]
+        lots = [
+            {"id": lot["identificator"], "type": lot["type"], "rate": lot["rate"], "created": created}
+            for lot in self.user_lots(user_id)
+        ]
+        transactions = [{"tx_hash": f"{user_id:064x}", "amount": 0.01, "type": "in", "created": created}]
+        return {"lots": lots, "promocodes": [], "deals": deals, "transactions": transactions}
+
+    def report(self, t, rows=20) -> list:
+        """
+        Rows of /reports-all/<t> with made-up values of the right type for every column.
+        """
+        now = datetime.utcnow()
+        result = []
+        for i in range(1, rows + 1):
+            user = self.users[self.random.choice(list(self.users))]
+            row = {}
+            for field in REPORT_FIELDS[t]:
+                if field in ("created", "created_at", "end", "end_time", "processed_at", "date"):
+                    row[field] = (now - timedelta(hours=i)).isoformat()
+                elif field in ("deleted", "baned", "verify", "active", "is_confirmed", "is_deleted"):
+                    row[field] = False
+                elif field in ("user", "buyer", "seller", "nickname"):
+                    row[field] = user["nickname"]
+                elif field in ("id", "count", "activations", "registrations", "deals", "rating", "telegram_id"):
+                    row[field] = i
+                elif field in ("lot", "code", "name", "type", "state", "status", "broker", "lang", "ip"):
+                    row[field] = f"{field}{i}"
+                else:
+                    row[field] = round(self.random.uniform(0, 1), 8)
+            result.append(row)
+        return result
@@ -0,0 +1,108 @@
+"""
+Cost of journaling /updates batches before they are processed.
+
+Batches shaped like the fake API's updates are appended and acknowledged, with and without fsync,
+and the time per batch, per item and per acknowledgement is reported. The result depends on the disk,
+so run it on the volume the journal lives on.
+
+    python -m bench.journal --dir /code/journal --batches 500
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from bench.fixtures import Fixtures
+from utils.journal import Journal
+
+
+def make_items(fixtures, rng, size) -> list:
+    users = list(fixtures.users)
+    deals = list(fixtures.deals.values())
+    items = []
+    for _ in range(size):
+        if rng.random() < 0.3:
+            sender_id, receiver_id = rng.sample(users, 2)
+            update = {"sender_id": sender_id, "receiver_id": receiver_id, "message": "Привет", "media_url": None}
+            items.append(("messages", update))
+        else:
+            deal = rng.choice(deals)
+            update = {"user_id": deal["buyer"]["id"], "opponent": deal["seller"]["id"], "deal_id": deal["identificator"]}
+            items.append(("deals.deals", update))
+    return items
+
+
+async def measure(path, batches, fsync, compact_bytes) -> dict:
+    journal = Journal(path, fsync=fsync, compact_bytes=compact_bytes)
+    journal.open()
+    append_times = []
+    ack_time = 0
+    acks = 0
+    for items in batches:
+        started = time.perf_counter()
+        entries = await journal.append(items)
+        append_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for seq, _, _ in entries:
+            journal.ack(seq)
+        await asyncio.sleep(0)
+        ack_time += time.perf_counter() - started
+        acks += len(entries)
+    stats = journal.stats()
+    journal.close()
+
+    items = sum(map(len, batches))
+    append_times.sort()
+    return {
+        "append_ms_p50": round(statistics.median(append_times) * 1000, 3),
+        "append_ms_p99": round(append_times[int(len(append_times) * 0.99)] * 1000, 3),
+        "us_per_item": round(sum(append_times) / items * 1e6, 2),
+        "us_per_ack": round(ack_time / acks * 1e6, 2),
+        "compactions": stats["compactions"],
+    }
+
+
+async def run(directory, batch_sizes, count, compact_bytes) -> dict:
+    fixtures = Fixtures()
+    rng = random.Random(1)
+    results = {}
+    for size in batch_sizes:
+        batches = [make_items(fixtures, rng, size) for _ in range(count)]
+        for fsync in (False, True):
+            path = os.path.join(directory, f"bench_{size}_{int(fsync)}.ndjson")
+            try:
+                results[f"batch={size} fsync={'on' if fsync else 'off'}"] = await measure(
+                    path, batches, fsync, compact_bytes
+                )
+            finally:
+                if os.path.exists(path):
+                    os.remove(path)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update journal benchmark")
+    parser.add_argument("--dir", help="directory for the journal files (a temporary one by default)")
+    parser.add_argument("--batches", type=int, default=300, help="batches appended per case")
+    parser.add_argument("--batch-size", type=int, action="append", help="items per batch (repeatable)")
+    parser.add_argument("--compact-bytes", type=int, default=1 << 20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        results = asyncio.run(run(directory, args.batch_size or [1, 10, 100], args.batches, args.compact_bytes))
+
+    width = max(map(len, results))
+    for name, result in results.items():
+        print(
+            f"{name:<{width}}  append p50 {result['append_ms_p50']:>7.3f} ms  p99 {result['append_ms_p99']:>7.3f} ms"
+            f"  {result['us_per_item']:>7.2f} us/item  {result['us_per_ack']:>5.2f} us/ack"
+            f"  {result['compactions']} compactions"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+End-to-end load test: N simulated users walk through real flows against a running bot.
+
+The fake Telegram API runs inside this process; the backend is bench/fake_api.py. Start both servers, then the bot:
+
+    python -m bench.fake_api --port 5555 --latency 0.02
+    python -m bench.load_test --users 200 --duration 120 --telegram-port 8081
+    TEST=1 API_HOST=http://127.0.0.1:5555 TELEGRAM_API_HOST=http://127.0.0.1:8081 python bot.py
+
+Fixture options (--users-pool, --seed) must match the ones fake_api was started with.
+Handler latency is measured from the moment the bot received an update in getUpdates
+to its first message or edit in that chat; end-to-end latency also includes the polling delay.
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+from bench.fake_telegram import FakeTelegram
+from bench.fixtures import Fixtures
+from translations import translate
+from utils.logger import logger
+
+FLOWS = ("start", "wallet", "market", "create_lot", "deal")
+
+
+class FlowAborted(Exception):
+    pass
+
+
+def percentile(values, q):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+class Recorder:
+    def __init__(self):
+        self.handler = defaultdict(list)
+        self.end_to_end = defaultdict(list)
+        self.errors = Counter()
+        self.flows = Counter()
+        self.started = time.monotonic()
+
+    def report(self, fake_telegram) -> dict:
+        elapsed = time.monotonic() - self.started
+        handler = [value for values in self.handler.values() for value in values]
+        end_to_end = [value for values in self.end_to_end.values() for value in values]
+
+        def summary(values):
+            return {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p95_ms": round(percentile(values, 95) * 1000, 1),
+                "p99_ms": round(percentile(values, 99) * 1000, 1),
+            }
+
+        return {
+            "elapsed_seconds": round(elapsed, 1),
+            "throughput_steps_per_second": round(len(handler) / elapsed, 2) if elapsed else 0,
+            "handler_latency": summary(handler),
+            "end_to_end_latency": summary(end_to_end),
+            "steps": {step: summary(values) for step, values in sorted(self.handler.items())},
+            "errors": dict(self.errors.most_common()),
+            "flows_completed": dict(self.flows),
+            "telegram_calls": dict(fake_telegram.calls),
+            "telegram_429": dict(fake_telegram.throttled),
+        }
+
+
+class VirtualUser:
+    def __init__(self, user, fixtures, fake_telegram, recorder, *, think_time, step_timeout, rnd):
+        self.user = user
+        self.telegram_id = user["telegram_id"]
+        self.lang = user["lang"]
+        self.fixtures = fixtures
+        self.fake_telegram = fake_telegram
+        self.recorder = recorder
+        self.think_time = think_time
+        self.step_timeout = step_timeout
+        self.random = rnd
+
+    def label(self, name, **kwargs):
+        return translate(f"menu_misc.{name}", locale=self.lang, **kwargs)
+
+    async def think(self):
+        await asyncio.sleep(self.random.uniform(0.5, 1.5) * self.think_time)
+
+    async def _step(self, step, update_id, response):
+        try:
+            method, message, responded_at = await asyncio.wait_for(response, self.step_timeout)
+        except asyncio.TimeoutError:
+            self.recorder.errors[f"{step}: timeout"] += 1
+            raise FlowAborted(step)
+        delivered_at = self.fake_telegram.delivered_at.get(update_id, responded_at)
+        self.recorder.handler[step].append(responded_at - delivered_at)
+        self.recorder.end_to_end[step].append(responded_at - self._pushed_at)
+        await self.think()
+        return message
+
+    async def send(self, step, text):
+        response = self.fake_telegram.wait_response(self.telegram_id)
+        self._pushed_at = time.monotonic()
+        update_id = self.fake_telegram.push_message(self.telegram_id, text, self.lang)
+        return await self._step(step, update_id, response)
+
+    async def click(self, step, pattern):
+        message = self.fake_telegram.last_inline_message(self.telegram_id)
+        buttons = [
+            button["callback_data"]
+            for row in (message or {}).get("reply_markup", {}).get("inline_keyboard", [])
+            for button in row
+            if re.match(pattern, button.get("callback_data", ""))
+        ]
+        if not buttons:
+            self.recorder.errors[f"{step}: no button"] += 1
+            raise FlowAborted(step)
+        data = self.random.choice(buttons)
+        response = self.fake_telegram.wait_response(self.telegram_id)
+        self._pushed_at = time.monotonic()
+        update_id = self.fake_telegram.push_callback(self.telegram_id, message, data, self.lang)
+        return await self._step(step, update_id, response)
+
+    async def flow_start(self):
+        await self.send("start", "/start")
+        await self.send("confirm_policy", self.label("confirm_policy"))
+
+    async def flow_wallet(self):
+        await self.send("wallet", self.label("wallet"))
+
+    async def flow_market(self):
+        await self.send("exchange", self.label("exchange", symbol=self.fixtures.symbol.upper()))
+        t = self.random.choice(("buy", "sell"))
+        await self.click("market", rf"^{t} 1$")
+        await self.click("broker_lots", rf"^lots {t} \S+ 1$")
+        await self.click("broker_lots_page", rf"^lots {t} \S+ [2-9]$")
+        await self.click("lot", r"^lot \w+$")
+
+    async def flow_create_lot(self):
+        await self.send("exchange", self.label("exchange", symbol=self.fixtures.symbol.upper()))
+        await self.click("my_lots", r"^handle_lots 1$")
+        await self.click("create_lot", r"^create_lot$")
+        t = self.random.choice(("you_wanna_buy", "you_wanna_sell"))
+        await self.send("lot_type", self.label(t, symbol=self.fixtures.symbol.upper()))
+        brokers = [broker for broker in self.fixtures.brokers if broker["currency"] == self.user["currency"]]
+        await self.send("lot_broker", self.random.choice(brokers)["name"])
+        await self.send("lot_rate", str(self.fixtures.rate(self.user["currency"])))
+        await self.send("lot_limits", "1000-50000")
+
+    async def flow_deal(self):
+        await self.send("exchange", self.label("exchange", symbol=self.fixtures.symbol.upper()))
+        await self.click("market", r"^(buy|sell) 1$")
+        await self.click("broker_lots", r"^lots (buy|sell) \S+ 1$")
+        await self.click("lot", r"^lot \w+$")
+        lot = self.fixtures.lots.get(self._offered_lot())
+        await self.click("begin_deal", r"^begin_deal \w+$")
+        await self.send("deal_sum", str(lot["limit_from"] if lot else 1000))
+        if lot and lot["type"] == "buy":
+            await self.send("deal_requisite", "5536913712345678")
+        await self.send("deal_confirm", self.label("yes"))
+
+    def _offered_lot(self):
+        message = self.fake_telegram.last_inline_message(self.telegram_id)
+        for row in (message or {}).get("reply_markup", {}).get("inline_keyboard", []):
+            for button in row:
+                match = re.match(r"^begin_deal (\w+)$", button.get("callback_data", ""))
+                if match:
+                    return match.group(1)
+        return None
+
+    async def reset(self):
+        """
+        Leave whatever state an aborted flow left the user in.
+        """
+        response = self.fake_telegram.wait_response(self.telegram_id)
+        self.fake_telegram.push_message(self.telegram_id, self.label("cancel"), self.lang)
+        try:
+            await asyncio.wait_for(response, min(self.step_timeout, 3))
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self, flows, deadline):
+        await self.run_flow("start")
+        while time.monotonic() < deadline:
+            await self.run_flow(self.random.choice(flows))
+
+    async def run_flow(self, name):
+        try:
+            await getattr(self, f"flow_{name}")()
+            self.recorder.flows[name] += 1
+        except FlowAborted:
+            await self.reset()
+        await self.think()
+
+
+async def run(args):
+    fixtures = Fixtures(symbol=args.symbol, users=args.users_pool, lots_per_broker=args.lots_per_broker, seed=args.seed)
+    fake_telegram = FakeTelegram(chat_rate=args.chat_rate, chat_burst=args.chat_burst, global_rate=args.global_rate)
+    runner = web.AppRunner(fake_telegram.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.telegram_port).start()
+    logger.info(f"Fake Telegram API on http://{args.host}:{args.telegram_port}, waiting for the bot to poll")
+    await fake_telegram.polling.wait()
+
+    rnd = random.Random(args.seed)
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration
+    users = rnd.sample(list(fixtures.users.values()), args.users)
+    flows = args.flows.split(",")
+
+    async def start_user(index, user):
+        await asyncio.sleep(args.ramp_up * index / len(users))
+        virtual_user = VirtualUser(
+            user,
+            fixtures,
+            fake_telegram,
+            recorder,
+            think_time=args.think_time,
+            step_timeout=args.step_timeout,
+            rnd=random.Random(rnd.random()),
+        )
+        await virtual_user.run(flows, deadline)
+
+    await asyncio.gather(*(start_user(index, user) for index, user in enumerate(users)))
+    report = recorder.report(fake_telegram)
+    await runner.cleanup()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test with simulated Telegram users")
+    parser.add_argument("--users", type=int, default=50, help="concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=60, help="seconds")
+    parser.add_argument("--ramp-up", type=float, default=10, help="seconds over which users join")
+    parser.add_argument("--think-time", type=float, default=1.5, help="average pause between steps")
+    parser.add_argument("--step-timeout", type=float, default=15)
+    parser.add_argument("--flows", default=",".join(FLOWS), help=f"comma separated subset of {', '.join(FLOWS)}")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--telegram-port", type=int, default=8081)
+    parser.add_argument("--chat-rate", type=float, default=1)
+    parser.add_argument("--chat-burst", type=float, default=3)
+    parser.add_argument("--global-rate", type=float, default=30)
+    parser.add_argument("--symbol", default="btc")
+    parser.add_argument("--users-pool", type=int, default=1000, help="fake_api --users")
+    parser.add_argument("--lots-per-broker", type=int, default=30, help="fake_api --lots-per-broker")
+    parser.add_argument("--seed", type=int, default=1, help="fake_api --seed")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
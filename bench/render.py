@@ -0,0 +1,190 @@
+"""
+Render micro-benchmarks for ResponseComposer and Keyboards.
+
+Every screen is rendered from fixture data in both locales; ops/sec and the peak memory
+allocated during one render are recorded. settings.py loads /settings at import, so a
+fake API is started in a background thread first.
+
+    python -m bench.render                                   # print results
+    python -m bench.render --save bench/render_baseline.json # record a new baseline
+    python -m bench.render --compare bench/render_baseline.json --threshold 0.15
+
+Compare mode exits with 1 when a screen is slower or allocates more than the threshold allows.
+Ops/sec depend on the machine, so record the baseline and compare on the same one.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+from decimal import Decimal
+
+from aiohttp import web
+
+from bench.fake_api import FakeApi
+from bench.fixtures import Fixtures
+
+LOCALES = ("ru", "en")
+
+
+def start_fake_api(fixtures) -> str:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(FakeApi(fixtures).app(), access_log=None)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return f"http://127.0.0.1:{port}"
+
+
+def screens(fixtures, rc, user) -> dict:
+    """
+    Screen name -> coroutine function rendering it for `user`, with arguments shaped like data_handler's.
+    """
+    currency = user["currency"]
+    rate = fixtures.rate(currency)
+    rates = {c: Decimal(str(fixtures.rate(c))) for c in ("rub", "usd", "uah", "kzt")}
+    stat = fixtures.user_stat(user["id"])
+    wallet = fixtures.wallet(user["id"])
+    broker = next(broker for broker in fixtures.brokers if broker["currency"] == currency)
+    broker_lots = [fixtures.lot_for(lot, user["id"]) for lot in fixtures.broker_lots(broker["id"], "buy")]
+    lot = broker_lots[0]
+    lot_user = fixtures.users[lot["user_id"]]
+    deal = next(iter(fixtures.deals.values()))
+    own_lots = [{**lot, "user_id": user["id"], "owner": True} for lot in fixtures.lots.values()][:100]
+
+    return {
+        "start": lambda: rc.start(user),
+        "wallet": lambda: rc.wallet(
+            user,
+            balance=wallet["balance"],
+            frozen=wallet["frozen"],
+            deposited=stat["deposited"],
+            withdrawn=stat["withdrawn"],
+            about=wallet["balance_currency"],
+            deal_cnt=stat["deals"],
+            revenue=stat["revenue"],
+            days_registered=stat["days_registered"],
+            likes=stat["likes"],
+            dislikes=stat["dislikes"],
+            rating=stat["rating"],
+            rating_sm=stat["rating_logo"],
+            is_bound=False,
+        ),
+        "exchange": lambda: rc.exchange(user, rate, active_deals_count=3, lots_cnt=5),
+        "market": lambda: rc.market(user, fixtures.market("buy", currency), 1, 1, rate, "buy"),
+        "broker_lots": lambda: rc.menu_lots_buy_from_broker(user, broker_lots[:10], 1, 3, broker),
+        "lot": lambda: rc.lot(user, lot, {**fixtures.user_stat(lot_user["id"]), **lot_user}, True, True, 50_000, True),
+        "self_lot": lambda: rc.self_lot(user, own_lots[0]),
+        "deal": lambda: rc.deal(user, deal, False, required_mask=False, mask=None),
+        "propose_deal": lambda: rc.propose_deal(user, deal["lot"], deal, "opponent", 15),
+        "active_deals": lambda: rc.active_deals(user, fixtures.user_deals(user["id"], active=False)),
+        "handle_lots": lambda: rc.handle_lots(user, own_lots[:10], True, rates, 1, 10),
+        "handle_lots_100": lambda: rc.handle_lots(user, own_lots, True, rates, 1, 1),
+    }
+
+
+async def measure(render, min_time) -> dict:
+    for _ in range(10):
+        await render()
+
+    ops = 0
+    started = time.perf_counter()
+    while True:
+        for _ in range(50):
+            await render()
+        ops += 50
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            break
+
+    tracemalloc.start()
+    peaks = []
+    for _ in range(20):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        await render()
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+
+    return {"ops_per_second": round(ops / elapsed, 1), "peak_bytes": sorted(peaks)[len(peaks) // 2]}
+
+
+async def run(fixtures, min_time, only=None) -> dict:
+    from response_composer import rc
+
+    results = {}
+    for lang in LOCALES:
+        user = next(user for user in fixtures.users.values() if user["lang"] == lang)
+        for name, render in screens(fixtures, rc, user).items():
+            if only and name not in only:
+                continue
+            # some renders print debug output; it is still timed, just not shown
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                results[f"{name}[{lang}]"] = await measure(render, min_time)
+    return results
+
+
+def compare(results, baseline, threshold) -> list:
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        speed = result["ops_per_second"] / base["ops_per_second"] - 1
+        memory = result["peak_bytes"] / base["peak_bytes"] - 1 if base["peak_bytes"] else 0
+        if speed < -threshold:
+            regressions.append(f"{name}: {speed:+.1%} ops/sec ({base['ops_per_second']} -> {result['ops_per_second']})")
+        if memory > threshold:
+            regressions.append(f"{name}: {memory:+.1%} peak bytes ({base['peak_bytes']} -> {result['peak_bytes']})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render micro-benchmarks")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds spent timing each screen")
+    parser.add_argument("--screen", action="append", help="only these screens (repeatable)")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed relative regression")
+    args = parser.parse_args()
+
+    fixtures = Fixtures()
+    os.environ["TEST"] = "1"
+    os.environ["API_HOST"] = start_fake_api(fixtures)
+    for name in ("BOT_TOKEN", "CONTROLLER_TOKEN", "INTERNAL_CONTROLLER_TOKEN"):
+        os.environ.setdefault(name, "123456:bench")
+    for name, value in (("API_KEY", "bench"), ("REDIS_HOST", "localhost")):
+        os.environ.setdefault(name, value)
+
+    results = asyncio.run(run(fixtures, args.min_time, args.screen))
+
+    width = max(map(len, results))
+    for name, result in results.items():
+        print(f"{name:<{width}}  {result['ops_per_second']:>10.1f} ops/s  {result['peak_bytes']:>9} B peak")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions above {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
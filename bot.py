@@ -6,18 +6,53 @@ import traceback
 from datetime import datetime, timedelta
 from io import BytesIO
 
-import requests
+import aiohttp
 from aiogram import exceptions, types
 from aiogram.types.message import ContentType
 from aiogram.utils import executor
 from aiogram.utils.exceptions import MessageNotModified
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
+from api import api
+from broadcast import broadcaster
 from constants import *
-from data_handler import dh, send_message
-from settings import Dispatcher, bot, dp, loop
+from data_handler import dh, send_message, update_journal
+from rate_feed import rate_feed
+from reference_data import reference_data
+from settings import (BOT_MODE, CONTROL_POLL_MAX_INTERVAL, LEADER_LEASE_TTL, LOOP_DEBUG, LOOP_STALL_THRESHOLD,
+                      POLL_MIN_INTERVAL, POLL_PREFETCH, RATE_REFRESH_INTERVAL, REFERENCE_DATA_REFRESH_INTERVAL, SYMBOL,
+                      UPDATES_POLL_MAX_INTERVAL, WEBHOOK_CONCURRENCY, WEBHOOK_HOST, WEBHOOK_MAX_PENDING, WEBHOOK_PATH,
+                      WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_URL, Dispatcher, bot, dp, loop, redis_general_async)
 from translations import get_trans_list, sm
-from utils.helpers import MessageMiddleware, rate_limit, save_error
+from utils.helpers import MessageMiddleware, ban_flags, rate_limit, save_error
+from utils.leader import LeaderElection
+from utils.logger import logger
+from utils.loop_monitor import LoopMonitor
+from utils.poller import AdaptivePoller
+from utils.webhook import WebhookServer
+
+
+AGREEMENT_URL = "https://sky-site.s3.eu-west-2.amazonaws.com/agreement.pdf"
+# set after the first upload; Telegram serves the same document by its file_id afterwards
+agreement_file_id = None
+
+
+async def send_agreement(chat_id):
+    global agreement_file_id
+    if agreement_file_id is not None:
+        await bot.send_document(chat_id=chat_id, document=agreement_file_id)
+        return
+    try:
+        session = await bot.get_session()
+        async with session.get(AGREEMENT_URL, timeout=aiohttp.ClientTimeout(total=10)) as resp:
+            resp.raise_for_status()
+            file = BytesIO(await resp.read())
+    except Exception as e:
+        logger.warning(f"Agreement download failure: {e}")
+        return
+    file.name = "agreement.pdf"
+    message = await bot.send_document(chat_id=chat_id, document=file)
+    agreement_file_id = message.document.file_id
 
 
 @dp.message_handler(commands=["id"])
@@ -35,13 +70,11 @@ async def start(message: types.Message, state):
 
     (text, k), data = await dh.start(msg=message)
     await state.set_state(CONFIRM_POLICY)
-    file = BytesIO(requests.get("https://sky-site.s3.eu-west-2.amazonaws.com/agreement.pdf").content)
-    file.name = "agreement.pdf"
-    await bot.send_document(chat_id=message.chat.id, document=file)
+    await send_agreement(message.chat.id)
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text in get_trans_list("yes"), state=CONFIRM_START_WITHDRAW)
+@dp.message_handler(text=get_trans_list("yes"), state=CONFIRM_START_WITHDRAW)
 @rate_limit(1)
 async def confirm_start_withdraw(message: types.Message, state):
     data = await state.get_data()
@@ -53,7 +86,7 @@ async def confirm_start_withdraw(message: types.Message, state):
     await message.reply(text, reply_markup=k, reply=False)
 
 
-@dp.message_handler(lambda msg: msg.text in get_trans_list("no"), state=CONFIRM_START_WITHDRAW)
+@dp.message_handler(text=get_trans_list("no"), state=CONFIRM_START_WITHDRAW)
 @rate_limit(1)
 async def action_declined(message: types.Message, state):
     await state.reset_state(with_data=True)
@@ -61,14 +94,14 @@ async def action_declined(message: types.Message, state):
     await message.reply(text, reply_markup=k, reply=False)
 
 
-@dp.message_handler(lambda msg: msg.text.startswith(sm("confirm_policy")), state=CONFIRM_POLICY)
+@dp.message_handler(text_startswith=sm("confirm_policy"), state=CONFIRM_POLICY)
 async def confirm_policy(message: types.Message, state):
     text, k = await dh.confirm_policy(msg=message, username=message.from_user.username)
     await state.reset_state(with_data=True)
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text.startswith(sm("wallet")))
+@dp.message_handler(text_startswith=sm("wallet"))
 @rate_limit(3)
 async def wallet(message: types.Message):
     print(f"wallet: {message.from_user.id}")
@@ -76,14 +109,14 @@ async def wallet(message: types.Message):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "wallet")
+@dp.callback_query_handler(text="wallet")
 @rate_limit(1)
 async def wallet_inline(message: types.CallbackQuery):
     text, k = await dh.wallet(msg=message)
     await message.message.edit_text(text, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text.startswith(sm("exchange")))
+@dp.message_handler(text_startswith=sm("exchange"))
 @rate_limit(3)
 async def exchange(message: types.Message):
     print(f"exchange: {message.from_user.id}")
@@ -91,7 +124,7 @@ async def exchange(message: types.Message):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "exchange")
+@dp.callback_query_handler(text="exchange")
 @rate_limit(1)
 async def exchange_inline(message: types.CallbackQuery):
     await message.answer()
@@ -104,7 +137,7 @@ async def exchange_inline(message: types.CallbackQuery):
         await message.message.edit_text(text, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "active_deals")
+@dp.callback_query_handler(text="active_deals")
 @rate_limit(1)
 async def active_deals(message: types.CallbackQuery):
     await message.answer()
@@ -114,7 +147,7 @@ async def active_deals(message: types.CallbackQuery):
     )
 
 
-@dp.callback_query_handler(lambda msg: re.match(r"^deal [a-zA-Z0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^deal [a-zA-Z0-9]+$"))
 @rate_limit(1)
 async def deal(message: types.CallbackQuery):
     await message.answer()
@@ -122,14 +155,14 @@ async def deal(message: types.CallbackQuery):
     await send_message(text=text, chat_id=message.message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: re.match(r"^/d[a-zA-Z0-9]+$", msg.text))
+@dp.message_handler(regexp=re.compile(r"^/d[a-zA-Z0-9]+$"))
 @rate_limit(1)
 async def deal(message: types.Message):
     text, k = await dh.deal(msg=message, deal_id=message.text[2:])
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "deposit")
+@dp.callback_query_handler(text="deposit")
 @rate_limit(1)
 async def deposit(message: types.CallbackQuery):
     await message.answer()
@@ -137,7 +170,7 @@ async def deposit(message: types.CallbackQuery):
     await send_message(text=text, chat_id=message.message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "deposit_rub")
+@dp.callback_query_handler(text="deposit_rub")
 @rate_limit(1)
 async def deposit_rub(message: types.CallbackQuery):
     await message.answer()
@@ -147,7 +180,7 @@ async def deposit_rub(message: types.CallbackQuery):
         await bot.send_photo(chat_id=message.message.chat.id, photo=target_file)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "withdraw")
+@dp.callback_query_handler(text="withdraw")
 @rate_limit(3)
 async def withdraw(message: types.CallbackQuery, state):
     await message.answer()
@@ -157,10 +190,10 @@ async def withdraw(message: types.CallbackQuery, state):
     await send_message(text=text, chat_id=message.message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text.startswith(sm("cancel")), state=CHOOSE_ADDRESS_WITHDRAW)
-@dp.message_handler(lambda msg: msg.text.startswith(sm("cancel")), state=CHOOSE_AMOUNT_WITHDRAW)
-@dp.message_handler(lambda msg: msg.text.startswith(sm("cancel")), state=CONFIRMATION_WITHDRAW)
-@dp.message_handler(lambda msg: msg.text in get_trans_list("no"), state=CONFIRMATION_WITHDRAW)
+@dp.message_handler(text_startswith=sm("cancel"), state=CHOOSE_ADDRESS_WITHDRAW)
+@dp.message_handler(text_startswith=sm("cancel"), state=CHOOSE_AMOUNT_WITHDRAW)
+@dp.message_handler(text_startswith=sm("cancel"), state=CONFIRMATION_WITHDRAW)
+@dp.message_handler(text=get_trans_list("no"), state=CONFIRMATION_WITHDRAW)
 @rate_limit(1)
 async def cancel_withdraw(message: types.Message, state):
     await state.reset_state(with_data=True)
@@ -189,7 +222,7 @@ async def handle_amount(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text in get_trans_list("yes"), state=CONFIRMATION_WITHDRAW)
+@dp.message_handler(text=get_trans_list("yes"), state=CONFIRMATION_WITHDRAW)
 @rate_limit(1)
 async def confirm_withdraw(message: types.Message, state):
     data = await state.get_data()
@@ -198,7 +231,7 @@ async def confirm_withdraw(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "promocodes")
+@dp.callback_query_handler(text="promocodes")
 @rate_limit(1)
 async def promocodes(message: types.CallbackQuery):
     await message.answer()
@@ -206,7 +239,7 @@ async def promocodes(message: types.CallbackQuery):
     message = await send_message(text=text, chat_id=message.message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "reports")
+@dp.callback_query_handler(text="reports")
 @rate_limit(1)
 async def reports(message: types.CallbackQuery):
     await message.answer()
@@ -215,7 +248,7 @@ async def reports(message: types.CallbackQuery):
         await bot.send_document(document=file, chat_id=message.from_user.id)
 
 
-@dp.message_handler(lambda msg: msg.text.startswith(sm("about")))
+@dp.message_handler(text_startswith=sm("about"))
 @rate_limit(3)
 async def about(message: types.Message):
     print(f"about: {message.from_user.id}")
@@ -223,7 +256,7 @@ async def about(message: types.Message):
     await message.reply(text, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "get_code")
+@dp.callback_query_handler(text="get_code")
 @rate_limit(1)
 async def get_code(message: types.CallbackQuery):
     await message.answer()
@@ -231,7 +264,7 @@ async def get_code(message: types.CallbackQuery):
     message = await send_message(text=text, chat_id=message.message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data.startswith("handle_lots"))
+@dp.callback_query_handler(text_startswith="handle_lots")
 @rate_limit(1)
 async def handle_lots(message: types.CallbackQuery):
     await message.answer()
@@ -249,7 +282,7 @@ async def handle_lots(message: types.CallbackQuery):
         pass
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "change_trading_activity_status")
+@dp.callback_query_handler(text="change_trading_activity_status")
 @rate_limit(1)
 async def change_trading_activity_status(message: types.CallbackQuery):
     await message.answer()
@@ -262,10 +295,10 @@ async def change_trading_activity_status(message: types.CallbackQuery):
         pass
 
 
-@dp.message_handler(lambda msg: msg.text.startswith(sm("cancel")), state=NEW_LOT_TYPE)
-@dp.message_handler(lambda msg: msg.text.startswith(sm("cancel")), state=NEW_LOT_RATE)
-@dp.message_handler(lambda msg: msg.text.startswith(sm("cancel")), state=NEW_LOT_LIMITS)
-@dp.message_handler(lambda msg: msg.text.startswith(sm("cancel")), state=NEW_LOT_BROKER)
+@dp.message_handler(text_startswith=sm("cancel"), state=NEW_LOT_TYPE)
+@dp.message_handler(text_startswith=sm("cancel"), state=NEW_LOT_RATE)
+@dp.message_handler(text_startswith=sm("cancel"), state=NEW_LOT_LIMITS)
+@dp.message_handler(text_startswith=sm("cancel"), state=NEW_LOT_BROKER)
 @rate_limit(1)
 async def cancel_create_lot(message: types.Message, state):
     await state.reset_state(with_data=True)
@@ -273,7 +306,7 @@ async def cancel_create_lot(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda x: x.data == "create_lot")
+@dp.callback_query_handler(text="create_lot")
 @rate_limit(1)
 async def create_lot(message: types.CallbackQuery, state):
     await message.answer()
@@ -329,7 +362,7 @@ async def new_lot_limits(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: re.match("^(buy|sell) [0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^(buy|sell) [0-9]+$"))
 @rate_limit(1)
 async def market(message: types.CallbackQuery):
     await message.answer()
@@ -344,7 +377,7 @@ async def market(message: types.CallbackQuery):
             pass
 
 
-@dp.callback_query_handler(lambda msg: msg.data.startswith("lots buy "))
+@dp.callback_query_handler(text_startswith="lots buy ")
 @rate_limit(1)
 async def lots_buy_from_broker(message: types.CallbackQuery):
     await message.answer()
@@ -360,7 +393,7 @@ async def lots_buy_from_broker(message: types.CallbackQuery):
         pass
 
 
-@dp.callback_query_handler(lambda msg: msg.data.startswith("lots sell "))
+@dp.callback_query_handler(text_startswith="lots sell ")
 @rate_limit(1)
 async def lots_sell_from_broker(message: types.CallbackQuery):
     await message.answer()
@@ -376,20 +409,20 @@ async def lots_sell_from_broker(message: types.CallbackQuery):
         pass
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "lots empty")
+@dp.callback_query_handler(text="lots empty")
 @rate_limit(1)
 async def lots_empty(message: types.CallbackQuery):
     await message.answer()
 
 
-@dp.message_handler(lambda msg: re.match(r"^/l[a-zA-Z0-9]+$", msg.text))
+@dp.message_handler(regexp=re.compile(r"^/l[a-zA-Z0-9]+$"))
 @rate_limit(1)
 async def lot(message: types.Message):
     text, k = await dh.lot(msg=message, identificator=message.text[2:])
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: re.match("^lot [a-zA-Z0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^lot [a-zA-Z0-9]+$"))
 @rate_limit(1)
 async def lot_inline(message: types.CallbackQuery):
     await message.answer()
@@ -397,7 +430,7 @@ async def lot_inline(message: types.CallbackQuery):
     await send_message(text=text, chat_id=message.message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: re.match("^begin_deal [a-zA-Z0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^begin_deal [a-zA-Z0-9]+$"))
 @rate_limit(1)
 async def begin_deal(message: types.CallbackQuery, state):
     await message.answer()
@@ -408,10 +441,10 @@ async def begin_deal(message: types.CallbackQuery, state):
     await send_message(text=text, chat_id=message.message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text.startswith(sm("cancel")), state=ENTER_SUM_DEAL)
-@dp.message_handler(lambda msg: msg.text.startswith(sm("cancel")), state=ENTER_REQ_DEAL)
-@dp.message_handler(lambda msg: msg.text.startswith(sm("cancel")), state=CONFIRMATION_DEAL)
-@dp.message_handler(lambda msg: msg.text in get_trans_list("no"), state=CONFIRMATION_DEAL)
+@dp.message_handler(text_startswith=sm("cancel"), state=ENTER_SUM_DEAL)
+@dp.message_handler(text_startswith=sm("cancel"), state=ENTER_REQ_DEAL)
+@dp.message_handler(text_startswith=sm("cancel"), state=CONFIRMATION_DEAL)
+@dp.message_handler(text=get_trans_list("no"), state=CONFIRMATION_DEAL)
 @rate_limit(1)
 async def cancel_create_deal(message: types.Message, state):
     await state.reset_state(with_data=True)
@@ -468,7 +501,7 @@ async def confirmation_deal(message: types.Message, state):
 ############### CANCELING DEAL ############
 
 
-@dp.callback_query_handler(lambda msg: re.match("^cancel_deal [a-zA-Z0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^cancel_deal [a-zA-Z0-9]+$"))
 @rate_limit(1)
 async def cancel_deal(message: types.CallbackQuery, state):
     await message.answer()
@@ -479,7 +512,7 @@ async def cancel_deal(message: types.CallbackQuery, state):
     message = await send_message(text=text, chat_id=message.message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text in get_trans_list("yes"), state=CONFIRMATION_DECLINE_DEAL)
+@dp.message_handler(text=get_trans_list("yes"), state=CONFIRMATION_DECLINE_DEAL)
 @rate_limit(1)
 async def cancel_deal_confirmed(message: types.Message, state):
     data = await state.get_data()
@@ -488,7 +521,7 @@ async def cancel_deal_confirmed(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text in get_trans_list("no"), state=CONFIRMATION_DECLINE_DEAL)
+@dp.message_handler(text=get_trans_list("no"), state=CONFIRMATION_DECLINE_DEAL)
 @rate_limit(1)
 async def decline_cancel_deal(message: types.Message, state):
     text, k = await dh.decline_cancel_deal(msg=message)
@@ -499,7 +532,7 @@ async def decline_cancel_deal(message: types.Message, state):
 ###########################################
 
 
-@dp.callback_query_handler(lambda msg: re.match("^accept_deal [a-zA-Z0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^accept_deal [a-zA-Z0-9]+$"))
 @rate_limit(1)
 async def accept_deal(message: types.CallbackQuery, state):
     await message.answer()
@@ -512,7 +545,7 @@ async def accept_deal(message: types.CallbackQuery, state):
     message = await send_message(text=text, chat_id=message.message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text.startswith(sm("cancel")), state=ENTER_REQ_DEAL_WHILE_ACCEPTING)
+@dp.message_handler(text_startswith=sm("cancel"), state=ENTER_REQ_DEAL_WHILE_ACCEPTING)
 @rate_limit(1)
 async def cancel_enter_req(message: types.Message, state):
     await state.reset_state(with_data=True)
@@ -530,7 +563,7 @@ async def enter_req_accepting(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text in get_trans_list("yes"), state=ENTER_REQ_DEAL_WHILE_ACCEPTING_CONFIRM)
+@dp.message_handler(text=get_trans_list("yes"), state=ENTER_REQ_DEAL_WHILE_ACCEPTING_CONFIRM)
 @rate_limit(1)
 async def enter_req_accepting_confirmed(message: types.Message, state):
     data = await state.get_data()
@@ -539,7 +572,7 @@ async def enter_req_accepting_confirmed(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text in get_trans_list("no"), state=ENTER_REQ_DEAL_WHILE_ACCEPTING_CONFIRM)
+@dp.message_handler(text=get_trans_list("no"), state=ENTER_REQ_DEAL_WHILE_ACCEPTING_CONFIRM)
 @rate_limit(1)
 async def enter_req_accepting_declined(message: types.Message, state):
     text, k = await dh.cancel_enter_req(msg=message)
@@ -550,7 +583,7 @@ async def enter_req_accepting_declined(message: types.Message, state):
 #############################################
 
 
-@dp.callback_query_handler(lambda msg: re.match("^confirm_sent_fiat [a-zA-Z0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^confirm_sent_fiat [a-zA-Z0-9]+$"))
 @rate_limit(1)
 async def confirm_sent_fiat(message: types.CallbackQuery, state):
     await message.answer()
@@ -561,7 +594,7 @@ async def confirm_sent_fiat(message: types.CallbackQuery, state):
     message = await send_message(text=text, chat_id=message.message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text in get_trans_list("no"), state=CONFIRMATION_FIAT_SENDING)
+@dp.message_handler(text=get_trans_list("no"), state=CONFIRMATION_FIAT_SENDING)
 @rate_limit(1)
 async def unconfirm_sent_fiat(message: types.Message, state):
     text, k = await dh.unconfirm_sent_fiat(msg=message)
@@ -569,7 +602,7 @@ async def unconfirm_sent_fiat(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text in get_trans_list("yes"), state=CONFIRMATION_FIAT_SENDING)
+@dp.message_handler(text=get_trans_list("yes"), state=CONFIRMATION_FIAT_SENDING)
 @rate_limit(1)
 async def confirm_sent_fiat(message: types.Message, state):
     data = await state.get_data()
@@ -581,7 +614,7 @@ async def confirm_sent_fiat(message: types.Message, state):
 #############################################
 
 
-@dp.callback_query_handler(lambda msg: re.match("^send_crypto_wo_agreement [a-zA-Z0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^send_crypto_wo_agreement [a-zA-Z0-9]+$"))
 @rate_limit(1)
 async def send_crypto_wo_agreement(message: types.CallbackQuery, state):
     await message.answer()
@@ -592,7 +625,7 @@ async def send_crypto_wo_agreement(message: types.CallbackQuery, state):
     message = await send_message(text=text, chat_id=message.message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text in get_trans_list("no"), state=CRYPTO_SENDING_NO_CONFIRMATION)
+@dp.message_handler(text=get_trans_list("no"), state=CRYPTO_SENDING_NO_CONFIRMATION)
 @rate_limit(1)
 async def unconfirm_send_crypto_wo_agreement(message: types.Message, state):
     text, k = await dh.unconfirm_send_crypto(msg=message)
@@ -600,7 +633,7 @@ async def unconfirm_send_crypto_wo_agreement(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text in get_trans_list("yes"), state=CRYPTO_SENDING_NO_CONFIRMATION)
+@dp.message_handler(text=get_trans_list("yes"), state=CRYPTO_SENDING_NO_CONFIRMATION)
 @rate_limit(1)
 async def confirm_send_crypto_wo_agreement(message: types.Message, state):
     data = await state.get_data()
@@ -612,7 +645,7 @@ async def confirm_send_crypto_wo_agreement(message: types.Message, state):
 #############################################
 
 
-@dp.callback_query_handler(lambda msg: re.match("^run_payment [a-zA-Z0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^run_payment [a-zA-Z0-9]+$"))
 @rate_limit(1)
 async def run_payment(message: types.CallbackQuery, state):
     await message.answer()
@@ -623,7 +656,7 @@ async def run_payment(message: types.CallbackQuery, state):
     message = await send_message(text=text, chat_id=message.message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text in get_trans_list("no"), state=CRYPTO_SENDING_FD_DECLINED_DEAL)
+@dp.message_handler(text=get_trans_list("no"), state=CRYPTO_SENDING_FD_DECLINED_DEAL)
 @rate_limit(1)
 async def unconfirm_run_payment(message: types.Message, state):
     text, k = await dh.unconfirm_send_crypto(msg=message)
@@ -631,7 +664,7 @@ async def unconfirm_run_payment(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text in get_trans_list("yes"), state=CRYPTO_SENDING_FD_DECLINED_DEAL)
+@dp.message_handler(text=get_trans_list("yes"), state=CRYPTO_SENDING_FD_DECLINED_DEAL)
 @rate_limit(1)
 async def confirm_run_payment(message: types.Message, state):
     data = await state.get_data()
@@ -644,7 +677,7 @@ async def confirm_run_payment(message: types.Message, state):
 
 
 
-@dp.callback_query_handler(lambda msg: re.match("^run_payment_with_req [a-zA-Z0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^run_payment_with_req [a-zA-Z0-9]+$"))
 @rate_limit(1)
 async def run_payment(message: types.CallbackQuery, state):
     await message.answer()
@@ -667,7 +700,7 @@ async def sending_no_agreement_with_req(message: types.Message, state):
 
 
 # yes
-@dp.message_handler(lambda msg: msg.text in get_trans_list("yes"), state=CRYPTO_SENDING_FD_DECLINED_DEAL_WITH_REQ_CONFIRMATION)
+@dp.message_handler(text=get_trans_list("yes"), state=CRYPTO_SENDING_FD_DECLINED_DEAL_WITH_REQ_CONFIRMATION)
 @rate_limit(1)
 async def confirm_run_payment_with_req(message: types.Message, state):
     data = await state.get_data()
@@ -677,7 +710,7 @@ async def confirm_run_payment_with_req(message: types.Message, state):
 
 
 # no
-@dp.message_handler(lambda msg: msg.text in get_trans_list("no"), state=CRYPTO_SENDING_FD_DECLINED_DEAL_WITH_REQ_CONFIRMATION)
+@dp.message_handler(text=get_trans_list("no"), state=CRYPTO_SENDING_FD_DECLINED_DEAL_WITH_REQ_CONFIRMATION)
 @rate_limit(1)
 async def unconfirm_run_payment_with_req(message: types.Message, state):
     text, k = await dh.unconfirm_send_crypto(msg=message)
@@ -690,7 +723,7 @@ async def unconfirm_run_payment_with_req(message: types.Message, state):
 #############################################
 
 
-@dp.callback_query_handler(lambda msg: re.match("^send_crypto [a-zA-Z0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^send_crypto [a-zA-Z0-9]+$"))
 @rate_limit(1)
 async def send_crypto(message: types.CallbackQuery, state):
     await message.answer()
@@ -701,7 +734,7 @@ async def send_crypto(message: types.CallbackQuery, state):
     message = await send_message(text=text, chat_id=message.message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text in get_trans_list("no"), state=CONFIRMATION_CRYPTO_SENDING)
+@dp.message_handler(text=get_trans_list("no"), state=CONFIRMATION_CRYPTO_SENDING)
 @rate_limit(1)
 async def unconfirm_send_crypto(message: types.Message, state):
     text, k = await dh.unconfirm_send_crypto(msg=message)
@@ -709,7 +742,7 @@ async def unconfirm_send_crypto(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text in get_trans_list("yes"), state=CONFIRMATION_CRYPTO_SENDING)
+@dp.message_handler(text=get_trans_list("yes"), state=CONFIRMATION_CRYPTO_SENDING)
 @rate_limit(1)
 async def confirm_send_crypto(message: types.Message, state):
     data = await state.get_data()
@@ -721,7 +754,7 @@ async def confirm_send_crypto(message: types.Message, state):
 ###############################  DISPUTES  ######################################
 
 
-@dp.callback_query_handler(lambda msg: re.match("^open_dispute [a-zA-Z0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^open_dispute [a-zA-Z0-9]+$"))
 @rate_limit(1)
 async def open_dispute(message: types.CallbackQuery):
     await message.answer()
@@ -730,7 +763,7 @@ async def open_dispute(message: types.CallbackQuery):
     await send_message(text=text, chat_id=message.message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: re.match(r"^decline_dispute [a-zA-Z0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^decline_dispute [a-zA-Z0-9]+$"))
 @rate_limit(1)
 async def decline_dispute(message: types.CallbackQuery, state):
     await message.answer()
@@ -741,7 +774,7 @@ async def decline_dispute(message: types.CallbackQuery, state):
     await send_message(text=text, chat_id=message.message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text in get_trans_list("no"), state=DECLINE_DISPUTE)
+@dp.message_handler(text=get_trans_list("no"), state=DECLINE_DISPUTE)
 @rate_limit(1)
 async def cancel_decline_dispute(message: types.Message, state):
     text, k = await dh.cancel_decline_dispute(msg=message)
@@ -749,7 +782,7 @@ async def cancel_decline_dispute(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text in get_trans_list("yes"), state=DECLINE_DISPUTE)
+@dp.message_handler(text=get_trans_list("yes"), state=DECLINE_DISPUTE)
 @rate_limit(1)
 async def handle_decline_dispute(message: types.Message, state):
     data = await state.get_data()
@@ -758,7 +791,7 @@ async def handle_decline_dispute(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: re.match("^(like|dislike) [0-9]+ [a-zA-Z0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^(like|dislike) [0-9]+ [a-zA-Z0-9]+$"))
 @rate_limit(2)
 async def rate_user(message: types.CallbackQuery):
     await message.answer()
@@ -775,14 +808,14 @@ async def rate_user(message: types.CallbackQuery):
         message = await send_message(text=text, chat_id=message.message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text.startswith(sm("about")))
+@dp.message_handler(text_startswith=sm("about"))
 @rate_limit(1)
 async def about(message: types.Message):
     text, k = await dh.about(msg=message)
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "about")
+@dp.callback_query_handler(text="about")
 @rate_limit(1)
 async def about_inline(message: types.CallbackQuery):
     await message.answer()
@@ -790,7 +823,7 @@ async def about_inline(message: types.CallbackQuery):
     await message.message.edit_text(text, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "communication")
+@dp.callback_query_handler(text="communication")
 @rate_limit(1)
 async def communication(message: types.CallbackQuery):
     await message.answer()
@@ -798,7 +831,7 @@ async def communication(message: types.CallbackQuery):
     await message.message.edit_text(text, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "friends")
+@dp.callback_query_handler(text="friends")
 @rate_limit(1)
 async def friends(message: types.CallbackQuery):
     await message.answer()
@@ -806,7 +839,7 @@ async def friends(message: types.CallbackQuery):
     await message.message.edit_text(text, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "affiliate")
+@dp.callback_query_handler(text="affiliate")
 @rate_limit(1)
 async def affiliate(message: types.CallbackQuery):
     await message.answer()
@@ -814,7 +847,7 @@ async def affiliate(message: types.CallbackQuery):
     await message.message.edit_text(text, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text.startswith(sm("settings")))
+@dp.message_handler(text_startswith=sm("settings"))
 @rate_limit(3)
 async def settings(message: types.Message):
     print(f"settings: {message.from_user.id}")
@@ -822,7 +855,7 @@ async def settings(message: types.Message):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "settings")
+@dp.callback_query_handler(text="settings")
 @rate_limit(1)
 async def settings_inline(message: types.CallbackQuery):
     await message.answer()
@@ -830,7 +863,7 @@ async def settings_inline(message: types.CallbackQuery):
     await message.message.edit_text(text, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "lang_settings")
+@dp.callback_query_handler(text="lang_settings")
 @rate_limit(1)
 async def lang_settings(message: types.CallbackQuery):
     await message.answer()
@@ -838,7 +871,7 @@ async def lang_settings(message: types.CallbackQuery):
     await message.message.edit_text(text, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: re.match(r"^lang_[a-z]{2}$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^lang_[a-z]{2}$"))
 @rate_limit(1)
 async def update_lang(message: types.CallbackQuery):
     await message.answer()
@@ -847,7 +880,7 @@ async def update_lang(message: types.CallbackQuery):
     await message.message.edit_text(text, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "rate_settings")
+@dp.callback_query_handler(text="rate_settings")
 @rate_limit(1)
 async def rate_settings(message: types.CallbackQuery):
     await message.answer()
@@ -855,7 +888,7 @@ async def rate_settings(message: types.CallbackQuery):
     await message.message.edit_text(text, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "currency_settings")
+@dp.callback_query_handler(text="currency_settings")
 @rate_limit(1)
 async def currency_settings(message: types.CallbackQuery):
     await message.answer()
@@ -863,7 +896,7 @@ async def currency_settings(message: types.CallbackQuery):
     await message.message.edit_text(text, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: re.match(r"^choose_currency [a-z]{3}$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^choose_currency [a-z]{3}$"))
 @rate_limit(1)
 async def choose_currency(message: types.CallbackQuery):
     await message.answer()
@@ -874,7 +907,7 @@ async def choose_currency(message: types.CallbackQuery):
 ######################################################################################
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "promocodes")
+@dp.callback_query_handler(text="promocodes")
 @rate_limit(1)
 async def promocodes(message: types.CallbackQuery):
     await message.answer()
@@ -882,7 +915,7 @@ async def promocodes(message: types.CallbackQuery):
     await message.message.edit_text(text, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "create_promocode")
+@dp.callback_query_handler(text="create_promocode")
 @rate_limit(1)
 async def create_promocode_(message: types.CallbackQuery):
     await message.answer()
@@ -890,7 +923,7 @@ async def create_promocode_(message: types.CallbackQuery):
     await message.message.edit_text(text, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "activate_promocode")
+@dp.callback_query_handler(text="activate_promocode")
 @rate_limit(1)
 async def activate_promocode(message: types.CallbackQuery, state):
     await message.answer()
@@ -899,7 +932,7 @@ async def activate_promocode(message: types.CallbackQuery, state):
     message = await send_message(text=text, chat_id=message.message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text.startswith(sm("cancel")), state=ACTIVATE_PROMOCODE)
+@dp.message_handler(text_startswith=sm("cancel"), state=ACTIVATE_PROMOCODE)
 @rate_limit(1)
 async def cancel_activate_promocode(message: types.Message, state):
     await state.reset_state(with_data=True)
@@ -915,7 +948,7 @@ async def check_promocode(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: re.match(r"^create_promocode [a-z]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^create_promocode [a-z]+$"))
 @rate_limit(1)
 async def create_promocode(message: types.CallbackQuery, state):
     await message.answer()
@@ -926,8 +959,8 @@ async def create_promocode(message: types.CallbackQuery, state):
     message = await send_message(text=text, chat_id=message.message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text.startswith(sm("cancel")), state=PROMOCODES_COUNT)
-@dp.message_handler(lambda msg: msg.text.startswith(sm("cancel")), state=PROMOCODES_AMOUNT)
+@dp.message_handler(text_startswith=sm("cancel"), state=PROMOCODES_COUNT)
+@dp.message_handler(text_startswith=sm("cancel"), state=PROMOCODES_AMOUNT)
 @rate_limit(1)
 async def cancel_create_promocode(message: types.Message, state):
     await state.reset_state(with_data=True)
@@ -959,14 +992,14 @@ async def handle_amount(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "active_promocodes")
+@dp.callback_query_handler(text="active_promocodes")
 @rate_limit(1)
 async def active_promocodes(message: types.CallbackQuery):
     await message.answer()
     await dh.active_promocodes(msg=message)
 
 
-@dp.callback_query_handler(lambda msg: re.match(r"^delete_promocode [0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^delete_promocode [0-9]+$"))
 @rate_limit(1)
 async def delete_promocode(message: types.CallbackQuery):
     await message.answer()
@@ -977,14 +1010,14 @@ async def delete_promocode(message: types.CallbackQuery):
 ########################################################################################
 
 
-@dp.message_handler(lambda msg: msg.text.startswith("/u"))
+@dp.message_handler(text_startswith="/u")
 @rate_limit(1)
 async def user(message: types.Message):
     text, k = await dh.user(msg=message, nickname=message.text[2:])
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: re.match(r"^write_message [0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^write_message [0-9]+$"))
 @rate_limit(1)
 async def write_message(message: types.CallbackQuery, state):
     await message.answer()
@@ -994,7 +1027,7 @@ async def write_message(message: types.CallbackQuery, state):
     await send_message(text=text, chat_id=message.message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text.startswith(sm("cancel")), state=WRITE_MESSAGE)
+@dp.message_handler(text_startswith=sm("cancel"), state=WRITE_MESSAGE)
 @rate_limit(1)
 async def cancel_write_message(message: types.Message, state):
     await state.reset_state(with_data=True)
@@ -1032,9 +1065,9 @@ async def send_pdf(message: types.Message, state):
 ##################################  SELF LOT  ##########################################
 
 
-@dp.message_handler(lambda msg: msg.text.startswith(sm("cancel")), state=CHANGE_LIMITS)
-@dp.message_handler(lambda msg: msg.text.startswith(sm("cancel")), state=CHANGE_CONDITIONS)
-@dp.message_handler(lambda msg: msg.text.startswith(sm("cancel")), state=CHANGE_RATE)
+@dp.message_handler(text_startswith=sm("cancel"), state=CHANGE_LIMITS)
+@dp.message_handler(text_startswith=sm("cancel"), state=CHANGE_CONDITIONS)
+@dp.message_handler(text_startswith=sm("cancel"), state=CHANGE_RATE)
 @rate_limit(1)
 async def cancel_change_lot(message: types.Message, state):
     await state.reset_state(with_data=True)
@@ -1042,7 +1075,7 @@ async def cancel_change_lot(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: re.match(r"^change_limits [a-zA-Z0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^change_limits [a-zA-Z0-9]+$"))
 @rate_limit(1)
 async def change_limits(message: types.CallbackQuery, state):
     await message.answer()
@@ -1061,7 +1094,7 @@ async def edit_limits(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: re.match(r"^change_rate [a-zA-Z0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^change_rate [a-zA-Z0-9]+$"))
 @rate_limit(1)
 async def change_rate(message: types.CallbackQuery, state):
     await message.answer()
@@ -1080,7 +1113,7 @@ async def edit_rate(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: re.match(r"^change_conditions [a-zA-Z0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^change_conditions [a-zA-Z0-9]+$"))
 @rate_limit(1)
 async def change_conditions(message: types.CallbackQuery, state):
     await message.answer()
@@ -1102,7 +1135,7 @@ async def edit_conditions(message: types.Message, state):
 ############## DELETE LOT #######################
 
 
-@dp.callback_query_handler(lambda msg: re.match(r"^delete_lot [a-zA-Z0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^delete_lot [a-zA-Z0-9]+$"))
 @rate_limit(1)
 async def delete_lot_confirmation(message: types.CallbackQuery, state):
     await message.answer()
@@ -1112,7 +1145,7 @@ async def delete_lot_confirmation(message: types.CallbackQuery, state):
     await state.set_state(CONFIRMATION_DELETE_LOT)
 
 
-@dp.message_handler(lambda msg: msg.text in get_trans_list("no"), state=CONFIRMATION_DELETE_LOT)
+@dp.message_handler(text=get_trans_list("no"), state=CONFIRMATION_DELETE_LOT)
 @rate_limit(1)
 async def cancel_delete_lot(message: types.Message, state):
     await state.reset_state(with_data=True)
@@ -1120,7 +1153,7 @@ async def cancel_delete_lot(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text in get_trans_list("yes"), state=CONFIRMATION_DELETE_LOT)
+@dp.message_handler(text=get_trans_list("yes"), state=CONFIRMATION_DELETE_LOT)
 @rate_limit(1)
 async def delete_lot(message: types.Message, state):
     data = await state.get_data()
@@ -1129,7 +1162,7 @@ async def delete_lot(message: types.Message, state):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.callback_query_handler(lambda msg: re.match(r"^change_lot_status [a-zA-Z0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^change_lot_status [a-zA-Z0-9]+$"))
 @rate_limit(1)
 async def change_lot_status(message: types.CallbackQuery):
     await message.answer()
@@ -1139,14 +1172,14 @@ async def change_lot_status(message: types.CallbackQuery):
     )
 
 
-@dp.callback_query_handler(lambda msg: re.match(r"^show .*$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^show .*$"))
 @rate_limit(1)
 async def show_text(message: types.CallbackQuery):
     await message.answer()
     await send_message(text=message.data.split()[1], chat_id=message.message.chat.id)
 
 
-@dp.callback_query_handler(lambda msg: re.match(r"^decline_token$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^decline_token$"))
 @rate_limit(1)
 async def decline_token(message: types.CallbackQuery):
     await message.answer()
@@ -1160,7 +1193,7 @@ async def decline_token(message: types.CallbackQuery):
 ####################################
 
 
-@dp.callback_query_handler(lambda msg: re.match(r"^(confirm|decline)_resolving [0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^(confirm|decline)_resolving [0-9]+$"))
 @rate_limit(1)
 async def confirm_resolving(message: types.CallbackQuery):
     await message.answer()
@@ -1168,7 +1201,7 @@ async def confirm_resolving(message: types.CallbackQuery):
     await message.message.edit_text(text, reply_markup=None)
 
 
-@dp.callback_query_handler(lambda msg: re.match(r"^(confirm|decline)_transaction [0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^(confirm|decline)_transaction [0-9]+$"))
 @rate_limit(1)
 async def confirm_transaction(message: types.CallbackQuery):
     await message.answer()
@@ -1189,7 +1222,7 @@ async def get_api_key(message: types.Message):
 ########################################################################################
 
 
-@dp.callback_query_handler(lambda msg: re.match(r"^cancel_deal [0-9a-zA-Z]+ (buyer|seller)$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^cancel_deal [0-9a-zA-Z]+ (buyer|seller)$"))
 @rate_limit(1)
 async def admin_cancel_deal(message: types.CallbackQuery):
     await message.answer()
@@ -1208,14 +1241,14 @@ async def menu(message: types.Message):
     await send_message(text=text, chat_id=message.chat.id, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: msg.text.startswith("/get_tx"))
+@dp.message_handler(text_startswith="/get_tx")
 @rate_limit(1)
 async def get_tx(message: types.Message):
     text = await dh.get_tx(msg=message, tx_hash=message.text.split()[1])
     await send_message(text=text, chat_id=message.chat.id)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "users_report")
+@dp.callback_query_handler(text="users_report")
 @rate_limit(1)
 async def users_report(message: types.CallbackQuery):
     await message.answer()
@@ -1223,7 +1256,7 @@ async def users_report(message: types.CallbackQuery):
     await bot.send_message(chat_id=message.from_user.id, text=text)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "lots_report")
+@dp.callback_query_handler(text="lots_report")
 @rate_limit(1)
 async def lots_report(message: types.CallbackQuery):
     await message.answer()
@@ -1231,7 +1264,7 @@ async def lots_report(message: types.CallbackQuery):
     await bot.send_message(chat_id=message.from_user.id, text=text)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "exchange_report")
+@dp.callback_query_handler(text="exchange_report")
 @rate_limit(1)
 async def exchange_report(message: types.CallbackQuery):
     await message.answer()
@@ -1239,7 +1272,7 @@ async def exchange_report(message: types.CallbackQuery):
     await bot.send_message(chat_id=message.from_user.id, text=text)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "promocodes_report")
+@dp.callback_query_handler(text="promocodes_report")
 @rate_limit(10)
 async def promocodes_report(message: types.CallbackQuery):
     await message.answer()
@@ -1247,7 +1280,7 @@ async def promocodes_report(message: types.CallbackQuery):
     await bot.send_message(chat_id=message.from_user.id, text=text)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "deals_report")
+@dp.callback_query_handler(text="deals_report")
 @rate_limit(1)
 async def deals_report(message: types.CallbackQuery):
     await message.answer()
@@ -1255,7 +1288,7 @@ async def deals_report(message: types.CallbackQuery):
     await bot.send_message(chat_id=message.from_user.id, text=text)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "transactions_report")
+@dp.callback_query_handler(text="transactions_report")
 @rate_limit(1)
 async def transactions_report(message: types.CallbackQuery):
     await message.answer()
@@ -1263,7 +1296,7 @@ async def transactions_report(message: types.CallbackQuery):
     await bot.send_message(chat_id=message.from_user.id, text=text)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "financial_report")
+@dp.callback_query_handler(text="financial_report")
 @rate_limit(1)
 async def financial_report(message: types.CallbackQuery):
     await message.answer()
@@ -1271,7 +1304,7 @@ async def financial_report(message: types.CallbackQuery):
     await bot.send_message(chat_id=message.from_user.id, text=text)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "merchant_report")
+@dp.callback_query_handler(text="merchant_report")
 @rate_limit(1)
 async def merchants_report(message: types.CallbackQuery):
     await message.answer()
@@ -1279,7 +1312,7 @@ async def merchants_report(message: types.CallbackQuery):
     await bot.send_message(chat_id=message.from_user.id, text=text)
 
 
-@dp.message_handler(lambda msg: re.match(r"^/r([dpleutfcm])_[0-9]+_[0-9]+$", msg.text))
+@dp.message_handler(regexp=re.compile(r"^/r([dpleutfcm])_[0-9]+_[0-9]+$"))
 @rate_limit(1)
 async def report(message: types.Message):
     cmd, year, month = message.text.split("_")
@@ -1306,9 +1339,7 @@ async def report(message: types.Message):
     await bot.send_document(chat_id=message.from_user.id, document=doc)
 
 
-@dp.message_handler(
-    lambda msg: re.match(r"^/p [0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$", msg.text)
-)
+@dp.message_handler(regexp=re.compile(r"^/p [0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$"))
 @rate_limit(1)
 async def get_payment_for_support(message: types.Message):
     payment_id = message.text.split()[1]
@@ -1316,9 +1347,7 @@ async def get_payment_for_support(message: types.Message):
     await send_message(text=text, chat_id=message.chat.id)
 
 
-@dp.message_handler(
-    lambda msg: re.match(r"^/p2 [0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$", msg.text)
-)
+@dp.message_handler(regexp=re.compile(r"^/p2 [0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$"))
 @rate_limit(1)
 async def get_payment_for_support(message: types.Message):
     payment_id = message.text.split()[1]
@@ -1326,9 +1355,7 @@ async def get_payment_for_support(message: types.Message):
     await send_message(text=text, chat_id=message.chat.id)
 
 
-@dp.message_handler(
-    lambda msg: re.match(r"^/s [0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$", msg.text)
-)
+@dp.message_handler(regexp=re.compile(r"^/s [0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$"))
 @rate_limit(1)
 async def get_sale_for_support(message: types.Message):
     sale_id = message.text.split()[1]
@@ -1336,9 +1363,7 @@ async def get_sale_for_support(message: types.Message):
     await send_message(text=text, chat_id=message.chat.id)
 
 
-@dp.message_handler(
-    lambda msg: re.match(r"^/s2 [0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$", msg.text)
-)
+@dp.message_handler(regexp=re.compile(r"^/s2 [0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$"))
 @rate_limit(1)
 async def get_sale_v2_for_support(message: types.Message):
     sale_v2_id = message.text.split()[1]
@@ -1346,9 +1371,7 @@ async def get_sale_v2_for_support(message: types.Message):
     await send_message(text=text, chat_id=message.chat.id)
 
 
-@dp.message_handler(
-    lambda msg: re.match(r"^/cp [0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$", msg.text)
-)
+@dp.message_handler(regexp=re.compile(r"^/cp [0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$"))
 @rate_limit(1)
 async def get_cpayment_for_support(message: types.Message):
     cpayment_id = message.text.split()[1]
@@ -1356,9 +1379,7 @@ async def get_cpayment_for_support(message: types.Message):
     await send_message(text=text, chat_id=message.chat.id)
 
 
-@dp.message_handler(
-    lambda msg: re.match(r"^/w2 [0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$", msg.text)
-)
+@dp.message_handler(regexp=re.compile(r"^/w2 [0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$"))
 @rate_limit(1)
 async def get_withdrawal_for_support(message: types.Message):
     withdrawal_id = message.text.split()[1]
@@ -1366,7 +1387,7 @@ async def get_withdrawal_for_support(message: types.Message):
     await send_message(text=text, chat_id=message.chat.id)
 
 
-@dp.message_handler(lambda msg: re.match(r"^/rcontr_[0-9]+_[0-9]+_[0-9]+$", msg.text))
+@dp.message_handler(regexp=re.compile(r"^/rcontr_[0-9]+_[0-9]+_[0-9]+$"))
 @rate_limit(1)
 async def report_control(message: types.Message):
     _, year, month, day = message.text.split("_")
@@ -1374,7 +1395,7 @@ async def report_control(message: types.Message):
     await bot.send_document(chat_id=message.from_user.id, document=doc)
 
 
-@dp.callback_query_handler(lambda msg: msg.data == "campaigns_report")
+@dp.callback_query_handler(text="campaigns_report")
 @rate_limit(1)
 async def campaigns_report(message: types.CallbackQuery):
     await message.answer()
@@ -1382,7 +1403,7 @@ async def campaigns_report(message: types.CallbackQuery):
     await bot.send_document(chat_id=message.from_user.id, document=doc)
 
 
-@dp.callback_query_handler(lambda msg: re.match(r"^user_(lots|promocodes|deals|transactions)_report [0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^user_(lots|promocodes|deals|transactions)_report [0-9]+$"))
 @rate_limit(1)
 async def user_report(message: types.CallbackQuery):
     await message.answer()
@@ -1394,7 +1415,7 @@ async def user_report(message: types.CallbackQuery):
         await bot.send_document(chat_id=message.from_user.id, document=file)
 
 
-@dp.callback_query_handler(lambda msg: re.match(r"^transit [0-9]+$", msg.data))
+@dp.callback_query_handler(regexp=re.compile(r"^transit [0-9]+$"))
 @rate_limit(1)
 async def transit(message: types.CallbackQuery):
     await message.answer()
@@ -1402,14 +1423,22 @@ async def transit(message: types.CallbackQuery):
     await send_message(text=text, chat_id=message.message.chat.id)
 
 
-@dp.message_handler(lambda msg: msg.text.startswith("/send_notif_all "))
+@dp.message_handler(text_startswith="/send_notif_all ")
 @rate_limit(1)
 async def send_to_all(message: types.Message):
-    await dh.send_to_all(msg=message, text=message.text)
+    text, k = await dh.send_to_all(msg=message, text=message.text)
+    await message.reply(text, reply_markup=k)
+
+
+@dp.message_handler(commands=["stop_notif_all"])
+@rate_limit(1)
+async def stop_send_to_all(message: types.Message):
+    text, k = await dh.stop_send_to_all(msg=message)
+    await message.reply(text, reply_markup=k)
 
 
 @dp.callback_query_handler(
-    lambda msg: re.match(r"^change_(ban|shadowban|applyshadowban|verification|superverification|skypay|skypayv2|allowsell|allowsalev2|usermessagesban)_status [0-9]+$", msg.data)
+    regexp=re.compile(r"^change_(ban|shadowban|applyshadowban|verification|superverification|skypay|skypayv2|allowsell|allowsalev2|usermessagesban)_status [0-9]+$")
 )
 @rate_limit(1)
 async def change_user_status(message: types.CallbackQuery):
@@ -1433,7 +1462,7 @@ async def reset_imbalance(message: types.Message):
     await message.reply(text, reply=False)
 
 
-@dp.message_handler(lambda msg: re.match(r"^/add(b|bm|f) [a-zA-Z0-9]+ [0-9,.-]+$", msg.text))
+@dp.message_handler(regexp=re.compile(r"^/add(b|bm|f) [a-zA-Z0-9]+ [0-9,.-]+$"))
 @rate_limit(1)
 async def change_balance_frozen(message: types.Message):
     cmd, nickname, amount = message.text.split()
@@ -1452,7 +1481,7 @@ async def change_balance_frozen(message: types.Message):
     await message.reply(text, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: re.match(r"^/sndtx [a-zA-Z0-9]+ [0-9.]+$", msg.text))
+@dp.message_handler(regexp=re.compile(r"^/sndtx [a-zA-Z0-9]+ [0-9.]+$"))
 @rate_limit(1)
 async def withdraw_from_payments_node(message: types.Message):
     _, address, amount = message.text.split()
@@ -1460,7 +1489,7 @@ async def withdraw_from_payments_node(message: types.Message):
     await message.reply(text, reply_markup=k)
 
 
-@dp.message_handler(lambda msg: re.match(r"^/new_c [а-яa-zА-ЯA-Z0-9_]+$", msg.text))
+@dp.message_handler(regexp=re.compile(r"^/new_c [а-яa-zА-ЯA-Z0-9_]+$"))
 @rate_limit(1)
 async def new_campaign(message: types.Message):
     _, campaign_name = message.text.split()
@@ -1468,7 +1497,7 @@ async def new_campaign(message: types.Message):
     await message.reply(text, reply=False)
 
 
-@dp.message_handler(lambda msg: re.match(r"^/(frozen|balance) [a-zA-Z0-9]+ [0-9,.-]+$", msg.text))
+@dp.message_handler(regexp=re.compile(r"^/(frozen|balance) [a-zA-Z0-9]+ [0-9,.-]+$"))
 @rate_limit(1)
 async def set_balance_frozen(message: types.Message):
     cmd, nickname, amount = message.text.split()
@@ -1477,7 +1506,7 @@ async def set_balance_frozen(message: types.Message):
     await message.reply(text)
 
 
-@dp.message_handler(lambda msg: re.match(r"^/ban_messages_all [0-9]+$", msg.text))
+@dp.message_handler(regexp=re.compile(r"^/ban_messages_all [0-9]+$"))
 @rate_limit(1)
 async def ban_all_messages(message: types.Message):
     _, telegram_id = message.text.split()
@@ -1485,7 +1514,7 @@ async def ban_all_messages(message: types.Message):
     await message.reply(text)
 
 
-@dp.message_handler(lambda msg: re.match(r"^/cban_messages_all [0-9]+$", msg.text))
+@dp.message_handler(regexp=re.compile(r"^/cban_messages_all [0-9]+$"))
 @rate_limit(1)
 async def unban_all_messages(message: types.Message):
     _, telegram_id = message.text.split()
@@ -1500,6 +1529,13 @@ async def frozen(message: types.Message):
     await message.reply(text, reply_markup=k)
 
 
+@dp.message_handler(commands=["metrics"])
+@rate_limit(1)
+async def metrics(message: types.Message):
+    text, k = await dh.metrics(msg=message)
+    await message.reply(text, reply_markup=k)
+
+
 @dp.message_handler(commands=["stopw"])
 @rate_limit(1)
 async def stop_withdraw(message: types.Message):
@@ -1556,12 +1592,58 @@ async def some_error(update: types.update.Update, error):
     #     await send_message(chat_id=user_telegram_id, text=traceback.format_exc(), reply_markup=k)
 
 
+run_scheduler = not bool(os.environ.get('IGNORE_TASKS'))
+# every replica of this bot handles updates, only the leader runs the jobs that must not run twice
+leader = LeaderElection(redis_general_async, f"leader:{SYMBOL}:{bot.id}", ttl=LEADER_LEASE_TTL)
+leader.on_elected(broadcaster.resume)
+pollers = [
+    AdaptivePoller(
+        "updates",
+        leader.only(dh.fetch_updates),
+        dh.process_updates,
+        min_interval=POLL_MIN_INTERVAL,
+        max_interval=UPDATES_POLL_MAX_INTERVAL,
+        prefetch=POLL_PREFETCH,
+    ),
+    AdaptivePoller(
+        "control_updates",
+        leader.only(api.get_control_updates),
+        dh.process_control_updates,
+        min_interval=POLL_MIN_INTERVAL,
+        max_interval=CONTROL_POLL_MAX_INTERVAL,
+        prefetch=POLL_PREFETCH,
+    ),
+]
+
+loop_monitor = LoopMonitor(threshold=LOOP_STALL_THRESHOLD, debug=LOOP_DEBUG)
+
+
+async def startup(dispatcher: Dispatcher):
+    loop_monitor.start()
+    await api.start()
+    await reference_data.refresh()
+    await rate_feed.refresh()
+    ban_flags.start()
+    if run_scheduler:
+        await dh.replay_updates()
+        leader.start()
+        for poller in pollers:
+            poller.start()
+
+
 async def shutdown(dispatcher: Dispatcher):
+    for poller in pollers:
+        await poller.stop()
+    await leader.stop()
+    update_journal.close()
+    await ban_flags.stop()
+    await loop_monitor.stop()
     await dispatcher.storage.close()
     await dispatcher.storage.wait_closed()
+    await api.close()
 
 
-# async def startup(dispatcher: Dispatcher):
+# async def startup_notification(dispatcher: Dispatcher):
 #     if IS_TEST:
 #         tg_ids = await dh.get_all_telegram_ids()
 #         for tg_id in tg_ids:
@@ -1573,15 +1655,39 @@ async def shutdown(dispatcher: Dispatcher):
 
 if __name__ == "__main__":
     dp.middleware.setup(MessageMiddleware())
-    run_scheduler = not bool(os.environ.get('IGNORE_TASKS'))
+    scheduler = AsyncIOScheduler(event_loop=loop)
+    # the caches of this process are refreshed whether or not it runs the background tasks
+    scheduler.add_job(reference_data.refresh, "interval", seconds=REFERENCE_DATA_REFRESH_INTERVAL, max_instances=1)
+    scheduler.add_job(rate_feed.refresh, "interval", seconds=RATE_REFRESH_INTERVAL, max_instances=1)
     if run_scheduler:
-        scheduler = AsyncIOScheduler(event_loop=loop)
-        scheduler.add_job(dh.get_updates, "interval", seconds=4, max_instances=1)
-        scheduler.add_job(dh.get_control_updates, "interval", seconds=10, max_instances=1)
-        scheduler.add_job(dh.send_control_queued_messages, "interval", seconds=60, max_instances=1)
-        scheduler.add_job(dh.send_queued_messages, "interval", seconds=10, max_instances=1)
+        scheduler.add_job(leader.only(dh.send_control_queued_messages), "interval", seconds=10, max_instances=1)
+        scheduler.add_job(leader.only(dh.send_queued_messages), "interval", seconds=10, max_instances=1)
+        scheduler.add_job(leader.only(broadcaster.resume), "interval", seconds=30, max_instances=1)
         scheduler.add_job(
-            dh.get_profit, "interval", minutes=15, max_instances=1, next_run_time=datetime.utcnow() + timedelta(seconds=3)
+            leader.only(dh.get_profit),
+            "interval",
+            minutes=15,
+            max_instances=1,
+            next_run_time=datetime.utcnow() + timedelta(seconds=3),
         )
-        scheduler.start()
-    executor.start_polling(dp, loop=loop, on_shutdown=shutdown)
+    scheduler.start()
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_SECRET:
+            logger.warning("WEBHOOK_SECRET is not set, webhook requests are not authenticated")
+        webhook = WebhookServer(
+            dp,
+            path=WEBHOOK_PATH,
+            secret=WEBHOOK_SECRET,
+            concurrency=WEBHOOK_CONCURRENCY,
+            max_pending=WEBHOOK_MAX_PENDING,
+        )
+        webhook.run(
+            host=WEBHOOK_HOST,
+            port=WEBHOOK_PORT,
+            url=WEBHOOK_URL + WEBHOOK_PATH if WEBHOOK_URL else None,
+            loop=loop,
+            on_startup=startup,
+            on_shutdown=shutdown,
+        )
+    else:
+        executor.start_polling(dp, loop=loop, on_startup=startup, on_shutdown=shutdown)
@@ -0,0 +1,243 @@
+import asyncio
+import time
+import uuid
+from datetime import timedelta
+
+from aiogram.utils.exceptions import BotBlocked, ChatNotFound, MessageNotModified, UserDeactivated
+
+from api import api
+from settings import SYMBOL, bot, redis_general_async
+from utils.leader import RELEASE_SCRIPT, RENEW_SCRIPT
+from utils.logger import logger
+from utils.metrics import metrics
+from utils.outbound import Lane, outbound_lane
+
+UNREACHABLE_ERRORS = (BotBlocked, ChatNotFound, UserDeactivated)
+
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_CANCELLED = "cancelled"
+
+
+class Broadcaster:
+    """
+    Sends one text to every user as a background task.
+    The id list and the cursor are kept in Redis, so a restarted bot resumes the broadcast
+    from the last checkpoint instead of starting over. Users who blocked the bot are remembered
+    and skipped by later broadcasts.
+    Only the process holding the owner key sends: the key is taken with SET NX, renewed every
+    owner_ttl / 3 seconds, and a broadcast that cannot renew it stops at the next chunk,
+    so a replica resuming the broadcast never runs alongside the one that started it.
+    """
+
+    def __init__(self, redis, prefix, chunk_size=100, report_interval=30, owner_ttl=60):
+        self.redis = redis
+        self.chunk_size = chunk_size
+        self.report_interval = report_interval
+        self.owner_ttl = owner_ttl
+        self.identity = uuid.uuid4().hex
+        self._state_key = f"{prefix}:state"
+        self._ids_key = f"{prefix}:ids"
+        self._blocked_key = f"{prefix}:blocked"
+        self._owner_key = f"{prefix}:owner"
+        self._owner_renewed = None
+        self._renew = redis.register_script(RENEW_SCRIPT)
+        self._release = redis.register_script(RELEASE_SCRIPT)
+        self._task = None
+        self._state = {}
+        metrics.register("broadcast", self.stats)
+
+    def stats(self) -> dict:
+        return {key: self._state.get(key, 0) for key in ("cursor", "total", "sent", "failed", "blocked")}
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def _load_state(self) -> dict:
+        raw = await self.redis.hgetall(self._state_key)
+        state = {key.decode(): value.decode() for key, value in raw.items()}
+        for key in ("cursor", "total", "sent", "failed", "blocked", "admin_id", "report_message_id"):
+            state[key] = int(state.get(key) or 0)
+        return state
+
+    async def _acquire(self) -> bool:
+        started = time.monotonic()
+        if await self.redis.set(self._owner_key, self.identity, nx=True, px=int(self.owner_ttl * 1000)):
+            self._owner_renewed = started
+            return True
+        return False
+
+    def _owns(self) -> bool:
+        # a margin of half a renewal interval for the time between the check and the sends
+        return (
+            self._owner_renewed is not None
+            and time.monotonic() - self._owner_renewed < self.owner_ttl - self.owner_ttl / 6
+        )
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.owner_ttl / 3)
+            started = time.monotonic()
+            try:
+                renewed = await self._renew(keys=[self._owner_key], args=[self.identity, int(self.owner_ttl * 1000)])
+            except Exception as e:
+                logger.warning(f"Broadcast owner renewal failure: {e}")
+                continue
+            if not renewed:
+                self._owner_renewed = None
+                return
+            self._owner_renewed = started
+
+    async def _release_owner(self):
+        self._owner_renewed = None
+        try:
+            await self._release(keys=[self._owner_key], args=[self.identity])
+        except Exception as e:
+            logger.warning(f"Broadcast owner release failure: {e}")
+
+    async def start(self, text, admin_id) -> bool:
+        if self.is_running or await self.redis.hget(self._state_key, "status") == STATUS_RUNNING.encode():
+            return False
+        if not await self._acquire():
+            return False
+        try:
+            await self._prepare(text, admin_id)
+        except Exception:
+            await self._release_owner()
+            raise
+        self._task = asyncio.create_task(self._run())
+        return True
+
+    async def _prepare(self, text, admin_id):
+        telegram_ids = await api.get_all_telegram_ids()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self._ids_key, self._state_key)
+            for i in range(0, len(telegram_ids), 10_000):
+                pipe.rpush(self._ids_key, *telegram_ids[i : i + 10_000])
+            pipe.hset(
+                self._state_key,
+                mapping={
+                    "status": STATUS_RUNNING,
+                    "text": text,
+                    "admin_id": admin_id,
+                    "total": len(telegram_ids),
+                    "cursor": 0,
+                    "sent": 0,
+                    "failed": 0,
+                    "blocked": 0,
+                },
+            )
+            await pipe.execute()
+
+    async def resume(self):
+        """
+        Take over a running broadcast whose owner is gone.
+        """
+        if self.is_running or await self.redis.hget(self._state_key, "status") != STATUS_RUNNING.encode():
+            return
+        if await self._acquire():
+            logger.info("Resuming interrupted broadcast")
+            self._task = asyncio.create_task(self._run())
+
+    async def cancel(self) -> bool:
+        if await self.redis.hget(self._state_key, "status") != STATUS_RUNNING.encode():
+            return False
+        await self.redis.hset(self._state_key, "status", STATUS_CANCELLED)
+        return True
+
+    async def _send(self, telegram_id, text) -> str:
+        try:
+            await bot.send_message(chat_id=telegram_id, text=text)
+        except UNREACHABLE_ERRORS:
+            return "blocked"
+        except Exception as e:
+            logger.warning(f"Broadcast to {telegram_id} failed: {e}")
+            return "failed"
+        return "sent"
+
+    async def _run(self):
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            with outbound_lane(Lane.broadcast):
+                await self._broadcast()
+        except Exception as e:
+            logger.exception(f"Broadcast failure: {e}")
+        finally:
+            heartbeat.cancel()
+            await self._release_owner()
+
+    async def _broadcast(self):
+        state = self._state = await self._load_state()
+        started_at, started_cursor = time.monotonic(), state["cursor"]
+        reported_at = 0
+
+        while state["cursor"] < state["total"] and state["status"] == STATUS_RUNNING:
+            if not self._owns():
+                logger.warning("Broadcast owner key lost, leaving the broadcast to the replica that takes it")
+                return
+            chunk = await self.redis.lrange(self._ids_key, state["cursor"], state["cursor"] + self.chunk_size - 1)
+            telegram_ids = [int(telegram_id) for telegram_id in chunk]
+            if not telegram_ids:
+                break
+            known_blocked = await self.redis.smismember(self._blocked_key, telegram_ids)
+            targets = [tg_id for tg_id, is_blocked in zip(telegram_ids, known_blocked) if not is_blocked]
+            results = await asyncio.gather(*(self._send(tg_id, state["text"]) for tg_id in targets))
+
+            newly_blocked = [tg_id for tg_id, result in zip(targets, results) if result == "blocked"]
+            state["cursor"] += len(telegram_ids)
+            state["sent"] += results.count("sent")
+            state["failed"] += results.count("failed")
+            state["blocked"] += len(newly_blocked) + len(telegram_ids) - len(targets)
+
+            async with self.redis.pipeline(transaction=True) as pipe:
+                if newly_blocked:
+                    pipe.sadd(self._blocked_key, *newly_blocked)
+                pipe.hset(
+                    self._state_key,
+                    mapping={key: state[key] for key in ("cursor", "sent", "failed", "blocked")},
+                )
+                pipe.hget(self._state_key, "status")
+                *_, status = await pipe.execute()
+            state["status"] = status.decode()
+
+            if time.monotonic() - reported_at > self.report_interval:
+                await self._report(state, started_at, started_cursor)
+                reported_at = time.monotonic()
+
+        if state["status"] == STATUS_RUNNING:
+            state["status"] = STATUS_DONE
+            await self.redis.hset(self._state_key, "status", STATUS_DONE)
+        await self._report(state, started_at, started_cursor)
+
+    def _progress_text(self, state, started_at, started_cursor) -> str:
+        elapsed = time.monotonic() - started_at
+        speed = (state["cursor"] - started_cursor) / elapsed if elapsed else 0
+        eta = timedelta(seconds=round((state["total"] - state["cursor"]) / speed)) if speed else "—"
+        status = {STATUS_RUNNING: "идет", STATUS_DONE: "завершена", STATUS_CANCELLED: "остановлена"}[state["status"]]
+        return (
+            f"<b>Рассылка {status}</b>\n\n"
+            f"<b>Обработано:</b> {state['cursor']} из {state['total']}\n"
+            f"<b>Отправлено:</b> {state['sent']}\n"
+            f"<b>Заблокировали бота:</b> {state['blocked']}\n"
+            f"<b>Ошибок:</b> {state['failed']}\n"
+            f"<b>Скорость:</b> {speed:.1f} сообщ./сек\n"
+            f"<b>Осталось:</b> ~{eta}"
+        )
+
+    async def _report(self, state, started_at, started_cursor):
+        text = self._progress_text(state, started_at, started_cursor)
+        try:
+            if state["report_message_id"]:
+                await bot.edit_message_text(text, chat_id=state["admin_id"], message_id=state["report_message_id"])
+            else:
+                message = await bot.send_message(chat_id=state["admin_id"], text=text)
+                state["report_message_id"] = message.message_id
+                await self.redis.hset(self._state_key, "report_message_id", message.message_id)
+        except MessageNotModified:
+            pass
+        except Exception as e:
+            logger.warning(f"Broadcast progress was not reported: {e}")
+
+
+broadcaster = Broadcaster(redis_general_async, f"broadcast:{SYMBOL}")
@@ -8,26 +8,46 @@ from datetime import date, datetime, timedelta
 from decimal import ROUND_DOWN, Decimal
 
 import pandas as pd
-from aiogram.utils.exceptions import CantParseEntities
+from aiogram.utils.exceptions import BotBlocked, CantParseEntities, ChatNotFound, UserDeactivated
 from dateutil.parser import parse
 from dateutil.relativedelta import relativedelta
 
 from api import api
+from broadcast import broadcaster
 from constants import DealTypes
 from errors import BadRequestError
+from rate_feed import rate_feed
+from reference_data import reference_data
 from response_composer import rc
-from settings import (CONTROL_CHAT_ID, DEAL_CONTROL_CHAT_ID, EARNINGS_CHAT_ID, IS_TEST, LOTS_ON_PAGE, MESSAGES_CHAT_ID,
-                      MIN_PROMOCODE_AMOUNT_CRYPTO, MIN_PROMOCODE_AMOUNT_FIAT, PROFIT_CHAT_ID, PROMOCODE_TYPES, STATES,
-                      SUPPORT_ID, SYMBOL, bot, controller_bot, internal_controller_bot, redis_general)
+from settings import (CONTROL_CHAT_ID, DEAL_CONTROL_CHAT_ID, EARNINGS_CHAT_ID, IS_TEST, LOADER_CONCURRENCY,
+                      LOADER_MAX_BATCH_SIZE, LOADER_WAIT, LOTS_ON_PAGE, MEDIA_MAX_BYTES, MEDIA_RELAY_CONCURRENCY,
+                      MESSAGES_CHAT_ID, MIN_PROMOCODE_AMOUNT_CRYPTO, MIN_PROMOCODE_AMOUNT_FIAT, PROFIT_CHAT_ID,
+                      PROMOCODE_TYPES, STATES, SUPPORT_ID, SYMBOL, UPDATES_JOURNAL_COMPACT_BYTES, UPDATES_JOURNAL_PATH,
+                      UPDATES_WORKERS, bot, controller_bot, internal_controller_bot, redis_general_async)
 from translations import get_trans_list
+from utils.batch_loader import BatchLoader
 from utils.click import click
-from utils.helpers import get_correct_value, save_message, utc_now, parse_utc_datetime
+from utils.helpers import ban_flags, get_correct_value, save_message, utc_now, parse_utc_datetime
+from utils.journal import Journal
 from utils.logger import logger
+from utils.media_relay import MediaRejected, MediaRelay
+from utils.metrics import metrics
+from utils.outbound import Lane, outbound_lane
+from utils.request_scope import RequestScope
+from utils.retry_queue import RetryQueue
 from utils.sky_math import math as sky_math
+from utils.update_dispatcher import UpdateDispatcher
 from utils.validators import validate_amount_precision_right_for_symbol
 
-MESSAGE_QUEUE = []
-CONTROL_MESSAGE_QUEUE_V2 = []
+PERMANENT_SEND_ERRORS = (BotBlocked, CantParseEntities, ChatNotFound, UserDeactivated)
+
+update_dispatcher = UpdateDispatcher(workers=UPDATES_WORKERS)
+update_journal = Journal(UPDATES_JOURNAL_PATH, compact_bytes=UPDATES_JOURNAL_COMPACT_BYTES)
+
+LOADER_OPTIONS = dict(max_batch_size=LOADER_MAX_BATCH_SIZE, wait=LOADER_WAIT, concurrency=LOADER_CONCURRENCY)
+user_loader = BatchLoader(lambda user_id: api.get_user(user_id=user_id), name="users", **LOADER_OPTIONS)
+deal_loader = BatchLoader(api.get_deal, name="deals", **LOADER_OPTIONS)
+media_relay = MediaRelay(bot, max_bytes=MEDIA_MAX_BYTES, concurrency=MEDIA_RELAY_CONCURRENCY)
 
 
 def admin_only(method):
@@ -47,7 +67,6 @@ async def send_message(
     silent=True,
     is_control=False,
     queue_on_fail=False,
-    tries=0,
     is_internal_control=False,
 ):
     try:
@@ -62,152 +81,149 @@ async def send_message(
     except Exception as e:
         logger.exception(e)
         logger.warning(f"TEXT: {text}, chat_id: {chat_id}")
-        if queue_on_fail:
-            MESSAGE_QUEUE.append(
-                {
-                    "chat_id": chat_id,
-                    "text": text,
-                    "reply_markup": reply_markup,
-                    "save": save,
-                    "silent": silent,
-                    "is_control": is_control,
-                    "queue_on_fail": False,
-                    "tries": tries + 1,
-                    "is_internal_control": True,
-                }
-            )
+        if queue_on_fail and not isinstance(e, PERMANENT_SEND_ERRORS):
+            try:
+                await message_queue.put(
+                    {
+                        "chat_id": chat_id,
+                        "text": text,
+                        "reply_markup": reply_markup.to_python() if reply_markup else None,
+                        "save": save,
+                        "is_control": is_control,
+                        "is_internal_control": is_internal_control,
+                    }
+                )
+            except Exception:
+                logger.exception(f"message for {chat_id} was not queued")
         if not silent:
             raise
 
 
+async def _deliver_queued_message(kw):
+    await send_message(**kw, silent=False)
+
+
+message_queue = RetryQueue(
+    redis_general_async,
+    f"queue:{SYMBOL}:messages",
+    _deliver_queued_message,
+    permanent_errors=PERMANENT_SEND_ERRORS,
+)
+control_message_queue = RetryQueue(
+    redis_general_async,
+    f"queue:{SYMBOL}:control_messages",
+    _deliver_queued_message,
+    permanent_errors=PERMANENT_SEND_ERRORS,
+    max_tries=20,
+)
+
+
 START_TXS_DATETIME = {}
 
 
 class DataHandler:
     async def send_queued_messages(self):
-        while MESSAGE_QUEUE:
-            item = MESSAGE_QUEUE.pop()
-            if item["tries"] < 10:
-                await send_message(**item)
-                await asyncio.sleep(0.1)
+        with outbound_lane(Lane.deal):
+            await message_queue.process()
 
     async def send_control_queued_messages(self):
-        while CONTROL_MESSAGE_QUEUE_V2:
-            coroutine, kw = CONTROL_MESSAGE_QUEUE_V2.pop()
-            success = False
-            while not success:
+        with outbound_lane(Lane.control):
+            await control_message_queue.process()
+
+    async def transaction_update(self, update):
+        amount = update["amount"]
+        t = update["type"]
+        user = await user_loader.load(update["user_id"])
+        if t == "in":
+            text, k = await rc.new_income(user, amount)
+        elif t == "out":
+            link = update["link"]
+            text, k = await rc.transaction_processed(user, link)
+        await send_message(chat_id=user["telegram_id"], text=text, reply_markup=k, queue_on_fail=True)
+
+    async def message_update(self, update):
+        sender, receiver = await asyncio.gather(
+            user_loader.load(update["sender_id"]), user_loader.load(update["receiver_id"])
+        )
+        message = update["message"]
+        media_url = update["media_url"]
+        if receiver["telegram_id"]:
+            if media_url:
                 try:
-                    await coroutine(**kw)
-                    success = True
-                    await asyncio.sleep(0.5)
-                except CantParseEntities:
-                    success = True
+                    if media_url[-3:] == 'pdf':
+                        await bot.send_document(chat_id=receiver["telegram_id"], document=media_url)
+                    else:
+                        await bot.send_photo(chat_id=receiver["telegram_id"], photo=media_url)
                 except Exception as e:
                     logger.exception(e)
-                    await asyncio.sleep(5)
-
-    async def transaction_updates(self, updates):
-        for update in updates:
-            amount = update["amount"]
-            t = update["type"]
-            user = await api.get_user(user_id=update["user_id"])
-            if t == "in":
-                text, k = await rc.new_income(user, amount)
-            elif t == "out":
-                link = update["link"]
-                text, k = await rc.transaction_processed(user, link)
-            await send_message(chat_id=user["telegram_id"], text=text, reply_markup=k, queue_on_fail=True)
-
-    async def message_updates(self, updates):
-        for update in updates:
-            sender = await api.get_user(user_id=update["sender_id"])
-            message = update["message"]
-            media_url = update["media_url"]
-            receiver = await api.get_user(user_id=update["receiver_id"])
-            if receiver["telegram_id"]:
-                if media_url:
-                    try:
-                        if media_url[-3:] == 'pdf':
-                            await bot.send_document(chat_id=receiver["telegram_id"], document=media_url)
-                        else:
-                            await bot.send_photo(chat_id=receiver["telegram_id"], photo=media_url)
-                    except Exception as e:
-                        logger.exception(e)
-                    text, k = await rc.photo_received(receiver, sender)
-                else:
-                    text, k = await rc.message_received(receiver, sender, message)
-
-                await send_message(chat_id=receiver["telegram_id"], text=text, reply_markup=k, queue_on_fail=True)
-
-    async def new_referral_updates(self, updates):
-        for update in updates:
-            user = await api.get_user(user_id=update["user_id"])
-            referral = update["referral"]
-            text, k = await rc.new_referral(user, referral)
-            await send_message(chat_id=user["telegram_id"], text=text, reply_markup=k)
+                text, k = await rc.photo_received(receiver, sender)
+            else:
+                text, k = await rc.message_received(receiver, sender, message)
 
-    async def accounts_join_updates(self, updates):
-        for update in updates:
-            tg_user = await api.get_user(user_id=update["tg_account"])
-            web_user = await api.get_user(user_id=update["web_account"])
-            token = update["token"]
-            text, k = await rc.new_accounts_join(tg_user, web_user, token)
-            await send_message(chat_id=tg_user["telegram_id"], text=text, reply_markup=k)
+            await send_message(chat_id=receiver["telegram_id"], text=text, reply_markup=k, queue_on_fail=True)
 
-    async def timeouts_updates(self, updates):
-        for update in updates:
-            user = await api.get_user(user_id=update["user_id"])
-            text, _ = await rc.message_about_deal_timeout(user, update["deal_id"])
-            if user["telegram_id"]:
-                await send_message(chat_id=user["telegram_id"], text=text)
+    async def new_referral_update(self, update):
+        user = await user_loader.load(update["user_id"])
+        referral = update["referral"]
+        text, k = await rc.new_referral(user, referral)
+        await send_message(chat_id=user["telegram_id"], text=text, reply_markup=k)
 
-    async def deal_cancel_updates(self, updates):
-        for update in updates:
-            user = await api.get_user(user_id=update["user_id"])
-            text, _ = await rc.opponent_canceled_deal(user, update["deal_id"])
-            if user["telegram_id"]:
-                await send_message(chat_id=user["telegram_id"], text=text)
+    async def accounts_join_update(self, update):
+        tg_user, web_user = await asyncio.gather(
+            user_loader.load(update["tg_account"]), user_loader.load(update["web_account"])
+        )
+        token = update["token"]
+        text, k = await rc.new_accounts_join(tg_user, web_user, token)
+        await send_message(chat_id=tg_user["telegram_id"], text=text, reply_markup=k)
+
+    async def timeout_update(self, update):
+        user = await user_loader.load(update["user_id"])
+        text, _ = await rc.message_about_deal_timeout(user, update["deal_id"])
+        if user["telegram_id"]:
+            await send_message(chat_id=user["telegram_id"], text=text)
 
-    async def promocode_activation_updates(self, updates):
-        for update in updates:
-            user = await api.get_user(user_id=update["user_id"])
-            text, _ = await rc.promocode_activated_by(user, update["activator"], update["amount"], update["code"])
-            await send_message(chat_id=user["telegram_id"], text=text, queue_on_fail=True)
+    async def deal_cancel_update(self, update):
+        user = await user_loader.load(update["user_id"])
+        text, _ = await rc.opponent_canceled_deal(user, update["deal_id"])
+        if user["telegram_id"]:
+            await send_message(chat_id=user["telegram_id"], text=text)
 
-    async def deal_dispute_updates(self, updates):
-        for update in updates:
-            user = await api.get_user(user_id=update["user_id"])
-            dispute = await api.get_dispute(update["deal_id"])
-            text = None
-            if dispute["opponent"] and dispute["initiator"]:
-                text, k = await rc.both_opened_dispute(dispute["initiator"], update["deal_id"])
-            else:
-                deal = await api.get_deal(update["deal_id"])
-                if deal['type'] != DealTypes.sky_pay_v2:
-                    can_decline = deal["buyer"]["id"] == user["id"]
-                    text, k = await rc.opponent_opened_dispute(
-                        user, update["deal_id"], update["dispute_time"], can_decline=can_decline
-                    )
-            if user["telegram_id"] and text:
-                await send_message(chat_id=user["telegram_id"], text=text, reply_markup=k, queue_on_fail=True)
+    async def promocode_activation_update(self, update):
+        user = await user_loader.load(update["user_id"])
+        text, _ = await rc.promocode_activated_by(user, update["activator"], update["amount"], update["code"])
+        await send_message(chat_id=user["telegram_id"], text=text, queue_on_fail=True)
+
+    async def deal_dispute_update(self, update):
+        user = await user_loader.load(update["user_id"])
+        dispute = await api.get_dispute(update["deal_id"])
+        text = None
+        if dispute["opponent"] and dispute["initiator"]:
+            text, k = await rc.both_opened_dispute(dispute["initiator"], update["deal_id"])
+        else:
+            deal = await deal_loader.load(update["deal_id"])
+            if deal['type'] != DealTypes.sky_pay_v2:
+                can_decline = deal["buyer"]["id"] == user["id"]
+                text, k = await rc.opponent_opened_dispute(
+                    user, update["deal_id"], update["dispute_time"], can_decline=can_decline
+                )
+        if user["telegram_id"] and text:
+            await send_message(chat_id=user["telegram_id"], text=text, reply_markup=k, queue_on_fail=True)
 
-    async def deal_dispute_notifications_updates(self, updates):
-        for update in updates:
-            user = await api.get_user(user_id=update["user_id"])
-            text, k = await rc.dispute_opened_notification(user, update["deal_id"])
-            if user["telegram_id"]:
-                await send_message(chat_id=user["telegram_id"], text=text, reply_markup=k, queue_on_fail=True)
+    async def deal_dispute_notification_update(self, update):
+        user = await user_loader.load(update["user_id"])
+        text, k = await rc.dispute_opened_notification(user, update["deal_id"])
+        if user["telegram_id"]:
+            await send_message(chat_id=user["telegram_id"], text=text, reply_markup=k, queue_on_fail=True)
 
-    async def deal_closed_dispute_updates(self, updates):
-        for update in updates:
-            user = await api.get_user(user_id=update["user_id"])
-            winner = update["winner"]
-            if update["admin"]:
-                text, k = await rc.deal_closed_by_dispute_admin(user, update["deal_id"], winner)
-            else:
-                text, k = await rc.deal_closed_by_dispute(user, update["deal_id"], winner)
-            if user["telegram_id"]:
-                await send_message(chat_id=user["telegram_id"], text=text, reply_markup=k, queue_on_fail=True)
+    async def deal_closed_dispute_update(self, update):
+        user = await user_loader.load(update["user_id"])
+        winner = update["winner"]
+        if update["admin"]:
+            text, k = await rc.deal_closed_by_dispute_admin(user, update["deal_id"], winner)
+        else:
+            text, k = await rc.deal_closed_by_dispute(user, update["deal_id"], winner)
+        if user["telegram_id"]:
+            await send_message(chat_id=user["telegram_id"], text=text, reply_markup=k, queue_on_fail=True)
 
     async def control_updates(self, updates):
         for update in updates:
@@ -228,11 +244,8 @@ class DataHandler:
                 "<b>Текущий баланс:</b> {balance} {symbol}\n"
                 "<b>Текущая заморозка:</b> {frozen} {symbol}"
             ).format(**update)
-            CONTROL_MESSAGE_QUEUE_V2.append(
-                (
-                    send_message,
-                    dict(chat_id=CONTROL_CHAT_ID, text=text, save=False, is_internal_control=True, silent=False),
-                )
+            await control_message_queue.put(
+                dict(chat_id=CONTROL_CHAT_ID, text=text, save=False, is_internal_control=True)
             )
             for message_type in ("deal", "sky pay", "sale", "processing temp seller balance", "Cpayment"):
                 update["message"] = update["message"].replace("<", "").replace(">", "")
@@ -253,58 +266,51 @@ class DataHandler:
                         text += f"\n<b>Сумма в {deal['currency'].upper()}:</b> {deal['amount_currency']}"
                         text += f"\n<b>Реквизиты:</b> {deal['requisite']}"
                         text += f"\n<b>Имейл покупателя:</b> {email}"
-                    CONTROL_MESSAGE_QUEUE_V2.append(
-                        (
-                            send_message,
-                            dict(chat_id=DEAL_CONTROL_CHAT_ID, text=text, is_control=True, save=False, silent=False),
-                        )
+                    await control_message_queue.put(
+                        dict(chat_id=DEAL_CONTROL_CHAT_ID, text=text, is_control=True, save=False)
                     )
                     break
 
-    async def control_usermessages(self, updates):
-        for update in updates:
-            base_text = f'📨  /u{update["sender"]}  ➡️  /u{update["receiver"]}'
-            if update["url"]:
-                try:
-                    if update['url'][-3:] == 'pdf':
-                        await bot.send_document(chat_id=MESSAGES_CHAT_ID, document=update['url'], caption=base_text)
-                    else:
-                        await bot.send_photo(chat_id=MESSAGES_CHAT_ID, photo=update["url"], caption=base_text)
-                except Exception:
-                    logger.exception("usermessage not controled")
-            else:
-                text = base_text + f'\n\n{update["message"]}'
-                await send_message(text, chat_id=MESSAGES_CHAT_ID, save=False, queue_on_fail=True)
+    async def control_usermessage(self, update):
+        base_text = f'📨  /u{update["sender"]}  ➡️  /u{update["receiver"]}'
+        if update["url"]:
+            try:
+                if update['url'][-3:] == 'pdf':
+                    await bot.send_document(chat_id=MESSAGES_CHAT_ID, document=update['url'], caption=base_text)
+                else:
+                    await bot.send_photo(chat_id=MESSAGES_CHAT_ID, photo=update["url"], caption=base_text)
+            except Exception:
+                logger.exception("usermessage not controled")
+        else:
+            text = base_text + f'\n\n{update["message"]}'
+            await send_message(text, chat_id=MESSAGES_CHAT_ID, save=False, queue_on_fail=True)
 
-    async def earnings(self, updates):
-        for update in updates:
-            income = update["income"]
-            prefix = "+" if income > 0 else ""
-            await send_message(f"{prefix} {income} {SYMBOL.upper()}", chat_id=EARNINGS_CHAT_ID, save=False)
+    async def earning_update(self, update):
+        income = update["income"]
+        prefix = "+" if income > 0 else ""
+        await send_message(f"{prefix} {income} {SYMBOL.upper()}", chat_id=EARNINGS_CHAT_ID, save=False)
 
-    async def secondary_node_updates(self, updates):
+    async def secondary_node_update(self, update):
         if SYMBOL != "btc":
             return
-        for update in updates:
-            amount = update["amount"]
-            link = update["link"]
-            text = f"<b>Пополнение запаса!</b>\n\n" f"Сумма: {amount} BTC\n" f"Ссылка: {link}"
-            await send_message(text, chat_id=PROFIT_CHAT_ID, save=False)
+        amount = update["amount"]
+        link = update["link"]
+        text = f"<b>Пополнение запаса!</b>\n\n" f"Сумма: {amount} BTC\n" f"Ссылка: {link}"
+        await send_message(text, chat_id=PROFIT_CHAT_ID, save=False)
 
-    async def auto_withdrawal_updates(self, updates):
-        for update in updates:
-            amount = update["amount"]
-            link = update["link"]
-            symbol = update.get("symbol", "BTC")
-            text = f"<b>Автоматика!</b>\n\n" f"Сумма: {amount} {symbol}\n" f"Ссылка: {link}"
-            await send_message(text, chat_id=PROFIT_CHAT_ID, save=False)
+    async def auto_withdrawal_update(self, update):
+        amount = update["amount"]
+        link = update["link"]
+        symbol = update.get("symbol", "BTC")
+        text = f"<b>Автоматика!</b>\n\n" f"Сумма: {amount} {symbol}\n" f"Ссылка: {link}"
+        await send_message(text, chat_id=PROFIT_CHAT_ID, save=False)
 
-    async def deals_referrals_updates(self, updates):
-        for update in updates:
-            user = await api.get_user(user_id=update["user_id"])
-            referral = await api.get_user(user_id=update["referral_id"])
-            text, k = await rc.referral_earning(user, referral, update["amount"])
-            await send_message(chat_id=user["telegram_id"], text=text, reply_markup=k)
+    async def deal_referral_update(self, update):
+        user, referral = await asyncio.gather(
+            user_loader.load(update["user_id"]), user_loader.load(update["referral_id"])
+        )
+        text, k = await rc.referral_earning(user, referral, update["amount"])
+        await send_message(chat_id=user["telegram_id"], text=text, reply_markup=k)
 
     async def _notify_user_dispute_is_ready(self, user, deal):
         text, k = await rc.notify_dispute_is_ready(user, deal)
@@ -312,86 +318,136 @@ class DataHandler:
             chat_id=user["telegram_id"], text=text, reply_markup=k, queue_on_fail=True
         )
 
-    async def deals_updates(self, updates):
-        for update in updates:
-            user = await api.get_user(user_id=update["user_id"])
-            opponent = await api.get_user(user_id=update["opponent"])
-            deal = await api.get_deal(deal_id=update["deal_id"])
-            if deal["state"] == STATES[0]:
-                limit_for_deal = (await api.get_settings())["base_deal_time"]
-                text, k = await rc.propose_deal(user, deal["lot"], deal, opponent["nickname"], limit_for_deal)
-            elif deal["state"] == STATES[1]:
-                long_limit = (await api.get_settings())["advanced_deal_time"]
-                if deal["lot"]["type"] == "buy":
-                    text, k = await rc.opponent_confirmed_deal(user, deal, long_limit=long_limit)
-                else:
-                    deal = await api.get_deal(update["deal_id"], with_merchant=True)
-                    required_mask = False
-                    if deal["payment_id"] and deal["merchant"]:
-                        required_mask = deal["merchant"]["required_mask"]
-                    text, k = await rc.confirm_sent_fiat(user, deal, long_limit=long_limit, required_mask=required_mask)
-            elif deal["state"] == STATES[2]:
-                mask = await api.get_mask(deal["identificator"])
-
-                is_show_dispute_button = user['rating'] > 0 or user['is_verify']
-                if (
-                    deal["type"] in (DealTypes.sky_pay, DealTypes.fast, DealTypes.sky_pay_v2)
-                ):
-                    is_show_dispute_button = utc_now() > (parse_utc_datetime(deal["created"]) + timedelta(minutes=5)) and user['rating'] > 0
-
-                if not is_show_dispute_button and user["telegram_id"] and (user['rating'] > 0 or user['is_verify']):
-                    async def notify_user(u, d):
-                        await asyncio.sleep(300.0)
-                        d = await api.get_deal(d['identificator'])
-                        if d['state'] == STATES[2]:
-                            await self._notify_user_dispute_is_ready(u, d)
-
-                    asyncio.create_task(notify_user(user, deal))
-
-                text_name = "please_check_fiat" if is_show_dispute_button else "please_check_fiat_with_5_min"
-                text, k = await rc.please_check_fiat(user, deal, mask, text_name, is_show_dispute_button)
-            elif deal["state"] == STATES[3]:
-                text, k = await rc.you_received_crypto(user, deal)
-            elif deal["state"] == STATES[4]:
-                text, k = await rc.opponent_canceled_deal(user, deal["identificator"])
-            if user["telegram_id"]:
-                await send_message(chat_id=user["telegram_id"], text=text, reply_markup=k, queue_on_fail=True)
-
-    async def parse_updates(self, updates):
-        await self.message_updates(updates["messages"])
-        await self.new_referral_updates(updates["new-referral"])
-        await self.transaction_updates(updates["transactions"])
-        await self.accounts_join_updates(updates["accounts_join"])
-        await self.timeouts_updates(updates["deals"]["timeouts"])
-        await self.deals_referrals_updates(updates["deals"]["referrals"])
-        await self.deals_updates(updates["deals"]["deals"])
-        await self.deal_cancel_updates(updates["deals"]["cancel"])
-        await self.promocode_activation_updates(updates["promocodes"])
-        await self.deal_dispute_updates(updates["deals"]["disputes"])
-        await self.deal_dispute_notifications_updates(updates["deals"]["dispute_notifications"])
-        await self.deal_closed_dispute_updates(updates["deals"]["closed_disputes"])
-        await self.control_usermessages(updates["usermessages"])
-        await self.earnings(updates["earnings"])
-        await self.secondary_node_updates(updates["secondary_node"])
-        # await self.auto_withdrawal_updates(updates['autowithdrawal'])
-
-    async def get_updates(self):
-        try:
-            updates = await api.get_updates()
-            await self.parse_updates(updates)
-        except Exception as e:
-            logger.exception(f"updates failure: {e}")
+    async def deal_update(self, update):
+        user, opponent, deal = await asyncio.gather(
+            user_loader.load(update["user_id"]),
+            user_loader.load(update["opponent"]),
+            deal_loader.load(update["deal_id"]),
+        )
+        if deal["state"] == STATES[0]:
+            limit_for_deal = (await reference_data.settings())["base_deal_time"]
+            text, k = await rc.propose_deal(user, deal["lot"], deal, opponent["nickname"], limit_for_deal)
+        elif deal["state"] == STATES[1]:
+            long_limit = (await reference_data.settings())["advanced_deal_time"]
+            if deal["lot"]["type"] == "buy":
+                text, k = await rc.opponent_confirmed_deal(user, deal, long_limit=long_limit)
+            else:
+                deal = await api.get_deal(update["deal_id"], with_merchant=True)
+                required_mask = False
+                if deal["payment_id"] and deal["merchant"]:
+                    required_mask = deal["merchant"]["required_mask"]
+                text, k = await rc.confirm_sent_fiat(user, deal, long_limit=long_limit, required_mask=required_mask)
+        elif deal["state"] == STATES[2]:
+            mask = await api.get_mask(deal["identificator"])
+
+            is_show_dispute_button = user['rating'] > 0 or user['is_verify']
+            if (
+                deal["type"] in (DealTypes.sky_pay, DealTypes.fast, DealTypes.sky_pay_v2)
+            ):
+                is_show_dispute_button = utc_now() > (parse_utc_datetime(deal["created"]) + timedelta(minutes=5)) and user['rating'] > 0
+
+            if not is_show_dispute_button and user["telegram_id"] and (user['rating'] > 0 or user['is_verify']):
+                async def notify_user(u, d):
+                    await asyncio.sleep(300.0)
+                    d = await api.get_deal(d['identificator'])
+                    if d['state'] == STATES[2]:
+                        await self._notify_user_dispute_is_ready(u, d)
+
+                asyncio.create_task(notify_user(user, deal))
+
+            text_name = "please_check_fiat" if is_show_dispute_button else "please_check_fiat_with_5_min"
+            text, k = await rc.please_check_fiat(user, deal, mask, text_name, is_show_dispute_button)
+        elif deal["state"] == STATES[3]:
+            text, k = await rc.you_received_crypto(user, deal)
+        elif deal["state"] == STATES[4]:
+            text, k = await rc.opponent_canceled_deal(user, deal["identificator"])
+        if user["telegram_id"]:
+            await send_message(chat_id=user["telegram_id"], text=text, reply_markup=k, queue_on_fail=True)
 
-    async def get_control_updates(self):
+    def _update_categories(self) -> dict:
+        """
+        "category" or "deals.category" of /updates -> (handler, ordering key fields).
+        """
+        by_user = (("user", "user_id"),)
+        by_user_and_deal = (("user", "user_id"), ("deal", "deal_id"))
+        return {
+            "messages": (self.message_update, (("user", "receiver_id"),)),
+            "new-referral": (self.new_referral_update, by_user),
+            "transactions": (self.transaction_update, by_user),
+            "accounts_join": (self.accounts_join_update, (("user", "tg_account"),)),
+            "deals.timeouts": (self.timeout_update, by_user_and_deal),
+            "deals.referrals": (self.deal_referral_update, by_user),
+            "deals.deals": (self.deal_update, by_user_and_deal),
+            "deals.cancel": (self.deal_cancel_update, by_user_and_deal),
+            "promocodes": (self.promocode_activation_update, by_user),
+            "deals.disputes": (self.deal_dispute_update, by_user_and_deal),
+            "deals.dispute_notifications": (self.deal_dispute_notification_update, by_user_and_deal),
+            "deals.closed_disputes": (self.deal_closed_dispute_update, by_user_and_deal),
+            "usermessages": (self.control_usermessage, ()),
+            "earnings": (self.earning_update, ()),
+            "secondary_node": (self.secondary_node_update, ()),
+            # "autowithdrawal": (self.auto_withdrawal_update, ()),
+        }
+
+    def _flatten_updates(self, updates) -> list:
+        items = []
+        for name in self._update_categories():
+            group, _, category = name.rpartition(".")
+            for update in (updates[group] if group else updates)[category]:
+                items.append((name, update))
+        return items
+
+    async def _journaled_update(self, seq, handler, update):
         try:
-            updates = await api.get_control_updates()
-            await self.control_updates(updates)
+            await handler(update)
         except Exception as e:
-            logger.exception(f"updates failure: {e}")
+            logger.exception(f"updates job {handler.__name__} failure: {e}")
+        finally:
+            update_journal.ack(seq)
+
+    async def parse_updates(self, entries):
+        """
+        Run journaled (seq, category, update) entries; each is acknowledged once its handler is done.
+        """
+        categories = self._update_categories()
+        jobs = []
+        for seq, name, update in entries:
+            handler, key_fields = categories[name]
+            # updates without a user go to a single service chat, so they are ordered per handler
+            keys = tuple((kind, update[field]) for kind, field in key_fields) or (("chat", handler.__name__),)
+            jobs.append((keys, self._journaled_update, seq, handler, update))
+        await update_dispatcher.run(jobs)
+
+    async def fetch_updates(self) -> list:
+        """
+        Fetch /updates and journal them before returning; the backend forgets a batch once it is fetched,
+        so it must be on disk before it waits in the poller's queue.
+        """
+        updates = await api.get_updates()
+        if not updates:
+            return []
+        return await update_journal.append(self._flatten_updates(updates))
+
+    async def process_updates(self, entries):
+        with outbound_lane(Lane.deal):
+            await self.parse_updates(entries)
+
+    async def replay_updates(self):
+        """
+        Process the updates journaled by a previous run that were not acknowledged.
+        """
+        entries = update_journal.open()
+        with outbound_lane(Lane.deal):
+            await self.parse_updates(entries)
+
+    async def process_control_updates(self, updates):
+        with outbound_lane(Lane.control):
+            await self.control_updates(updates)
 
     async def get_profit(self):
         text = await self._get_profit_text()
-        await send_message(text, chat_id=PROFIT_CHAT_ID, save=False)
+        with outbound_lane(Lane.control):
+            await send_message(text, chat_id=PROFIT_CHAT_ID, save=False)
 
     def _get_id_from_start_msg(self, msg, prefix, length):
         param_text = msg.text.split()
@@ -439,7 +495,7 @@ class DataHandler:
             return await rc.not_enough_funds_tx(user, amount, wallet["balance"])
         else:
             START_TXS_DATETIME[address] = datetime.utcnow()
-            api.send_transaction_sync(user["id"], amount, address, with_proxy=True, token=token)
+            await api.send_transaction(user["id"], amount, address, with_proxy=True, token=token)
             return await rc.done(user)
 
     @click
@@ -448,11 +504,14 @@ class DataHandler:
 
     @click
     async def wallet(self, user):
-        await api.create_wallet_if_not_exists(user["id"])
-        stat = await api.user_stat(user["id"])
-        wallet = await api.get_wallet(user["id"])
-
-        is_bound = (await api.is_web_bound(user["id"]))["status"]
+        async with RequestScope() as scope:
+            created = scope.fetch(api.create_wallet_if_not_exists, user["id"])
+            stat, wallet, is_bound = await asyncio.gather(
+                scope.fetch(api.user_stat, user["id"], after=[created]),
+                scope.fetch(api.get_wallet, user["id"], after=[created]),
+                scope.fetch(api.is_web_bound, user["id"]),
+            )
+        is_bound = is_bound["status"]
 
         return await rc.wallet(
             user,
@@ -481,7 +540,7 @@ class DataHandler:
     async def exchange(self, user):
         active_deals_count = await api.get_active_deals_count(user["id"])
         lots_cnt = len(await api.get_user_lots(user["id"]))
-        rate = await api.get_rate(user["currency"])
+        rate = await rate_feed.get(user["currency"])
         return await rc.exchange(user, rate, active_deals_count, lots_cnt)
 
     @click
@@ -509,7 +568,7 @@ class DataHandler:
     @click
     async def deposit(self, user):
         wallet = await api.get_wallet(user["id"])
-        min_deposit = (await api.get_settings())['min_tx_amount']
+        min_deposit = (await reference_data.settings())['min_tx_amount']
         text, _ = await rc.deposit(user, min_deposit)
         await send_message(chat_id=user["telegram_id"], text=text)
         return wallet["address"], None
@@ -528,7 +587,7 @@ class DataHandler:
 
     @click
     async def withdraw(self, user):
-        settings = await api.get_settings()
+        settings = await reference_data.settings()
         min_to_withdraw = settings["min_tx_amount"]
         wallet = await api.get_wallet(user["id"])
         balance = wallet["balance"]
@@ -546,7 +605,7 @@ class DataHandler:
         is_wallet_valid = (await api.address_validation_check(address))["is_valid"]
         if not is_wallet_valid:
             return await rc.wrong_address(user), None
-        settings = await api.get_settings()
+        settings = await reference_data.settings()
         min_to_withdraw = settings["min_tx_amount"]
         balance = wallet["balance"]
         commission = await api.get_withdraw_commission(balance)
@@ -575,7 +634,7 @@ class DataHandler:
             return await rc.wrong_sum(user), False
 
         balance = wallet["balance"]
-        settings = await api.get_settings()
+        settings = await reference_data.settings()
         min_to_withdraw = settings["min_tx_amount"]
         if amount > Decimal(str(balance)) or amount < Decimal(str(min_to_withdraw)):
             return await rc.wrong_sum(user), False
@@ -589,7 +648,7 @@ class DataHandler:
 
         wallet = await api.get_wallet(user["id"])
         balance = wallet["balance"]
-        settings = await api.get_settings()
+        settings = await reference_data.settings()
         min_to_withdraw = settings["min_tx_amount"]
 
         if amount > Decimal(str(balance)) or amount < Decimal(str(min_to_withdraw)):
@@ -625,9 +684,7 @@ class DataHandler:
         wallet = await api.get_wallet(user["id"])
         currencies = {lot["currency"] for lot in lots}
         currencies.add(user["currency"])
-        rates = {}
-        for currency in currencies:
-            rates[currency] = Decimal(str(await api.get_rate(currency)))
+        rates = {currency: Decimal(str(rate)) for currency, rate in (await rate_feed.get_many(currencies)).items()}
 
         page = int(data.split()[-1])
         lots_count = len(lots)
@@ -654,22 +711,21 @@ class DataHandler:
             new_lot_type = "sell"
         else:
             return await rc.wrong_lot_type(user), None
-        brokers = await api.get_brokers(user["currency"])
+        brokers = await reference_data.brokers(user["currency"])
         return await rc.choose_broker(user, [b["name"] for b in brokers]), new_lot_type
 
     @click
     async def handle_broker(self, user, text):
         broker = text
-        brokers = await api.get_brokers(user["currency"])
-        target_broker = next(filter(lambda b: b["name"] == broker, brokers), None)
+        target_broker = await reference_data.broker(name=broker, currency=user["currency"])
         if target_broker is None:
-            return await rc.wrong_broker(user, brokers), None
-        rate = await api.get_rate(user["currency"])
+            return await rc.wrong_broker(user, await reference_data.brokers(user["currency"])), None
+        rate = await rate_feed.get(user["currency"])
         return await rc.choose_rate(user, rate), target_broker["id"]
 
     @click
     async def handle_rate(self, user, text):
-        rate = await api.get_rate(user["currency"])
+        rate = await rate_feed.get(user["currency"])
         rate_variation = await self._get_rate_variation(user['currency'])
         try:
             new_lot_rate, coefficient = await sky_math.parse_rate(
@@ -715,19 +771,15 @@ class DataHandler:
 
     @click
     async def market(self, user, page, t):
-        rate = await api.get_rate(user["currency"])
+        rate = await rate_feed.get(user["currency"])
         total_lots = await api.get_lots(user["id"], t)
         lots = total_lots[(page - 1) * LOTS_ON_PAGE : page * LOTS_ON_PAGE]
         pages = math.ceil(len(total_lots) / LOTS_ON_PAGE)
         return await rc.market(user, lots, page, pages, rate, t)
 
-    async def _get_broker(self, broker_id=None, name=None):
-        brokers = await api.get_brokers()
-        return next(filter(lambda b: b["name"] == name or b["id"] == broker_id, brokers), None)
-
     @click
     async def menu_lots_buy_from_broker(self, user, data):
-        broker = await self._get_broker(broker_id=data.split()[2])
+        broker = await reference_data.broker(broker_id=data.split()[2])
         page = int(data.split()[-1])
         lots = await api.get_broker_lots(user["id"], "buy", broker["id"])
         lots_cnt = len(lots)
@@ -737,7 +789,7 @@ class DataHandler:
 
     @click
     async def menu_lots_sell_from_broker(self, user, data):
-        broker = await self._get_broker(broker_id=data.split()[2])
+        broker = await reference_data.broker(broker_id=data.split()[2])
         page = int(data.split()[-1])
         lots = await api.get_broker_lots(user["id"], "sell", broker["id"])
         lots_cnt = len(list(lots))
@@ -748,14 +800,16 @@ class DataHandler:
         pages = math.ceil(lots_cnt / LOTS_ON_PAGE)
         return await rc.menu_lots_sell_from_broker(user, lots, page, pages, broker)
 
-    async def are_users_active(self, lot, user):
-        lot_user = await api.get_user(user_id=lot["user_id"])
+    async def are_users_active(self, lot, user, scope=None):
+        scope = scope or RequestScope()
+        lot_user = await scope.fetch(api.get_user, user_id=lot["user_id"])
         return not lot_user["is_baned"] and not user["is_baned"]
 
-    async def is_enough_money(self, lot, user):
+    async def is_enough_money(self, lot, user, scope=None):
+        scope = scope or RequestScope()
         target_money = lot["limit_from"] / lot["rate"]
         seller = lot["user_id"] if lot["type"] == "sell" else user["id"]
-        seller_wallet = await api.get_wallet(seller)
+        seller_wallet = await scope.fetch(api.get_wallet, seller)
         return seller_wallet["balance"] >= target_money
 
     async def session_closed(self):
@@ -772,16 +826,17 @@ class DataHandler:
         if lot["user_id"] == user["id"]:
             return await rc.self_lot(user, lot)
         else:
-            lot_user_stat = await api.user_stat(lot["user_id"])
-            lot_user = await api.get_user(user_id=lot["user_id"])
-            if lot["type"] == "sell":
-                wallet = await api.get_wallet(lot["user_id"])
-            elif lot["type"] == "buy":
-                wallet = await api.get_wallet(user["id"])
+            seller = lot["user_id"] if lot["type"] == "sell" else user["id"]
+            async with RequestScope() as scope:
+                lot_user_stat, lot_user, wallet, is_message_baned, is_enough_money, are_users_active = await asyncio.gather(
+                    scope.fetch(api.user_stat, lot["user_id"]),
+                    scope.fetch(api.get_user, user_id=lot["user_id"]),
+                    scope.fetch(api.get_wallet, seller),
+                    scope.fetch(api.get_is_usermessages_baned, user["id"], lot["user_id"]),
+                    self.is_enough_money(lot, user, scope),
+                    self.are_users_active(lot, user, scope),
+                )
             limit_to = await sky_math.get_maximum_limit(lot, wallet["balance"])
-            is_enough_money = await self.is_enough_money(lot, user)
-            are_users_active = await self.are_users_active(lot, user)
-            is_message_baned = await api.get_is_usermessages_baned(user["id"], lot["user_id"])
             return await rc.lot(user, lot, {**lot_user_stat, **lot_user}, is_enough_money, are_users_active, limit_to, not is_message_baned)
 
     #######################################        DEALS       #######################################
@@ -830,7 +885,7 @@ class DataHandler:
 
         including_requisite_step = lot["type"] == "buy"
         if including_requisite_step:
-            broker = await self._get_broker(name=lot["broker"])
+            broker = await reference_data.broker(name=lot["broker"])
             last_reqs = await api.get_last_requisites(user["id"], lot['currency'], broker["id"])
             to_return = await rc.enter_req_deal(user, lot, last_reqs)
         else:
@@ -922,12 +977,12 @@ class DataHandler:
         deal = await api.get_deal(deal_id)
         if deal["state"] == STATES[0]:
             if deal["lot"]["type"] == "sell":
-                broker = await self._get_broker(name=deal["lot"]["broker"])
+                broker = await reference_data.broker(name=deal["lot"]["broker"])
                 last_req = await api.get_last_requisites(user["id"], deal['currency'], broker["id"])
                 return await rc.enter_req_deal(user, deal["lot"], last_requisites=last_req), True, deal_id
             elif deal["lot"]["type"] == "buy":
                 await api.update_deal_state(user["id"], deal_id)
-                long_limit = (await api.get_settings())["advanced_deal_time"]
+                long_limit = (await reference_data.settings())["advanced_deal_time"]
                 return await rc.confirm_sent_fiat(deal["buyer"], deal, long_limit=long_limit), False, deal_id
 
         return await rc.error(user), None, None
@@ -942,7 +997,7 @@ class DataHandler:
         if deal["state"] == STATES[0] and deal["lot"]["type"] == "sell":
             await api.update_deal_req(user_id=user["id"], deal_id=deal_id, req=req)
             await api.update_deal_state(user["id"], deal_id)
-            long_limit = (await api.get_settings())["advanced_deal_time"]
+            long_limit = (await reference_data.settings())["advanced_deal_time"]
             return await rc.opponent_confirmed_deal(deal["seller"], deal, long_limit=long_limit)
 
         return await rc.error(user)
@@ -1094,12 +1149,12 @@ class DataHandler:
 
     @click
     async def rate_settings(self, user):
-        rate = await api.get_rate(user["currency"])
+        rate = await rate_feed.get(user["currency"])
         return await rc.rate_settings(user, rate)
 
     @click
     async def currency_settings(self, user):
-        currencies = await api.get_currencies()
+        currencies = await reference_data.currencies()
         return await rc.currency_settings(user, currencies)
 
     @click
@@ -1187,7 +1242,7 @@ class DataHandler:
 
         wallet = await api.get_wallet(user["id"])
         balance = wallet["balance"]
-        rate = await api.get_rate(user["currency"])
+        rate = await rate_feed.get(user["currency"])
         if type_ == PROMOCODE_TYPES[1]:
             amount = Decimal(amount / Decimal(str(rate))).quantize(Decimal("0.0000001"), rounding=ROUND_DOWN)
         if balance < amount * count:
@@ -1278,14 +1333,23 @@ class DataHandler:
             content_type = None
             if isinstance(photo, (list, tuple)):
                 target = sorted(photo, key=lambda item: item.file_size, reverse=True)[0]
+                filename = f"{target.file_unique_id}.jpg"
             else:
                 content_type = 'application/pdf'
                 target = photo
                 if target.mime_type != 'application/pdf':
                     raise ValueError('wrong file')
-            file = await target.download()
-            media = await api.upload_photo(user["id"], open(file.name, "rb"), content_type)
+                filename = target.file_name or f"{target.file_unique_id}.pdf"
+            media = await media_relay.relay(
+                target,
+                lambda chunks: api.upload_photo(user["id"], chunks, content_type, filename=filename),
+                scan_pdf=content_type == 'application/pdf',
+            )
             await api.new_usermessage(sender_id=user["id"], receiver_id=receiver_id, media_id=media["id"])
+        except MediaRejected as e:
+            if e.reason == "javascript":
+                return await rc.javascript_in_pdf(user)
+            return await rc.file_too_large(user, MEDIA_MAX_BYTES // (1024 * 1024))
         except BadRequestError as e:
             error_text = e.detail.lower()
             if error_text == "400 bad request: javascript in pdf":
@@ -1301,7 +1365,7 @@ class DataHandler:
         deal = await api.get_deal(deal_id)
         is_buyer = deal["buyer"]["id"] == user["id"]
         is_seller = deal["seller"]["id"] == user["id"]
-        settings = await api.get_settings()
+        settings = await reference_data.settings()
         dispute_time = settings["dispute_time"]
         if deal["state"] != STATES[2] or not (is_seller or is_buyer):
             return await rc.error(user)
@@ -1425,7 +1489,7 @@ class DataHandler:
         return await self.lot(user=user, identificator=lot["identificator"])
 
     async def _get_rate_variation(self, currency) -> Decimal:
-        settings = await api.get_settings()
+        settings = await reference_data.settings()
         currencies = settings['currencies']
         target_currency = next(filter(lambda x: x['id'] == currency, currencies))
         return Decimal(str(target_currency['rate_variation']))
@@ -1435,7 +1499,7 @@ class DataHandler:
         lot = await api.get_lot(lot_id)
         if lot["user_id"] != user["id"] or lot["is_deleted"]:
             return await rc.error(user)
-        rates = await api.get_rate(lot["currency"])
+        rates = await rate_feed.get(lot["currency"])
         rate_variation = await self._get_rate_variation(lot['currency'])
         print(rate_variation)
         try:
@@ -1471,10 +1535,16 @@ class DataHandler:
     @admin_only
     async def send_to_all(self, user, text):
         text = text[16:]
-        all_tg_id = await api.get_all_telegram_ids()
-        for telegram_id in all_tg_id:
-            await asyncio.sleep(0.5)
-            await send_message(chat_id=telegram_id, text=text, save=False)
+        if not await broadcaster.start(text, admin_id=user["telegram_id"]):
+            return "Рассылка уже идет, остановить: /stop_notif_all", None
+        return "Рассылка запущена", None
+
+    @click
+    @admin_only
+    async def stop_send_to_all(self, user):
+        if await broadcaster.cancel():
+            return "Рассылка будет остановлена", None
+        return "Нет активной рассылки", None
 
     @click
     async def get_payment_for_support(self, user, payment_id):
@@ -1803,6 +1873,12 @@ class DataHandler:
             text += f'/u{item["user"]} {item["frozen"]} {SYMBOL.upper()}\n'
         return text, None
 
+    @click
+    @admin_only
+    async def metrics(self, user):
+        text = "\n".join(f"<b>{name}:</b> {value}" for name, value in metrics.snapshot().items())
+        return text or "Нет данных", None
+
     @click
     @admin_only
     async def stop_withdraw(self, user):
@@ -1813,13 +1889,13 @@ class DataHandler:
     @click
     @admin_only
     async def ban_all_messages(self, user, tg_id):
-        redis_general.set(f"is_baned_{tg_id}", "1")
+        await ban_flags.ban(tg_id)
         return f"Юзер забанен"
 
     @click
     @admin_only
     async def unban_all_messages(self, user, tg_id):
-        redis_general.delete(f"is_baned_{tg_id}")
+        await ban_flags.unban(tg_id)
         return f"Юзер разбанен"
 
     @click
@@ -1903,7 +1979,7 @@ class DataHandler:
     async def finreport(self, user):
         resp = await api.finreport()
         resp["symbol"] = SYMBOL.upper()
-        rate = await api.get_rate("usd")
+        rate = await rate_feed.get("usd")
         intervals = ["day", "week", "month", "year"]
         for interval in intervals:
             total = resp[f"transactions_{interval}"] + resp[f"deals_{interval}"] + resp[f"merchants_{interval}"]
@@ -1962,7 +2038,7 @@ class DataHandler:
 
     @click
     async def unknown_command(self, user):
-        settings = await api.get_settings()
+        settings = await reference_data.settings()
         return await rc.unknown_command(user, withdraw_commission=settings["commission"])
 
     async def some_error(self):
@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+from api import api
+from reference_data import reference_data
+from settings import RATE_MAX_STALE, RATE_REFRESH_INTERVAL
+from utils.logger import logger
+from utils.metrics import metrics
+
+
+class RateFeed:
+    """
+    Keeps the rate of every active currency in memory.
+    All rates are refreshed in one concurrent pass; a rate older than `max_age` is returned right away
+    while the refresh runs in the background. A rate older than `max_stale` is not returned at all:
+    it is loaded again first, and the error is raised if that fails. Subscribers are called on every change.
+    """
+
+    def __init__(self, max_age, max_stale):
+        self.max_age = max_age
+        self.max_stale = max_stale
+        self._rates = {}
+        self._updated_at = {}
+        self._loading = {}
+        self._refresh_task = None
+        self._subscribers = []
+        self.refreshes = 0
+        self.refresh_failures = 0
+        metrics.register("rates", self.stats)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        oldest = max((now - updated_at for updated_at in self._updated_at.values()), default=0)
+        return {
+            "currencies": len(self._rates),
+            "oldest_age_seconds": round(oldest, 1),
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+        }
+
+    def subscribe(self, callback):
+        """
+        Call `await callback(currency, old_rate, new_rate)` whenever a rate changes.
+        """
+        self._subscribers.append(callback)
+
+    async def _publish(self, currency, old_rate, new_rate):
+        for callback in self._subscribers:
+            try:
+                await callback(currency, old_rate, new_rate)
+            except Exception as e:
+                logger.exception(f"Rate subscriber {callback} failure: {e}")
+
+    async def _fetch(self, currency):
+        rate = await api.get_rate(currency)
+        old_rate = self._rates.get(currency)
+        self._rates[currency] = rate
+        self._updated_at[currency] = time.monotonic()
+        if old_rate is not None and old_rate != rate:
+            await self._publish(currency, old_rate, rate)
+        return rate
+
+    async def _load(self, currency):
+        """
+        Load a currency right away; concurrent callers share one request.
+        """
+        future = self._loading.get(currency)
+        if future is None:
+            future = self._loading[currency] = asyncio.ensure_future(self._fetch(currency))
+            future.add_done_callback(lambda _: self._loading.pop(currency, None))
+        return await asyncio.shield(future)
+
+    async def refresh(self):
+        currencies = set(self._rates)
+        try:
+            currencies.update(currency["id"] for currency in await reference_data.currencies())
+        except Exception as e:
+            logger.warning(f"Currencies for rates refresh are not available: {e}")
+        results = await asyncio.gather(*(self._fetch(currency) for currency in currencies), return_exceptions=True)
+        self.refreshes += 1
+        for currency, result in zip(currencies, results):
+            if isinstance(result, Exception):
+                self.refresh_failures += 1
+                logger.warning(f"Rate refresh for {currency} failure: {result}")
+
+    def _refresh_in_background(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self.refresh())
+
+    async def get(self, currency):
+        if currency not in self._rates:
+            return await self._load(currency)
+        age = time.monotonic() - self._updated_at[currency]
+        if age > self.max_stale:
+            return await self._load(currency)
+        if age > self.max_age:
+            self._refresh_in_background()
+        return self._rates[currency]
+
+    async def get_many(self, currencies) -> dict:
+        currencies = list(currencies)
+        rates = await asyncio.gather(*(self.get(currency) for currency in currencies))
+        return dict(zip(currencies, rates))
+
+
+rate_feed = RateFeed(max_age=2 * RATE_REFRESH_INTERVAL, max_stale=RATE_MAX_STALE)
@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+from api import api
+from utils.logger import logger
+from utils.metrics import metrics
+
+
+class ReferenceData:
+    """
+    In-memory copy of settings, brokers and currencies.
+    Loaded at startup and refreshed in the background; reads never wait for the API
+    unless an item has not been loaded yet. A failed refresh keeps the previous values.
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._updated_at = {}
+        self._broker_indexes = {}
+        self._lock = asyncio.Lock()
+        self.refresh_failures = 0
+        metrics.register("reference_data", self.stats)
+
+    def staleness(self) -> dict:
+        """
+        Seconds since each item was last loaded.
+        """
+        now = time.monotonic()
+        return {name: round(now - updated_at, 1) for name, updated_at in self._updated_at.items()}
+
+    def stats(self) -> dict:
+        result = {f"{name}_age_seconds": age for name, age in self.staleness().items()}
+        result["refresh_failures"] = self.refresh_failures
+        return result
+
+    def _store(self, name, value):
+        self._items[name] = value
+        self._updated_at[name] = time.monotonic()
+        if name.startswith("brokers"):
+            by_id = {str(broker["id"]): broker for broker in value}
+            by_name = {broker["name"]: broker for broker in value}
+            self._broker_indexes[name] = by_id, by_name
+
+    async def _load(self, name):
+        if name == "settings":
+            value = await api.get_settings()
+        elif name == "currencies":
+            value = await api.get_currencies()
+        elif name == "brokers":
+            value = await api.get_brokers()
+        else:
+            value = await api.get_brokers(name.split(":", 1)[1])
+        self._store(name, value)
+        return value
+
+    async def refresh(self):
+        async with self._lock:
+            names = ["settings", "currencies", "brokers"]
+            results = await asyncio.gather(*(self._load(name) for name in names), return_exceptions=True)
+            currencies = self._items.get("currencies") or []
+            names = [f"brokers:{currency['id']}" for currency in currencies]
+            results += await asyncio.gather(*(self._load(name) for name in names), return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    self.refresh_failures += 1
+                    logger.warning(f"Reference data refresh failure: {result}")
+
+    async def _get(self, name):
+        if name not in self._items:
+            return await self._load(name)
+        return self._items[name]
+
+    async def settings(self) -> dict:
+        return await self._get("settings")
+
+    async def currencies(self) -> list:
+        return await self._get("currencies")
+
+    async def brokers(self, currency=None) -> list:
+        return await self._get("brokers" if currency is None else f"brokers:{currency}")
+
+    async def broker(self, broker_id=None, name=None, currency=None):
+        """
+        Find a broker by id or name, among the brokers of the currency if it is given.
+        """
+        key = "brokers" if currency is None else f"brokers:{currency}"
+        await self._get(key)
+        by_id, by_name = self._broker_indexes[key]
+        if broker_id is not None and str(broker_id) in by_id:
+            return by_id[str(broker_id)]
+        return by_name.get(name)
+
+
+reference_data = ReferenceData()
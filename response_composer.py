@@ -1338,5 +1338,11 @@ class ResponseComposer:
         k = await kb.main_menu(lang)
         return text, k
 
+    async def file_too_large(self, user, max_size):
+        lang = user["lang"]
+        text = await self._get(lang, var_name="file_too_large", max_size=max_size)
+        k = await kb.main_menu(lang)
+        return text, k
+
 
 rc = ResponseComposer()
@@ -1,13 +1,15 @@
 import asyncio
 import os
 
-import redis
+import redis.asyncio
 import requests
-from aiogram import Bot
+from aiogram.bot.api import TELEGRAM_PRODUCTION, TelegramAPIServer
 from aiogram.contrib.fsm_storage.redis import RedisStorage2
 from aiogram.dispatcher import Dispatcher
 
 from utils.logger import logger
+from utils.outbound import Lane, ScheduledBot
+from utils.router import RoutingDispatcher
 
 if os.environ.get("TEST"):
     host = os.environ.get("API_HOST")
@@ -18,8 +20,21 @@ if os.environ.get("TEST"):
 else:
     API_HOST = "http://api:5555"
 
+# Telegram Bot API server, overridable in test mode to run against bench/fake_telegram.py
+TELEGRAM_API_HOST = os.environ.get("TELEGRAM_API_HOST") if os.environ.get("TEST") else None
+telegram_server = TelegramAPIServer.from_base(TELEGRAM_API_HOST) if TELEGRAM_API_HOST else TELEGRAM_PRODUCTION
+
 API_KEY = os.environ["API_KEY"]
 
+API_POOL_LIMIT = int(os.environ.get("API_POOL_LIMIT", 100))
+API_POOL_LIMIT_PER_HOST = int(os.environ.get("API_POOL_LIMIT_PER_HOST", 50))
+API_KEEPALIVE_TIMEOUT = float(os.environ.get("API_KEEPALIVE_TIMEOUT", 30))
+API_CONNECT_TIMEOUT = float(os.environ.get("API_CONNECT_TIMEOUT", 5))
+API_READ_TIMEOUT = float(os.environ.get("API_READ_TIMEOUT", 30))
+
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10_000))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 10))
+
 settings = requests.get(API_HOST + "/settings", headers={"Token": API_KEY}).json()
 
 SYMBOL = settings["symbol"]
@@ -30,7 +45,13 @@ redis_host = os.environ.get("REDIS_HOST") + redis_postfix
 loop = asyncio.get_event_loop()
 redis_general_host = os.environ.get("REDIS_GENERAL_HOST", "redis_general")
 
-redis_general = redis.Redis(host=redis_general_host)
+REDIS_GENERAL_MAX_CONNECTIONS = int(os.environ.get("REDIS_GENERAL_MAX_CONNECTIONS", 50))
+# commands wait up to 5s for a free connection instead of opening more than the pool allows
+redis_general_async = redis.asyncio.Redis(
+    connection_pool=redis.asyncio.BlockingConnectionPool(
+        host=redis_general_host, max_connections=REDIS_GENERAL_MAX_CONNECTIONS, timeout=5
+    )
+)
 
 storage = RedisStorage2(db=5, host=redis_host)
 token = os.environ.get("BOT_TOKEN")
@@ -39,11 +60,37 @@ internal_controller_token = os.environ.get("INTERNAL_CONTROLLER_TOKEN")
 if token is None:
     exit(1)
 
-bot = Bot(token=token, parse_mode="html", loop=loop)
-dp = Dispatcher(bot, storage=storage)
-
-controller_bot = Bot(token=controller_token, parse_mode="html", loop=loop)
-internal_controller_bot = Bot(token=internal_controller_token, parse_mode="html", loop=loop)
+TELEGRAM_LIMITS = {
+    "global_rate": float(os.environ.get("TG_GLOBAL_RATE", 30)),
+    "chat_rate": float(os.environ.get("TG_CHAT_RATE", 1)),
+    "chat_burst": float(os.environ.get("TG_CHAT_BURST", 3)),
+    "group_rate": float(os.environ.get("TG_GROUP_RATE_PER_MINUTE", 20)) / 60,
+    "group_burst": float(os.environ.get("TG_GROUP_BURST", 3)),
+}
+
+bot = ScheduledBot(
+    token=token, parse_mode="html", loop=loop, server=telegram_server, name="bot", limits=TELEGRAM_LIMITS
+)
+dp = RoutingDispatcher(bot, storage=storage)
+
+controller_bot = ScheduledBot(
+    token=controller_token,
+    parse_mode="html",
+    loop=loop,
+    server=telegram_server,
+    name="controller_bot",
+    default_lane=Lane.control,
+    limits=TELEGRAM_LIMITS,
+)
+internal_controller_bot = ScheduledBot(
+    token=internal_controller_token,
+    parse_mode="html",
+    loop=loop,
+    server=telegram_server,
+    name="internal_controller_bot",
+    default_lane=Lane.control,
+    limits=TELEGRAM_LIMITS,
+)
 
 logger.warning(settings)
 SYMBOL_NAME = settings["coin_name"]
@@ -71,6 +118,49 @@ BUYER_REFERRAL_COMMISSION_FROM_COMMISSION = 0.4
 
 CURRENCIES = ("rub", "inr", "usd", "uah")
 LOTS_ON_PAGE = 10
+UPDATES_WORKERS = int(os.environ.get("UPDATES_WORKERS", 20))
+REFERENCE_DATA_REFRESH_INTERVAL = int(os.environ.get("REFERENCE_DATA_REFRESH_INTERVAL", 60))
+RATE_REFRESH_INTERVAL = int(os.environ.get("RATE_REFRESH_INTERVAL", 10))
+# a rate older than this is never served: it is reloaded first, and the request fails if that does
+RATE_MAX_STALE = int(os.environ.get("RATE_MAX_STALE", 30 * RATE_REFRESH_INTERVAL))
+LOADER_MAX_BATCH_SIZE = int(os.environ.get("LOADER_MAX_BATCH_SIZE", 100))
+LOADER_WAIT = float(os.environ.get("LOADER_WAIT", 0))
+LOADER_CONCURRENCY = int(os.environ.get("LOADER_CONCURRENCY", 10))
+
+# "polling" or "webhook"; in webhook mode the bot registers WEBHOOK_URL + WEBHOOK_PATH when WEBHOOK_URL is set
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", 8080))
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+WEBHOOK_CONCURRENCY = int(os.environ.get("WEBHOOK_CONCURRENCY", 50))
+WEBHOOK_MAX_PENDING = int(os.environ.get("WEBHOOK_MAX_PENDING", 1000))
+# seconds before another replica takes over the scheduled jobs from a leader that stopped renewing its lease
+LEADER_LEASE_TTL = float(os.environ.get("LEADER_LEASE_TTL", 15))
+# backend update polls: immediate while there is traffic, backing off up to the max interval when idle
+POLL_MIN_INTERVAL = float(os.environ.get("POLL_MIN_INTERVAL", 0.5))
+UPDATES_POLL_MAX_INTERVAL = float(os.environ.get("UPDATES_POLL_MAX_INTERVAL", 8))
+CONTROL_POLL_MAX_INTERVAL = float(os.environ.get("CONTROL_POLL_MAX_INTERVAL", 30))
+POLL_PREFETCH = int(os.environ.get("POLL_PREFETCH", 1))
+# fetched /updates are journaled here before processing and replayed after a crash
+UPDATES_JOURNAL_PATH = os.environ.get("UPDATES_JOURNAL_PATH", f"journal/updates_{SYMBOL}_{token.split(':')[0]}.ndjson")
+UPDATES_JOURNAL_COMPACT_BYTES = int(os.environ.get("UPDATES_JOURNAL_COMPACT_BYTES", 1 << 20))
+# a user with SPAM_THRESHOLD throttled messages within SPAM_WINDOW seconds is banned for SPAM_BAN_TTL (0 is forever)
+SPAM_WINDOW = int(os.environ.get("SPAM_WINDOW", 60))
+SPAM_THRESHOLD = int(os.environ.get("SPAM_THRESHOLD", 50))
+SPAM_BAN_TTL = int(os.environ.get("SPAM_BAN_TTL", 86400))
+SPAM_ALERT_COOLDOWN = int(os.environ.get("SPAM_ALERT_COOLDOWN", 3600))
+SPAM_ALERT_IDS = [int(i) for i in os.environ.get("SPAM_ALERT_IDS", "138510832,173724189,1144473266").split(",")]
+# "local" keeps throttling buckets in process memory; "redis" shares them when several replicas handle updates
+THROTTLE_BACKEND = os.environ.get("THROTTLE_BACKEND", "local")
+THROTTLE_MAX_BUCKETS = int(os.environ.get("THROTTLE_MAX_BUCKETS", 100_000))
+# event loop stalls longer than this are logged; LOOP_DEBUG also logs the slow callbacks (asyncio debug mode)
+LOOP_STALL_THRESHOLD = float(os.environ.get("LOOP_STALL_THRESHOLD", 0.1))
+LOOP_DEBUG = bool(os.environ.get("LOOP_DEBUG"))
+# media sent between users is relayed from Telegram to the backend without temp files; bots can download up to 20 MB
+MEDIA_MAX_BYTES = int(os.environ.get("MEDIA_MAX_BYTES", 20 * 1024 * 1024))
+MEDIA_RELAY_CONCURRENCY = int(os.environ.get("MEDIA_RELAY_CONCURRENCY", 10))
 STATES = "proposed", "confirmed", "paid", "closed", "deleted"
 
 FILES_PATH = os.path.abspath("files")
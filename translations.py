@@ -1,23 +1,105 @@
+import json
 import os
-
-import i18n
+import re
 
 _CURRENT_DIR = os.path.dirname(__file__)
 TRANSLATIONS_FOLDER = os.path.join(_CURRENT_DIR, "translations/")
 
-i18n.set("file_format", "json")
-i18n.set("available_locales", ["ru", "en"])
-i18n.set("locale", "ru")
-i18n.load_path.append(TRANSLATIONS_FOLDER)
+AVAILABLE_LOCALES = ["ru", "en"]
+DEFAULT_LOCALE = "ru"
+FALLBACK_LOCALE = "en"
+
+# Fail at startup when a key is not translated to every available locale
+TRANSLATIONS_STRICT = bool(os.environ.get("TRANSLATIONS_STRICT"))
+
+# Same placeholder syntax as string.Template with the "%" delimiter used by python-i18n
+_PLACEHOLDER = re.compile(r"%(?:(%)|([_a-z][_a-z0-9]*)|{([_a-z][_a-z0-9]*)})", re.IGNORECASE | re.ASCII)
+
+
+class CompiledTemplate:
+    """
+    Translation string split once into literal parts and placeholder names.
+    Unknown placeholders are left as is, like Template.safe_substitute.
+    """
+
+    __slots__ = ("text", "parts")
+
+    def __init__(self, text):
+        parts = []
+        literal = []
+        position = 0
+        for match in _PLACEHOLDER.finditer(text):
+            literal.append(text[position : match.start()])
+            position = match.end()
+            escaped, name, braced_name = match.groups()
+            if escaped:
+                literal.append("%")
+                continue
+            if literal:
+                parts.append("".join(literal))
+                literal = []
+            parts.append((name or braced_name, match.group()))
+        literal.append(text[position:])
+        self.parts = parts + ["".join(literal)] if parts else None
+        self.text = "".join(literal) if not parts else text
+
+    def format(self, kwargs) -> str:
+        if self.parts is None:
+            return self.text
+        result = []
+        for part in self.parts:
+            if part.__class__ is str:
+                result.append(part)
+            else:
+                name, placeholder = part
+                result.append(str(kwargs[name]) if name in kwargs else placeholder)
+        return "".join(result)
+
+
+def _flatten(data, prefix, catalog):
+    for key, value in data.items():
+        if isinstance(value, dict):
+            _flatten(value, f"{prefix}{key}.", catalog)
+        else:
+            catalog[f"{prefix}{key}"] = CompiledTemplate(str(value))
+
+
+def load_catalog(folder=TRANSLATIONS_FOLDER, strict=TRANSLATIONS_STRICT) -> dict:
+    """
+    Read {namespace}.{locale}.json files into {locale: {"namespace.key": CompiledTemplate}}.
+    """
+    catalog = {locale: {} for locale in AVAILABLE_LOCALES}
+    for filename in sorted(os.listdir(folder)):
+        namespace, locale, extension = (filename.rsplit(".", 2) + ["", ""])[:3]
+        if extension != "json" or locale not in catalog:
+            continue
+        with open(os.path.join(folder, filename), encoding="utf-8") as f:
+            data = json.load(f)
+        _flatten(data.get(locale, {}), f"{namespace}.", catalog[locale])
+
+    if strict:
+        all_keys = set().union(*catalog.values())
+        missing = {locale: sorted(all_keys - set(keys)) for locale, keys in catalog.items()}
+        missing = {locale: keys for locale, keys in missing.items() if keys}
+        if missing:
+            raise KeyError(f"Missing translations: {missing}")
+    return catalog
+
+
+_catalog = load_catalog()
 
 
-def translate(key, **kwargs):
-    return i18n.t(key, **kwargs)
+def translate(key, locale=DEFAULT_LOCALE, **kwargs):
+    template = _catalog.get(locale, {}).get(key)
+    if template is None:
+        template = _catalog[FALLBACK_LOCALE].get(key)
+        if template is None:
+            return kwargs.get("default", key)
+    return template.format(kwargs)
 
 
 def get_trans_list(key, **kw):
-    languages = i18n.get("available_locales")
-    return [translate(f"menu_misc.{key}", locale=lang, **kw) for lang in languages]
+    return [translate(f"menu_misc.{key}", locale=lang, **kw) for lang in AVAILABLE_LOCALES]
 
 
 def translate_all(key):
@@ -0,0 +1,124 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from utils.batch_loader import BatchLoader
+from utils.logger import logger
+from utils.metrics import metrics
+
+
+class BanFlags:
+    """
+    The is_baned_<telegram id> flags in the general Redis, with a local read-through cache.
+    Changes made through ban()/unban() are published on `channel`, and every process drops its cached
+    flag on the message, so the usual "not banned" answer is served from memory. Flags are only cached
+    while the subscription is up, and for at most `ttl` seconds, to cover keys changed without a message.
+    Cache misses from one event loop tick are read with a single MGET.
+    """
+
+    def __init__(self, redis, channel, *, ttl=300, max_size=100_000):
+        self.redis = redis
+        self.channel = channel
+        self.ttl = ttl
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._generation = 0
+        self._live = False
+        self._task = None
+        self._loader = BatchLoader(self._load_one, load_many=self._load_many, name="ban_flags")
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        metrics.register("ban_flags", self.stats)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "cached": len(self._cache),
+            "subscribed": int(self._live),
+        }
+
+    @staticmethod
+    def key(telegram_id) -> str:
+        return f"is_baned_{telegram_id}"
+
+    async def _load_one(self, telegram_id) -> bool:
+        return bool(await self.redis.get(self.key(telegram_id)))
+
+    async def _load_many(self, telegram_ids) -> dict:
+        values = await self.redis.mget([self.key(telegram_id) for telegram_id in telegram_ids])
+        return {telegram_id: bool(value) for telegram_id, value in zip(telegram_ids, values)}
+
+    async def is_banned(self, telegram_id) -> bool:
+        cached = self._cache.get(telegram_id)
+        if cached is not None and cached[1] > time.monotonic():
+            self.hits += 1
+            return cached[0]
+
+        self.misses += 1
+        generation = self._generation
+        banned = await self._loader.load(telegram_id)
+        # a flag read before an invalidation arrived may already be stale
+        if self._live and generation == self._generation:
+            self._cache[telegram_id] = (banned, time.monotonic() + self.ttl)
+            self._cache.move_to_end(telegram_id)
+            if len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return banned
+
+    async def _set(self, telegram_id, banned):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if banned:
+                pipe.set(self.key(telegram_id), "1")
+            else:
+                pipe.delete(self.key(telegram_id))
+            pipe.publish(self.channel, str(telegram_id))
+            await pipe.execute()
+        self.invalidate(telegram_id)
+
+    async def ban(self, telegram_id):
+        await self._set(telegram_id, True)
+
+    async def unban(self, telegram_id):
+        await self._set(telegram_id, False)
+
+    def invalidate(self, telegram_id=None):
+        self._generation += 1
+        self.invalidations += 1
+        if telegram_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(telegram_id, None)
+
+    async def _listen(self):
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                # invalidations published while unsubscribed were missed
+                self.invalidate()
+                self._live = True
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.invalidate(int(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Ban flags subscription failure: {e}")
+            finally:
+                self._live = False
+                self._cache.clear()
+                await pubsub.close()
+            await asyncio.sleep(1)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,95 @@
+import asyncio
+import copy
+import time
+
+from utils.metrics import metrics
+
+
+class BatchLoader:
+    """
+    Collects the keys requested within one event loop tick (or `wait` seconds) and
+    resolves them together: with one `load_many(keys) -> {key: value}` call when a bulk
+    endpoint exists, otherwise with `load_one(key)` calls run `concurrency` at a time.
+    A key requested several times in one batch is loaded once.
+    """
+
+    def __init__(self, load_one, *, load_many=None, name, max_batch_size=100, wait=0, concurrency=10):
+        self.load_one = load_one
+        self.load_many = load_many
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.wait = wait
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._batch = {}
+        self._batch_started = None
+        self._dispatch_handle = None
+        self.batches = 0
+        self.keys = 0
+        self.deduplicated = 0
+        metrics.register(f"loader_{name}", self.stats)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "keys": self.keys,
+            "deduplicated": self.deduplicated,
+            "avg_batch_size": round(self.keys / self.batches, 2) if self.batches else 0,
+        }
+
+    async def load(self, key):
+        future = self._batch.get(key)
+        if future is not None:
+            self.deduplicated += 1
+            return copy.deepcopy(await asyncio.shield(future))
+
+        future = self._batch[key] = asyncio.get_running_loop().create_future()
+        if self._dispatch_handle is None:
+            self._batch_started = time.monotonic()
+            loop = asyncio.get_running_loop()
+            if self.wait:
+                self._dispatch_handle = loop.call_later(self.wait, self._dispatch)
+            else:
+                self._dispatch_handle = loop.call_soon(self._dispatch)
+        if len(self._batch) >= self.max_batch_size:
+            self._dispatch_handle.cancel()
+            self._dispatch()
+        return await asyncio.shield(future)
+
+    def _dispatch(self):
+        batch, self._batch = self._batch, {}
+        self._dispatch_handle = None
+        self.batches += 1
+        self.keys += len(batch)
+        metrics.set(f"loader_{self.name}.last_batch_size", len(batch))
+        metrics.set(f"loader_{self.name}.last_batch_wait", round(time.monotonic() - self._batch_started, 4))
+        asyncio.ensure_future(self._resolve(batch))
+
+    async def _resolve(self, batch):
+        if self.load_many is not None:
+            try:
+                values = await self.load_many(list(batch))
+            except Exception as e:
+                for future in batch.values():
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            for key, future in batch.items():
+                if future.done():
+                    continue
+                if key in values:
+                    future.set_result(values[key])
+                else:
+                    future.set_exception(KeyError(key))
+        else:
+            await asyncio.gather(*(self._resolve_one(key, future) for key, future in batch.items()))
+
+    async def _resolve_one(self, key, future):
+        async with self._semaphore:
+            try:
+                value = await self.load_one(key)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(value)
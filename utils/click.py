@@ -8,7 +8,7 @@ from utils.logger import logger
 def click(method):
     async def clicked(*args, **kw):
         msg = kw.get("msg")
-        user = kw.get("user") or await api.get_user(telegram_id=msg.from_user.id)
+        user = kw.get("user") or await api.get_cached_user(telegram_id=msg.from_user.id)
         kw["user"] = user
         if user["is_baned"]:
             return await ResponseComposer.you_are_baned(user)
@@ -3,10 +3,9 @@ import math
 import random
 import string
 import time
-from collections import defaultdict
 from decimal import Decimal
 
-from aiogram import Dispatcher, types
+from aiogram import types
 from aiogram.dispatcher import DEFAULT_RATE_LIMIT
 from aiogram.dispatcher.handler import CancelHandler, current_handler
 from aiogram.dispatcher.middlewares import BaseMiddleware
@@ -15,9 +14,30 @@ from dateutil.parser import parse
 from dateutil.tz import UTC
 
 from api import api
-from settings import bot, redis_general
-
-MESSAGES_WHILE_BANED = defaultdict(int)
+from reference_data import reference_data
+from settings import (SPAM_ALERT_COOLDOWN, SPAM_ALERT_IDS, SPAM_BAN_TTL, SPAM_THRESHOLD, SPAM_WINDOW, SYMBOL,
+                      THROTTLE_BACKEND, THROTTLE_MAX_BUCKETS, bot, redis_general_async)
+from utils.ban_flags import BanFlags
+from utils.logger import logger
+from utils.spam import SpamDetector
+from utils.throttle import Throttler
+
+# is_baned_ flags are shared by the bots of every coin, so is the invalidation channel
+ban_flags = BanFlags(redis_general_async, "ban_flags")
+spam_detector = SpamDetector(
+    redis_general_async,
+    f"spam:{SYMBOL}",
+    ban_flags,
+    window=SPAM_WINDOW,
+    threshold=SPAM_THRESHOLD,
+    ban_ttl=SPAM_BAN_TTL,
+    alert_cooldown=SPAM_ALERT_COOLDOWN,
+)
+throttler = Throttler(
+    redis=redis_general_async if THROTTLE_BACKEND == "redis" else None,
+    prefix=f"throttle:{SYMBOL}:{bot.id}",
+    max_size=THROTTLE_MAX_BUCKETS,
+)
 
 
 def rate_limit(limit: int, key=None):
@@ -41,11 +61,7 @@ class MessageMiddleware(BaseMiddleware):
         super(MessageMiddleware, self).__init__()
 
     async def check_spam(self, message: types.Message):
-
-        is_baned_key = f"is_baned_{message.from_user.id}"
-        is_banned: str = redis_general.get(is_baned_key)
-
-        if is_banned:
+        if await ban_flags.is_banned(message.from_user.id):
             # from data_handler import send_message
             # text = '🚫 Вы были забанены за спам. Если вы считаете, что это произошло по ошибке, пожалуйста, обратитесь в поддержку @SKY_CRYPTO_SUPPORT'
             # bot.loop.create_task(send_message(text, message.from_user.id))
@@ -56,7 +72,6 @@ class MessageMiddleware(BaseMiddleware):
             raise CancelHandler()
 
         handler = current_handler.get()
-        dispatcher = Dispatcher.get_current()
         if handler:
             limit = getattr(handler, "throttling_rate_limit", self.rate_limit)
             key = getattr(handler, "throttling_key", f"{self.prefix}_{handler.__name__}")
@@ -65,19 +80,10 @@ class MessageMiddleware(BaseMiddleware):
             key = f"{self.prefix}_message"
 
         try:
-            await dispatcher.throttle(key, rate=limit)
-            MESSAGES_WHILE_BANED[message.from_user.id] = 0
+            await throttler.throttle(key, rate=limit, user_id=message.from_user.id, chat_id=message.chat.id)
         except Throttled as t:
             await self.message_throttled(message, t)
-            current_cnt = MESSAGES_WHILE_BANED[message.from_user.id]
-            MESSAGES_WHILE_BANED[message.from_user.id] = current_cnt + 1
-            if current_cnt > 50:
-                text = f"Более 50 сообщений заблокировано ботом от юзера {message.from_user.id} со времени последнего успешного ответа. Вероятно, спам атака"
-                from data_handler import send_message
-
-                for tg_id in (138510832, 173724189, 1144473266):
-                    bot.loop.create_task(send_message(text, tg_id))
-                MESSAGES_WHILE_BANED[message.from_user.id] = 0
+            await self.report_spam(message.from_user.id)
             raise CancelHandler()
 
         # loop.create_task(save_message(message, bot=False))
@@ -85,6 +91,22 @@ class MessageMiddleware(BaseMiddleware):
     async def message_throttled(self, message: types.Message, throttled: Throttled):
         pass
 
+    async def report_spam(self, telegram_id):
+        try:
+            banned, alert = await spam_detector.record(telegram_id)
+        except Exception as e:
+            logger.warning(f"Spam detector failure: {e}")
+            return
+        if alert:
+            from data_handler import control_message_queue
+
+            text = (
+                f"{SPAM_THRESHOLD} сообщений от юзера {telegram_id} заблокировано ботом за {SPAM_WINDOW} сек. "
+                f"Вероятно, спам атака{', юзер забанен' if banned else ''}"
+            )
+            for tg_id in SPAM_ALERT_IDS:
+                await control_message_queue.put(dict(chat_id=tg_id, text=text, save=False))
+
 
 def timeit(method):
     async def timed(*args, **kw):
@@ -127,7 +149,7 @@ def get_correct_value(num):
 
 
 async def get_brokers(user_currency):
-    return await api.get_brokers(user_currency)
+    return await reference_data.brokers(user_currency)
 
 
 async def save_error(message, telegram_id):
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import os
+import time
+
+from utils.logger import logger
+from utils.metrics import metrics
+
+
+class Journal:
+    """
+    Append-only NDJSON log of fetched items, written before they are processed.
+
+    Every item gets a sequence number and is written as {"seq", "name", "item"}; acknowledged items are
+    followed by {"ack": seq}. A batch is written with one fsync; acknowledgements are only flushed
+    once per event loop tick, so a crash loses no items, and at worst a few items are delivered twice.
+    On open the items without an acknowledgement are returned for replay. When the file grows
+    past `compact_bytes` it is rewritten with only the pending items, in a thread like the fsyncs.
+    """
+
+    def __init__(self, path, *, compact_bytes=1 << 20, fsync=True):
+        self.path = path
+        self.compact_bytes = compact_bytes
+        self.fsync = fsync
+        self._file = None
+        self._seq = 0
+        self._pending = {}
+        self._flush_handle = None
+        self._lock = asyncio.Lock()
+        self.appended = 0
+        self.acked = 0
+        self.replayed = 0
+        self.fsyncs = 0
+        self.fsync_seconds = 0
+        self.compactions = 0
+        metrics.register("journal", self.stats)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "appended": self.appended,
+            "acked": self.acked,
+            "replayed": self.replayed,
+            "fsyncs": self.fsyncs,
+            "avg_fsync_ms": round(self.fsync_seconds / self.fsyncs * 1000, 3) if self.fsyncs else 0,
+            "compactions": self.compactions,
+            "bytes": self._file.tell() if self._file else 0,
+        }
+
+    def open(self) -> list:
+        """
+        Read the journal and return the pending (seq, name, item) entries in the order they were written.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # a line torn by a crash in the middle of a write
+                        logger.warning(f"Skipping a damaged record in {self.path}")
+                        continue
+                    if "ack" in record:
+                        self._pending.pop(record["ack"], None)
+                    else:
+                        self._pending[record["seq"]] = (record["seq"], record["name"], record["item"])
+                        self._seq = max(self._seq, record["seq"])
+        self._file = open(self.path, "ab")
+        self._rewrite()
+        pending = list(self._pending.values())
+        self.replayed += len(pending)
+        if pending:
+            logger.warning(f"Replaying {len(pending)} unacknowledged entries from {self.path}")
+        return pending
+
+    def _sync(self):
+        started = time.perf_counter()
+        os.fsync(self._file.fileno())
+        self.fsyncs += 1
+        self.fsync_seconds += time.perf_counter() - started
+
+    async def append(self, items) -> list:
+        """
+        Durably record (name, item) pairs and return them as (seq, name, item) entries.
+        """
+        if not items:
+            return []
+        entries = []
+        lines = []
+        for name, item in items:
+            self._seq += 1
+            entries.append((self._seq, name, item))
+            lines.append(json.dumps({"seq": self._seq, "name": name, "item": item}, ensure_ascii=False))
+        async with self._lock:
+            if self._file.tell() > self.compact_bytes:
+                await self._compact()
+            self._file.write(("\n".join(lines) + "\n").encode())
+            self._file.flush()
+            if self.fsync:
+                await asyncio.get_running_loop().run_in_executor(None, self._sync)
+        for entry in entries:
+            self._pending[entry[0]] = entry
+        self.appended += len(entries)
+        return entries
+
+    def ack(self, seq):
+        if self._pending.pop(seq, None) is None or self._file is None:
+            return
+        self.acked += 1
+        self._file.write(b'{"ack": %d}\n' % seq)
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_handle = None
+        if self._file is not None:
+            self._file.flush()
+
+    @staticmethod
+    def _write_entries(path, entries):
+        with open(path, "wb") as f:
+            for seq, name, item in entries:
+                f.write(json.dumps({"seq": seq, "name": name, "item": item}, ensure_ascii=False).encode() + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _replace(self, tmp_path):
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "ab")
+        self.compactions += 1
+
+    def _rewrite(self):
+        """
+        Replace the file with one holding only the pending entries.
+        """
+        tmp_path = f"{self.path}.tmp"
+        self._write_entries(tmp_path, list(self._pending.values()))
+        self._replace(tmp_path)
+
+    async def _compact(self):
+        """
+        Same as _rewrite, with the copy written and synced in a thread instead of on the event loop.
+        """
+        tmp_path = f"{self.path}.tmp"
+        entries = list(self._pending.values())
+        await asyncio.get_running_loop().run_in_executor(None, self._write_entries, tmp_path, entries)
+        self._replace(tmp_path)
+        # acknowledgements written meanwhile went to the replaced file
+        for seq, _, _ in entries:
+            if seq not in self._pending:
+                self._file.write(b'{"ack": %d}\n' % seq)
+
+    def close(self):
+        if self._file is not None:
+            self._file.flush()
+            if self.fsync:
+                self._sync()
+            self._file.close()
+            self._file = None
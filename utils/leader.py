@@ -0,0 +1,168 @@
+import asyncio
+import functools
+import os
+import socket
+import time
+import uuid
+
+from utils.logger import logger
+from utils.metrics import metrics
+
+# Extends the lease only while this replica still holds it
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Gives the lease up only if this replica holds it
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaderElection:
+    """
+    Picks one replica to run the background jobs, using a Redis key with a time to live as a lease.
+    The leader renews the lease every ttl / 3 seconds and the other replicas try to take it as often,
+    so a dead leader is replaced within ttl. A leader steps down as soon as a renewal fails or takes
+    longer than ttl / 3, and its jobs stop running once the last renewal is older than the lease minus
+    a margin, even if the renewal loop itself is stuck, before the lease can be taken by another replica.
+    """
+
+    def __init__(self, redis, key, *, ttl=15):
+        self.redis = redis
+        self.key = key
+        self.ttl = ttl
+        self.interval = ttl / 3
+        self.margin = self.interval / 2
+        self.identity = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self.leader = None
+        self._term_started = None
+        self._lease_renewed = None
+        self._lease_age = None
+        self._on_elected = []
+        self._task = None
+        self.elections = 0
+        self.failures = 0
+        self._renew = redis.register_script(RENEW_SCRIPT)
+        self._release = redis.register_script(RELEASE_SCRIPT)
+        metrics.register("leader", self.stats)
+
+    def stats(self) -> dict:
+        if self.is_leader:
+            lease_age = time.monotonic() - self._lease_renewed
+        else:
+            lease_age = self._lease_age
+        return {
+            "is_leader": int(self.is_leader),
+            "leader": self.leader,
+            "lease_age_seconds": round(lease_age, 1) if lease_age is not None else None,
+            "term_seconds": round(time.monotonic() - self._term_started, 1) if self.is_leader else 0,
+            "elections": self.elections,
+            "failures": self.failures,
+        }
+
+    def on_elected(self, callback):
+        """
+        Call `await callback()` every time this replica becomes the leader.
+        """
+        self._on_elected.append(callback)
+
+    def holds_lease(self) -> bool:
+        """
+        Whether this replica is the leader and its lease cannot have expired yet.
+        """
+        return self.is_leader and time.monotonic() - self._lease_renewed < self.ttl - self.margin
+
+    def only(self, job):
+        """
+        Wrap a scheduled job so it does nothing on replicas that do not hold the lease.
+        """
+
+        @functools.wraps(job)
+        async def wrapper(*args, **kwargs):
+            if self.holds_lease():
+                return await job(*args, **kwargs)
+
+        return wrapper
+
+    async def _elected(self, acquired_at):
+        self.is_leader = True
+        self.leader = self.identity
+        self.elections += 1
+        self._term_started = self._lease_renewed = acquired_at
+        logger.info(f"{self.identity} is the leader for {self.key}")
+        for callback in self._on_elected:
+            try:
+                await callback()
+            except Exception as e:
+                logger.exception(f"Leader callback {callback} failure: {e}")
+
+    def _step_down(self, reason):
+        self.is_leader = False
+        logger.warning(f"{self.identity} is no longer the leader for {self.key}: {reason}")
+
+    async def _tick(self):
+        ttl_ms = int(self.ttl * 1000)
+        # the lease runs from the moment the command was sent, not from the reply
+        started = time.monotonic()
+        if self.is_leader:
+            if await self._renew(keys=[self.key], args=[self.identity, ttl_ms]):
+                self._lease_renewed = started
+            else:
+                self._step_down("lease lost")
+            return
+
+        if await self.redis.set(self.key, self.identity, nx=True, px=ttl_ms):
+            await self._elected(started)
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.get(self.key)
+            pipe.pttl(self.key)
+            leader, pttl = await pipe.execute()
+        self.leader = leader.decode() if leader else None
+        self._lease_age = self.ttl - pttl / 1000 if pttl and pttl > 0 else None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._tick(), self.interval)
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                self.failures += 1
+                if self.is_leader:
+                    self._step_down("renewal timed out")
+                else:
+                    logger.warning("Leader election timed out")
+            except Exception as e:
+                self.failures += 1
+                if self.is_leader:
+                    self._step_down(f"renewal failure: {e}")
+                else:
+                    logger.warning(f"Leader election failure: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop campaigning and hand the lease over right away instead of letting it expire.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.is_leader:
+            self.is_leader = False
+            try:
+                await self._release(keys=[self.key], args=[self.identity])
+            except Exception as e:
+                logger.warning(f"Leader lease release failure: {e}")
@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+from utils.logger import logger
+from utils.metrics import metrics
+
+
+class LoopMonitor:
+    """
+    Measures how late the event loop wakes a task that sleeps for `interval` seconds; a late wake-up
+    means some callback held the loop, typically with synchronous I/O. Lags over `threshold` are logged.
+    With `debug`, asyncio's debug mode is turned on as well, so every callback running longer than
+    `threshold` is logged by the asyncio logger together with the code it ran. Debug mode slows the
+    loop down, so it is meant for finding the culprit, not for running all the time.
+    """
+
+    def __init__(self, *, interval=0.5, threshold=0.1, debug=False):
+        self.interval = interval
+        self.threshold = threshold
+        self.debug = debug
+        self._task = None
+        self.lag = 0
+        self.max_lag = 0
+        self.stalls = 0
+        metrics.register("loop", self.stats)
+
+    def stats(self) -> dict:
+        return {
+            "lag_ms": round(self.lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "stalls": self.stalls,
+        }
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.lag = time.monotonic() - started - self.interval
+            self.max_lag = max(self.max_lag, self.lag)
+            if self.lag > self.threshold:
+                self.stalls += 1
+                logger.warning(f"Event loop was blocked for {self.lag * 1000:.0f} ms")
+
+    def start(self):
+        if self.debug:
+            loop = asyncio.get_running_loop()
+            loop.set_debug(True)
+            loop.slow_callback_duration = self.threshold
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,130 @@
+import asyncio
+import re
+
+from utils.metrics import metrics
+
+# Dictionary delimiters, the start of a stream body and the names that attach JavaScript to a document
+PDF_TOKENS = re.compile(rb"<<|>>|(?<![A-Za-z])stream(?=\r|\n)|/J(?:avaScript|S)(?![A-Za-z0-9#])")
+PDF_STREAM_END = re.compile(rb"endstream")
+# longer than any token together with the byte its lookahead needs
+PDF_TOKEN_SPAN = 16
+
+
+class MediaRejected(Exception):
+    def __init__(self, reason):
+        self.reason = reason
+
+    def __str__(self) -> str:
+        return self.reason
+
+
+class PdfScanner:
+    """
+    Looks for JavaScript in a PDF fed in chunks. Stream bodies are skipped and the names count only
+    inside a dictionary, so compressed data that happens to contain "/JS" is not taken for it.
+    Objects packed into compressed object streams are not seen; the backend checks uploads again.
+    """
+
+    def __init__(self):
+        self._buffer = b""
+        self._pos = 0
+        self._depth = 0
+        self._in_stream = False
+
+    def feed(self, data, final=False) -> bool:
+        """
+        Scan the next piece of the file, the last one with `final`; return True once JavaScript is found.
+        """
+        buffer = self._buffer + data
+        # tokens starting past the limit may be cut off, they are scanned with the next piece
+        limit = len(buffer) if final else len(buffer) - PDF_TOKEN_SPAN
+        pos = self._pos
+        while pos < limit:
+            match = (PDF_STREAM_END if self._in_stream else PDF_TOKENS).search(buffer, pos)
+            if match is None or match.start() >= limit:
+                pos = limit
+                break
+            pos = match.end()
+            token = match.group()
+            if self._in_stream:
+                self._in_stream = False
+            elif token == b"<<":
+                self._depth += 1
+            elif token == b">>":
+                self._depth = max(0, self._depth - 1)
+            elif token == b"stream":
+                self._in_stream = True
+            elif self._depth:
+                return True
+        # one byte more is kept for the lookbehind
+        keep = max(0, pos - 1)
+        self._buffer = buffer[keep:]
+        self._pos = pos - keep
+        return False
+
+
+class MediaRelay:
+    """
+    Pipes a file from Telegram into an upload without touching the disk: the download is read in
+    `chunk_size` pieces and handed on as they arrive, so a relay holds one chunk at a time and at most
+    `concurrency` relays run at once. Files over `max_bytes` are refused before the download starts.
+    PDFs are scanned for JavaScript on the way through; a match aborts the upload before its end,
+    so the backend never receives a complete request.
+    """
+
+    def __init__(self, bot, *, max_bytes, chunk_size=64 * 1024, concurrency=10):
+        self.bot = bot
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.active = 0
+        self.relayed = 0
+        self.relayed_bytes = 0
+        self.rejected = 0
+        metrics.register("media_relay", self.stats)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "relayed": self.relayed,
+            "relayed_bytes": self.relayed_bytes,
+            "rejected": self.rejected,
+        }
+
+    def _reject(self, reason):
+        self.rejected += 1
+        return MediaRejected(reason)
+
+    async def _chunks(self, response, scan_pdf):
+        size = 0
+        scanner = PdfScanner() if scan_pdf else None
+        async for chunk in response.content.iter_chunked(self.chunk_size):
+            size += len(chunk)
+            if size > self.max_bytes:
+                raise self._reject("too_large")
+            if scanner is not None and scanner.feed(chunk):
+                raise self._reject("javascript")
+            yield chunk
+        if scanner is not None and scanner.feed(b"", final=True):
+            raise self._reject("javascript")
+        self.relayed_bytes += size
+
+    async def relay(self, file, upload, *, scan_pdf=False):
+        """
+        Stream a Telegram PhotoSize or Document into `await upload(chunks)` and return its result.
+        Raises MediaRejected with reason "too_large" or "javascript".
+        """
+        if file.file_size and file.file_size > self.max_bytes:
+            raise self._reject("too_large")
+        async with self._semaphore:
+            self.active += 1
+            try:
+                telegram_file = await self.bot.get_file(file.file_id)
+                session = await self.bot.get_session()
+                async with session.get(self.bot.get_file_url(telegram_file.file_path)) as response:
+                    response.raise_for_status()
+                    result = await upload(self._chunks(response, scan_pdf))
+            finally:
+                self.active -= 1
+        self.relayed += 1
+        return result
@@ -0,0 +1,34 @@
+import time
+
+
+class Metrics:
+    def __init__(self):
+        self._values = {}
+        self._collectors = {}
+        self.started_at = time.monotonic()
+
+    def set(self, name, value):
+        self._values[name] = value
+
+    def inc(self, name, value=1):
+        self._values[name] = self._values.get(name, 0) + value
+
+    def get(self, name, default=None):
+        return self._values.get(name, default)
+
+    def register(self, prefix, collector):
+        """
+        Register a callable returning a dict of current values.
+        Collectors are evaluated lazily on every snapshot.
+        """
+        self._collectors[prefix] = collector
+
+    def snapshot(self) -> dict:
+        result = dict(self._values)
+        for prefix, collector in self._collectors.items():
+            for name, value in collector().items():
+                result[f"{prefix}.{name}"] = value
+        return dict(sorted(result.items()))
+
+
+metrics = Metrics()
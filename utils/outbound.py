@@ -0,0 +1,219 @@
+import asyncio
+import contextvars
+import functools
+import time
+from collections import deque
+from contextlib import contextmanager
+from enum import IntEnum
+
+from aiogram import Bot
+from aiogram.bot.api import Methods
+from aiogram.utils.exceptions import RetryAfter
+
+from utils.logger import logger
+from utils.metrics import metrics
+
+SCHEDULED_METHODS = {
+    Methods.SEND_MESSAGE,
+    Methods.FORWARD_MESSAGE,
+    Methods.COPY_MESSAGE,
+    Methods.SEND_PHOTO,
+    Methods.SEND_DOCUMENT,
+    Methods.SEND_VIDEO,
+    Methods.SEND_ANIMATION,
+    Methods.SEND_MEDIA_GROUP,
+    Methods.SEND_STICKER,
+}
+
+MAX_RETRY_AFTER_ATTEMPTS = 3
+IDLE_CHATS_LIMIT = 10_000
+LANE_SCAN_DEPTH = 100
+
+
+class Lane(IntEnum):
+    interactive = 0
+    deal = 1
+    control = 2
+    broadcast = 3
+
+
+_current_lane = contextvars.ContextVar("outbound_lane", default=None)
+
+
+@contextmanager
+def outbound_lane(lane: Lane):
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now) -> float:
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds, now):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def is_idle(self, now) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class OutboundScheduler:
+    """
+    Sends outgoing messages of one bot within Telegram limits.
+    A global bucket caps messages per second for the token, per-chat buckets cap private
+    chats and groups separately, and lower lanes only go out when higher ones have nothing ready.
+    """
+
+    def __init__(self, name, global_rate, chat_rate, chat_burst, group_rate, group_burst):
+        self.name = name
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._lanes = [deque() for _ in Lane]
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self._in_flight = set()
+        self._sent = 0
+        self._retry_after = 0
+        metrics.register(f"outbound_{name}", self.stats)
+
+    def stats(self) -> dict:
+        result = {f"queued_{lane.name}": len(self._lanes[lane]) for lane in Lane}
+        result.update(
+            in_flight=len(self._in_flight), sent=self._sent, retry_after=self._retry_after, chats=len(self._chats)
+        )
+        return result
+
+    async def submit(self, chat_id, call, lane: Lane, can_retry=True):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[lane].append((chat_id, call, future, lane, can_retry, 0))
+        self._wakeup.set()
+        return await future
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= IDLE_CHATS_LIMIT:
+                self._drop_idle_chats()
+            try:
+                is_group = int(chat_id) < 0
+            except ValueError:
+                is_group = True
+            if is_group:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _drop_idle_chats(self):
+        now = time.monotonic()
+        self._chats = {chat_id: bucket for chat_id, bucket in self._chats.items() if not bucket.is_idle(now)}
+
+    def _next(self):
+        """
+        Return the first ready item by lane priority or the time to wait for one.
+        """
+        now = time.monotonic()
+        wait = self._global.delay(now)
+        if wait:
+            return None, wait
+
+        wait = None
+        for lane in self._lanes:
+            for index, item in enumerate(lane):
+                if index >= LANE_SCAN_DEPTH:
+                    break
+                chat_delay = self._chat_bucket(item[0]).delay(now) if item[0] is not None else 0
+                if not chat_delay:
+                    del lane[index]
+                    self._global.consume(now)
+                    if item[0] is not None:
+                        self._chat_bucket(item[0]).consume(now)
+                    return item, None
+                wait = chat_delay if wait is None else min(wait, chat_delay)
+        return None, wait
+
+    async def _run(self):
+        while True:
+            item, wait = self._next()
+            if item is not None:
+                task = asyncio.create_task(self._deliver(item))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, item):
+        chat_id, call, future, lane, can_retry, attempt = item
+        if future.cancelled():
+            return
+        try:
+            result = await call()
+        except RetryAfter as e:
+            self._retry_after += 1
+            logger.warning(f"{self.name}: flood control for chat {chat_id}, retry in {e.timeout}s")
+            if chat_id is not None:
+                self._chat_bucket(chat_id).block(e.timeout, time.monotonic())
+            if can_retry and attempt < MAX_RETRY_AFTER_ATTEMPTS and not future.cancelled():
+                self._lanes[lane].appendleft((chat_id, call, future, lane, can_retry, attempt + 1))
+                self._wakeup.set()
+            elif not future.done():
+                future.set_exception(e)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            self._sent += 1
+            if not future.done():
+                future.set_result(result)
+
+
+class ScheduledBot(Bot):
+    def __init__(self, *args, name, default_lane=Lane.interactive, limits, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default_lane = default_lane
+        self.outbound = OutboundScheduler(name, **limits)
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        if method not in SCHEDULED_METHODS:
+            return await super().request(method, data, files, **kwargs)
+        lane = _current_lane.get()
+        if lane is None:
+            lane = self.default_lane
+        call = functools.partial(super().request, method, data, files, **kwargs)
+        chat_id = (data or {}).get("chat_id")
+        return await self.outbound.submit(chat_id, call, lane, can_retry=not files)
@@ -0,0 +1,127 @@
+import asyncio
+import random
+import time
+
+from utils.logger import logger
+from utils.metrics import metrics
+
+
+class AdaptivePoller:
+    """
+    Polls `fetch()` and hands every non-empty batch to `process(batch)`, one batch at a time and in order.
+    After a non-empty batch the next poll starts right away. After an empty batch or an error the delay
+    doubles from `min_interval` up to `max_interval`, with jitter. Up to `prefetch` batches are fetched
+    while an earlier one is still processing. Fetched batches are already consumed on the backend,
+    so stop() lets a fetch in flight finish and processes every fetched batch before returning.
+    """
+
+    def __init__(self, name, fetch, process, *, size=len, min_interval=0.5, max_interval=10, prefetch=1, jitter=0.2):
+        self.name = name
+        self.fetch = fetch
+        self.process = process
+        self.size = size
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.interval = 0
+        self._slots = asyncio.Semaphore(prefetch + 1)
+        self._batches = asyncio.Queue()
+        self._tasks = []
+        self._fetch = None
+        self.polls = 0
+        self.empty_polls = 0
+        self.errors = 0
+        self.items = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self._started = None
+        metrics.register(f"poller_{name}", self.stats)
+
+    def stats(self) -> dict:
+        uptime = time.monotonic() - self._started if self._started else 0
+        batches = self.polls - self.empty_polls
+        return {
+            "polls": self.polls,
+            "empty_polls": self.empty_polls,
+            "errors": self.errors,
+            "polls_per_minute": round(self.polls / uptime * 60, 1) if uptime else 0,
+            "interval_seconds": round(self.interval, 2),
+            "prefetched": self._batches.qsize(),
+            "items": self.items,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_size": round(self.items / batches, 2) if batches else 0,
+        }
+
+    def _backoff(self):
+        interval = min(self.max_interval, max(self.min_interval, self.interval * 2))
+        self.interval = interval
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def _fetch_batch(self) -> float:
+        """
+        Fetch and queue one batch; return the delay before the next poll.
+        """
+        try:
+            batch = await self.fetch()
+            count = self.size(batch) if batch else 0
+        except Exception as e:
+            self._slots.release()
+            self.errors += 1
+            logger.exception(f"{self.name} poll failure: {e}")
+            return self._backoff()
+
+        self.polls += 1
+        self.last_batch_size = count
+        if not count:
+            self._slots.release()
+            self.empty_polls += 1
+            return self._backoff()
+        self.items += count
+        self.max_batch_size = max(self.max_batch_size, count)
+        self.interval = 0
+        self._batches.put_nowait(batch)
+        return 0
+
+    async def _poll(self):
+        while True:
+            await self._slots.acquire()
+            # cancelling the loop leaves the fetch running, so a consumed batch is always queued
+            self._fetch = asyncio.ensure_future(self._fetch_batch())
+            delay = await asyncio.shield(self._fetch)
+            if delay:
+                await asyncio.sleep(delay)
+
+    async def _process(self):
+        while True:
+            batch = await self._batches.get()
+            try:
+                await self.process(batch)
+            except Exception as e:
+                logger.exception(f"{self.name} processing failure: {e}")
+            finally:
+                self._batches.task_done()
+                self._slots.release()
+
+    def start(self):
+        if not self._tasks:
+            self._started = time.monotonic()
+            self._tasks = [asyncio.create_task(self._poll()), asyncio.create_task(self._process())]
+
+    async def stop(self, timeout=10):
+        if not self._tasks:
+            return
+        poll, process = self._tasks
+        poll.cancel()
+        if self._fetch is not None and not self._fetch.done():
+            await asyncio.wait([self._fetch], timeout=timeout)
+            if not self._fetch.done():
+                logger.warning(f"{self.name} fetch still running on shutdown, its batch may be lost")
+                self._fetch.cancel()
+        try:
+            await asyncio.wait_for(self._batches.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self._batches.qsize()} {self.name} batches dropped on shutdown")
+        process.cancel()
+        await asyncio.gather(poll, process, return_exceptions=True)
+        self._tasks = []
@@ -0,0 +1,36 @@
+import asyncio
+
+
+class RequestScope:
+    """
+    Backend calls made while building one screen.
+    Each call starts as a task right away, so independent calls run concurrently,
+    and the same call with the same arguments is made only once per scope.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+
+    @staticmethod
+    async def _call(method, args, kwargs, after):
+        if after:
+            await asyncio.gather(*after)
+        return await method(*args, **kwargs)
+
+    def fetch(self, method, *args, after=(), **kwargs) -> asyncio.Task:
+        """
+        Start `method(*args, **kwargs)` once the `after` tasks are done, or return the task already started.
+        """
+        key = (method, args, tuple(sorted(kwargs.items())))
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(self._call(method, args, kwargs, after))
+        return task
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from utils.logger import logger
+from utils.metrics import metrics
+
+# Takes up to ARGV[2] due items and leases them until ARGV[3], so a crashed delivery is retried later
+CLAIM_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #ids == 0 then
+    return {}
+end
+local items = {}
+for i, id in ipairs(ids) do
+    redis.call('ZADD', KEYS[1], ARGV[3], id)
+    items[i] = redis.call('HGET', KEYS[2], id)
+end
+return {ids, items}
+"""
+
+
+class RetryQueue:
+    """
+    Durable FIFO queue of delivery attempts stored in Redis.
+    Failed items are rescheduled with exponential backoff and jitter and end up
+    in a dead-letter list after max_tries or on a permanent error.
+    """
+
+    def __init__(
+        self,
+        redis,
+        name,
+        deliver,
+        *,
+        permanent_errors=(),
+        batch_size=50,
+        concurrency=10,
+        max_tries=10,
+        base_delay=2,
+        max_delay=600,
+        lease=60,
+        dead_limit=1000,
+    ):
+        self.redis = redis
+        self.name = name
+        self.deliver = deliver
+        self.permanent_errors = permanent_errors
+        self.batch_size = batch_size
+        self.max_tries = max_tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease = lease
+        self.dead_limit = dead_limit
+        self._concurrency = asyncio.Semaphore(concurrency)
+        self._schedule_key = f"{name}:schedule"
+        self._created_key = f"{name}:created"
+        self._items_key = f"{name}:items"
+        self._dead_key = f"{name}:dead"
+        self._claim = redis.register_script(CLAIM_SCRIPT)
+
+    async def put(self, kw: dict):
+        item_id = uuid.uuid4().hex
+        now = time.time()
+        item = {"kw": kw, "tries": 0, "created": now, "error": None}
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._items_key, item_id, json.dumps(item))
+            pipe.zadd(self._created_key, {item_id: now})
+            pipe.zadd(self._schedule_key, {item_id: now})
+            await pipe.execute()
+
+    def _backoff(self, tries) -> float:
+        delay = min(self.max_delay, self.base_delay * 2**tries)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _ack(self, item_id, dead_item=None):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(self._schedule_key, item_id)
+            pipe.zrem(self._created_key, item_id)
+            pipe.hdel(self._items_key, item_id)
+            if dead_item is not None:
+                pipe.lpush(self._dead_key, json.dumps(dead_item))
+                pipe.ltrim(self._dead_key, 0, self.dead_limit - 1)
+            await pipe.execute()
+
+    async def _retry(self, item_id, item):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._items_key, item_id, json.dumps(item))
+            pipe.zadd(self._schedule_key, {item_id: time.time() + self._backoff(item["tries"])})
+            await pipe.execute()
+
+    async def _process_item(self, item_id, raw):
+        if raw is None:
+            await self._ack(item_id)
+            return
+        item = json.loads(raw)
+        async with self._concurrency:
+            try:
+                await self.deliver(item["kw"])
+            except Exception as e:
+                item["tries"] += 1
+                item["error"] = repr(e)
+                metrics.inc(f"{self.name}.retries")
+                if isinstance(e, self.permanent_errors) or item["tries"] >= self.max_tries:
+                    logger.warning(f"{self.name}: item {item_id} moved to dead letters after {item['tries']} tries: {e}")
+                    metrics.inc(f"{self.name}.dead_lettered")
+                    await self._ack(item_id, dead_item=item)
+                else:
+                    await self._retry(item_id, item)
+            else:
+                metrics.inc(f"{self.name}.delivered")
+                await self._ack(item_id)
+
+    async def process(self):
+        while True:
+            now = time.time()
+            claimed = await self._claim(
+                keys=[self._schedule_key, self._items_key], args=[now, self.batch_size, now + self.lease]
+            )
+            if not claimed:
+                break
+            ids, items = claimed
+            await asyncio.gather(*(self._process_item(item_id.decode(), raw) for item_id, raw in zip(ids, items)))
+        await self._update_metrics()
+
+    async def _update_metrics(self):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zcard(self._schedule_key)
+            pipe.zrange(self._created_key, 0, 0, withscores=True)
+            pipe.llen(self._dead_key)
+            depth, oldest, dead = await pipe.execute()
+        metrics.set(f"{self.name}.depth", depth)
+        metrics.set(f"{self.name}.oldest_age_seconds", round(time.time() - oldest[0][1]) if oldest else 0)
+        metrics.set(f"{self.name}.dead", dead)
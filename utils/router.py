@@ -0,0 +1,216 @@
+import re
+from bisect import insort
+
+from aiogram import types
+from aiogram.dispatcher import Dispatcher
+from aiogram.dispatcher.filters import Command, Regexp, StateFilter, Text
+from aiogram.dispatcher.handler import CancelHandler, Handler, SkipHandler, _check_spec, ctx_data, current_handler
+
+_REGEX_SPECIAL = set(".^$*+?{}[]\\|()")
+_REGEX_QUANTIFIERS = set("*+?{")
+_NO_TARGET = object()
+
+
+def _has_top_level_branch(source) -> bool:
+    depth, escaped, in_class = 0, False, False
+    for char in source:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif in_class:
+            in_class = char != "]"
+        elif char == "[":
+            in_class = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            return True
+    return False
+
+
+def literal_prefix(pattern) -> str:
+    """
+    Return the text every string matched by an anchored, case-sensitive pattern starts with.
+    """
+    source = pattern.pattern
+    if pattern.flags & (re.IGNORECASE | re.MULTILINE) or not source.startswith("^") or _has_top_level_branch(source):
+        return ""
+    end = 1
+    while end < len(source) and source[end] not in _REGEX_SPECIAL:
+        end += 1
+    if end < len(source) and source[end] in _REGEX_QUANTIFIERS:
+        end -= 1
+    return source[1:end]
+
+
+def update_text(obj):
+    """
+    The string text filters look at: message text or caption, callback data.
+    """
+    if isinstance(obj, types.Message):
+        return obj.text or obj.caption or ""
+    if isinstance(obj, types.CallbackQuery):
+        return obj.data
+    return None
+
+
+class IndexedHandler(Handler):
+    """
+    Handler that looks candidates up by the user state and the update text instead of
+    checking every filter. For each state, Text, Regexp and Command filters are put into
+    exact, prefix and command tables once; handlers without such filters are always candidates.
+    Candidates are still checked by their filters in registration order, so routing works
+    exactly as in aiogram.
+    """
+
+    def __init__(self, dispatcher, once=True, middleware_key=None):
+        super().__init__(dispatcher, once=once, middleware_key=middleware_key)
+        self._indexes = {}
+
+    def register(self, handler, filters=None, index=None):
+        super().register(handler, filters, index)
+        self._indexes = {}
+
+    def unregister(self, handler):
+        self._indexes = {}
+        return super().unregister(handler)
+
+    @staticmethod
+    def _states(handler_obj):
+        for filter_obj in handler_obj.filters or ():
+            if isinstance(filter_obj.filter, StateFilter) and "*" not in filter_obj.filter.states:
+                return filter_obj.filter.states
+        return None
+
+    @staticmethod
+    def _routes(handler_obj):
+        """
+        Return (exact, prefixes, commands) of the first indexable filter or None.
+        """
+        for filter_obj in handler_obj.filters or ():
+            f = filter_obj.filter
+            if isinstance(f, Text) and not f.ignore_case:
+                if f.equals is not None:
+                    return [str(value) for value in f.equals], [], []
+                if f.startswith is not None:
+                    return [], [str(value) for value in f.startswith], []
+            elif isinstance(f, Regexp):
+                prefix = literal_prefix(f.regexp)
+                if prefix:
+                    return [], [prefix], []
+            elif isinstance(f, Command) and f.ignore_case and f.ignore_caption:
+                return [], [], [prefix + command for prefix in f.prefixes for command in f.commands]
+        return None
+
+    def _build_index(self, state):
+        exact, prefixes, commands, fallback = {}, {}, {}, []
+        for position, handler_obj in enumerate(self.handlers):
+            states = self._states(handler_obj)
+            if states is not None and state not in states:
+                continue
+            routes = self._routes(handler_obj)
+            if routes is None:
+                fallback.append(position)
+                continue
+            for value in routes[0]:
+                exact.setdefault(value, []).append(position)
+            for value in routes[1]:
+                prefixes.setdefault(len(value), {}).setdefault(value, []).append(position)
+            for value in routes[2]:
+                commands.setdefault(value, []).append(position)
+        index = self._indexes[state] = exact, sorted(prefixes.items()), commands, fallback
+        return index
+
+    async def _get_state(self, obj):
+        """
+        Load the user state the same way StateFilter does and share it with the filters.
+        """
+        try:
+            return StateFilter.ctx_state.get()
+        except LookupError:
+            chat, user = StateFilter.get_target(None, obj)
+            if not (chat or user):
+                return _NO_TARGET
+            state = await self.dispatcher.storage.get_state(chat=chat, user=user)
+            StateFilter.ctx_state.set(state)
+            return state
+
+    async def candidates(self, obj) -> list:
+        state = await self._get_state(obj)
+        index = self._indexes.get(state)
+        exact, prefixes, commands, fallback = index or self._build_index(state)
+        text = update_text(obj)
+        if text is None:
+            return [self.handlers[position] for position in fallback]
+        positions = list(fallback)
+        matched = list(exact.get(text, ()))
+        if text:
+            command = text.split(maxsplit=1)[0].partition("@")[0].lower()
+            matched.extend(commands.get(command, ()))
+        for length, table in prefixes:
+            if length > len(text):
+                break
+            matched.extend(table.get(text[:length], ()))
+        for position in matched:
+            insort(positions, position)
+        return [self.handlers[position] for position in dict.fromkeys(positions)]
+
+    async def notify(self, *args):
+        """
+        Same as Handler.notify, but only the indexed candidates are checked.
+        """
+        from aiogram.dispatcher.filters import FilterNotPassed, check_filters
+
+        results = []
+
+        data = {}
+        ctx_data.set(data)
+
+        if self.middleware_key:
+            try:
+                await self.dispatcher.middleware.trigger(f"pre_process_{self.middleware_key}", args + (data,))
+            except CancelHandler:
+                return results
+
+        try:
+            for handler_obj in await self.candidates(args[0]):
+                try:
+                    data.update(await check_filters(handler_obj.filters, args))
+                except FilterNotPassed:
+                    continue
+                else:
+                    ctx_token = current_handler.set(handler_obj.handler)
+                    try:
+                        if self.middleware_key:
+                            await self.dispatcher.middleware.trigger(f"process_{self.middleware_key}", args + (data,))
+                        partial_data = _check_spec(handler_obj.spec, data)
+                        response = await handler_obj.handler(*args, **partial_data)
+                        if response is not None:
+                            results.append(response)
+                        if self.once:
+                            break
+                    except SkipHandler:
+                        continue
+                    except CancelHandler:
+                        break
+                    finally:
+                        current_handler.reset(ctx_token)
+        finally:
+            if self.middleware_key:
+                await self.dispatcher.middleware.trigger(f"post_process_{self.middleware_key}", args + (results, data))
+
+        return results
+
+
+class RoutingDispatcher(Dispatcher):
+    """
+    Dispatcher whose message and callback query handlers are routed through IndexedHandler.
+    """
+
+    def _setup_filters(self):
+        self.message_handlers = IndexedHandler(self, middleware_key="message")
+        self.callback_query_handlers = IndexedHandler(self, middleware_key="callback_query")
+        super()._setup_filters()
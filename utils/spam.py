@@ -0,0 +1,88 @@
+import time
+import uuid
+
+from utils.metrics import metrics
+
+# Records a blocked message in the user's window; at the threshold bans the user and claims the alert.
+# Returns {count in window, 1 if this call banned the user, 1 if this call should send the alert}.
+RECORD_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local threshold = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+redis.call('ZADD', KEYS[1], now, ARGV[4])
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -threshold - 1)
+redis.call('PEXPIRE', KEYS[1], window)
+local count = redis.call('ZCARD', KEYS[1])
+if count < threshold then
+    return {count, 0, 0}
+end
+local banned = 0
+if redis.call('EXISTS', KEYS[3]) == 0 then
+    if tonumber(ARGV[7]) > 0 then
+        redis.call('SET', KEYS[3], '1', 'PX', ARGV[7])
+    else
+        redis.call('SET', KEYS[3], '1')
+    end
+    redis.call('PUBLISH', ARGV[8], ARGV[5])
+    banned = 1
+end
+local alert = redis.call('SET', KEYS[2], '1', 'NX', 'PX', ARGV[6]) and 1 or 0
+return {count, banned, alert}
+"""
+
+
+class SpamDetector:
+    """
+    Counts the messages a user sent that were throttled, in a sliding window shared by all replicas.
+    A user reaching `threshold` throttled messages within `window` seconds is banned through the
+    is_baned_ flag for `ban_ttl` seconds (0 is forever), and one alert is claimed per `alert_cooldown`.
+    Each window keeps at most `threshold` entries and expires with the user's last message.
+    """
+
+    def __init__(self, redis, prefix, ban_flags, *, window=60, threshold=50, ban_ttl=86400, alert_cooldown=3600):
+        self.redis = redis
+        self.prefix = prefix
+        self.ban_flags = ban_flags
+        self.window = window
+        self.threshold = threshold
+        self.ban_ttl = ban_ttl
+        self.alert_cooldown = alert_cooldown
+        self._record = redis.register_script(RECORD_SCRIPT)
+        self.recorded = 0
+        self.bans = 0
+        self.alerts = 0
+        metrics.register("spam", self.stats)
+
+    def stats(self) -> dict:
+        return {"recorded": self.recorded, "bans": self.bans, "alerts": self.alerts}
+
+    async def record(self, telegram_id) -> tuple:
+        """
+        Record a throttled message; return (banned now, alert to send).
+        """
+        now = int(time.time() * 1000)
+        _, banned, alert = await self._record(
+            keys=[
+                f"{self.prefix}:window:{telegram_id}",
+                f"{self.prefix}:alert:{telegram_id}",
+                self.ban_flags.key(telegram_id),
+            ],
+            args=[
+                now,
+                self.window * 1000,
+                self.threshold,
+                f"{now}:{uuid.uuid4().hex[:8]}",
+                telegram_id,
+                self.alert_cooldown * 1000,
+                self.ban_ttl * 1000,
+                self.ban_flags.channel,
+            ],
+        )
+        self.recorded += 1
+        if banned:
+            self.bans += 1
+            self.ban_flags.invalidate(telegram_id)
+        if alert:
+            self.alerts += 1
+        return bool(banned), bool(alert)
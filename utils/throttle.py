@@ -0,0 +1,97 @@
+import time
+from collections import OrderedDict
+
+from aiogram.dispatcher.storage import DELTA, EXCEEDED_COUNT, LAST_CALL, RATE_LIMIT, RESULT
+from aiogram.utils.exceptions import Throttled
+
+from utils.metrics import metrics
+
+# One token bucket holding one token; returns {allowed, exceeded count, seconds since the previous call}
+THROTTLE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated', 'exceeded')
+local updated = tonumber(state[2]) or now
+local tokens = math.min(1, (tonumber(state[1]) or 1) + (now - updated) / rate)
+local exceeded = tonumber(state[3]) or 0
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    exceeded = 0
+    allowed = 1
+else
+    exceeded = exceeded + 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now, 'exceeded', exceeded)
+redis.call('PEXPIRE', KEYS[1], math.ceil(rate * 1000))
+return {allowed, exceeded, tostring(now - updated)}
+"""
+
+
+class Throttler:
+    """
+    Replacement for Dispatcher.throttle: one call per `rate` seconds for each (chat, user, key),
+    kept as a token bucket holding a single token. Buckets live in process memory, in an LRU dict
+    of at most `max_size` entries; a bucket untouched for `rate` seconds is full again, so evicting it
+    changes nothing. With `redis` set the buckets are kept there and checked with one script call
+    instead, for replicas that share the updates of one bot.
+    """
+
+    def __init__(self, *, redis=None, prefix="throttle", max_size=100_000):
+        self.redis = redis
+        self.prefix = prefix
+        self.max_size = max_size
+        self._buckets = OrderedDict()
+        self._script = redis.register_script(THROTTLE_SCRIPT) if redis is not None else None
+        self.allowed = 0
+        self.throttled = 0
+        metrics.register("throttle", self.stats)
+
+    def stats(self) -> dict:
+        return {"allowed": self.allowed, "throttled": self.throttled, "buckets": len(self._buckets)}
+
+    def _take_local(self, bucket_key, rate) -> tuple:
+        now = time.monotonic()
+        bucket = self._buckets.pop(bucket_key, None)
+        if bucket is None:
+            tokens, updated, exceeded = 1, now, 0
+        else:
+            tokens, updated, exceeded = bucket
+            tokens = min(1, tokens + (now - updated) / rate)
+        if tokens >= 1:
+            tokens -= 1
+            exceeded = 0
+        else:
+            exceeded += 1
+        self._buckets[bucket_key] = (tokens, now, exceeded)
+        if len(self._buckets) > self.max_size:
+            self._buckets.popitem(last=False)
+        return not exceeded, exceeded, now - updated
+
+    async def _take_redis(self, bucket_key, rate) -> tuple:
+        allowed, exceeded, delta = await self._script(
+            keys=[f"{self.prefix}:{':'.join(map(str, bucket_key))}"], args=[time.time(), rate]
+        )
+        return bool(allowed), exceeded, float(delta)
+
+    async def throttle(self, key, *, rate, user_id=None, chat_id=None) -> bool:
+        """
+        Take the call from the bucket or raise Throttled, with the same details Dispatcher.throttle gives.
+        """
+        if rate <= 0:
+            return True
+        bucket_key = (chat_id, user_id, key)
+        if self._script is None:
+            allowed, exceeded, delta = self._take_local(bucket_key, rate)
+        else:
+            allowed, exceeded, delta = await self._take_redis(bucket_key, rate)
+        if allowed:
+            self.allowed += 1
+            return True
+        self.throttled += 1
+        raise Throttled(
+            key=key,
+            chat=chat_id,
+            user=user_id,
+            **{RESULT: False, RATE_LIMIT: rate, LAST_CALL: time.time(), DELTA: delta, EXCEEDED_COUNT: exceeded},
+        )
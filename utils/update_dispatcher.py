@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+from utils.logger import logger
+from utils.metrics import metrics
+
+
+class UpdateDispatcher:
+    """
+    Runs update jobs concurrently on a bounded number of workers.
+    Jobs sharing any ordering key run strictly in submission order.
+    """
+
+    def __init__(self, workers, name="updates"):
+        self.name = name
+        self.workers = workers
+        self._semaphore = asyncio.Semaphore(workers)
+        self._tails = {}
+        self._pending = 0
+        metrics.register(name, self.stats)
+
+    def stats(self) -> dict:
+        return {"backlog": self._pending, "workers": self.workers, "ordering_keys": len(self._tails)}
+
+    def submit(self, keys, job, *args) -> asyncio.Task:
+        previous = {self._tails[key] for key in keys if key in self._tails}
+        task = asyncio.create_task(self._run(previous, job, args))
+        for key in keys:
+            self._tails[key] = task
+        self._pending += 1
+        task.add_done_callback(lambda t: self._release(keys, t))
+        return task
+
+    async def _run(self, previous, job, args):
+        if previous:
+            await asyncio.wait(previous)
+        async with self._semaphore:
+            try:
+                return await job(*args)
+            except Exception as e:
+                logger.exception(f"{self.name} job {job.__name__} failure: {e}")
+
+    def _release(self, keys, task):
+        self._pending -= 1
+        for key in keys:
+            if self._tails.get(key) is task:
+                del self._tails[key]
+
+    async def run(self, jobs):
+        """
+        Submit (keys, job, *args) tuples and wait until all of them are done.
+        """
+        if not jobs:
+            return
+        started = time.monotonic()
+        tasks = [self.submit(keys, job, *args) for keys, job, *args in jobs]
+        backlog = self._pending
+        await asyncio.wait(tasks)
+        elapsed = time.monotonic() - started
+        throughput = round(len(tasks) / elapsed, 2) if elapsed else len(tasks)
+        metrics.set(f"{self.name}.last_batch_size", len(tasks))
+        metrics.set(f"{self.name}.last_batch_seconds", round(elapsed, 3))
+        metrics.set(f"{self.name}.last_batch_throughput", throughput)
+        metrics.inc(f"{self.name}.processed", len(tasks))
+        logger.info(f"{self.name}: {len(tasks)} processed in {elapsed:.2f}s ({throughput}/s), backlog was {backlog}")
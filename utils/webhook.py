@@ -0,0 +1,122 @@
+import asyncio
+import hmac
+
+from aiogram import Bot, types
+from aiogram.dispatcher import Dispatcher
+from aiohttp import web
+
+from utils.logger import logger
+from utils.metrics import metrics
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Receives updates from Telegram over HTTP instead of long polling.
+    An update is acknowledged as soon as it is queued and processed by a fixed number of workers,
+    so a slow handler never holds the request. When the queue is full Telegram gets 503 and redelivers later.
+    Each update runs in a copy of the worker's context, as with polling, so the current chat and user
+    of one update never leak into the next. FSM state lives in the shared Redis storage, but handler
+    throttling is kept per process unless THROTTLE_BACKEND=redis, which is needed when several replicas
+    serve one token.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, *, path, secret, concurrency, max_pending):
+        self.dispatcher = dispatcher
+        self.path = path
+        self.secret = secret
+        self.concurrency = concurrency
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        self._workers = []
+        self.received = 0
+        self.rejected = 0
+        self.overflowed = 0
+        self.processed = 0
+        self.failed = 0
+        metrics.register("webhook", self.stats)
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "rejected": self.rejected,
+            "overflowed": self.overflowed,
+            "processed": self.processed,
+            "failed": self.failed,
+            "pending": self._queue.qsize(),
+        }
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            self.rejected += 1
+            return web.Response(status=401)
+        try:
+            update = types.Update(**await request.json())
+        except Exception as e:
+            logger.warning(f"Malformed webhook update: {e}")
+            return web.Response(status=400)
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.overflowed += 1
+            return web.Response(status=503)
+        self.received += 1
+        return web.Response()
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    async def _work(self):
+        while True:
+            update = await self._queue.get()
+            try:
+                await asyncio.create_task(self.dispatcher.process_update(update))
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.exception(f"Webhook update {update.update_id} failure: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def start(self, url=None):
+        """
+        Start the workers and, when `url` is given, point the bot's webhook at it.
+        """
+        Bot.set_current(self.dispatcher.bot)
+        Dispatcher.set_current(self.dispatcher)
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        if url is not None:
+            await self.dispatcher.bot.set_webhook(url, secret_token=self.secret or None, max_connections=100)
+            logger.info(f"Webhook set to {url}")
+
+    async def stop(self, timeout=10):
+        """
+        Let the queued updates finish, up to `timeout` seconds, then stop the workers.
+        """
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self._queue.qsize()} webhook updates dropped on shutdown")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    def run(self, *, host, port, url=None, loop=None, on_startup=None, on_shutdown=None):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        app.router.add_get("/healthz", self.health)
+
+        async def startup(_):
+            if on_startup is not None:
+                await on_startup(self.dispatcher)
+            await self.start(url)
+
+        async def shutdown(_):
+            await self.stop()
+            if on_shutdown is not None:
+                await on_shutdown(self.dispatcher)
+            await (await self.dispatcher.bot.get_session()).close()
+
+        app.on_startup.append(startup)
+        app.on_shutdown.append(shutdown)
+        web.run_app(app, host=host, port=port, loop=loop, access_log=None, print=logger.info)